@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# compare how many concurrent tool connections one server process can handle.
+# start the servers you want to compare with a single worker process each, e.g.
+#
+#   gunicorn -w 1 --threads 8 -b :8001 labelous.wsgi:application
+#   uvicorn --workers 1 --port 8002 labelous.asgi:application
+#
+# (the second with L_ASYNC_VIEWS = True in the settings.) then run
+#
+#   python bench/concurrency.py --user u --password p --image 1 \
+#       --target wsgi=http://localhost:8001 --target asgi=http://localhost:8002
+#
+# each target is hit with increasing numbers of simultaneous clients, each
+# holding its own keep-alive connection and cycling through the endpoints the
+# tool hits when it opens an image. for each level we report throughput and
+# latency, then the largest level whose p99 latency stayed under --slo-ms.
+
+import argparse
+import threading
+import time
+
+from lm_client import LabelousClient, latency_summary
+
+def client_loop(base_url, args, stop, latencies, errors):
+    client = LabelousClient(base_url)
+    client.login(args.user, args.password)
+    paths = [
+        "/label/Annotations/f/img{}.xml".format(args.image),
+        "/label/Images/f/img{}.jpg".format(args.image),
+        "/label/annotationTools/perl/fetch_image.cgi?image=img{}.jpg".format(
+            args.image),
+    ]
+    i = 0
+    while not stop.is_set():
+        try:
+            status, _, _, elapsed = client.get(paths[i % len(paths)])
+            if status != 200:
+                errors.append(status)
+            else:
+                latencies.append(elapsed)
+        except Exception as e:
+            errors.append(repr(e))
+            client.close()
+        i += 1
+    client.close()
+
+def run_level(base_url, args, clients):
+    stop = threading.Event()
+    latencies = []
+    errors = []
+    threads = [threading.Thread(target=client_loop,
+            args=(base_url, args, stop, latencies, errors))
+        for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    # give everybody a moment to log in before we start counting
+    time.sleep(1)
+    del latencies[:]
+    del errors[:]
+    time.sleep(args.duration)
+    completed = len(latencies)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    result = latency_summary(latencies[:completed])
+    result["clients"] = clients
+    result["requests_per_s"] = completed/args.duration
+    result["errors"] = len(errors)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="compare concurrent connections per server process")
+    parser.add_argument("--target", action="append", required=True,
+        help="name=base_url of a server to test. may be repeated.")
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--image", type=int, required=True,
+        help="ID of an image the user has an annotation for")
+    parser.add_argument("--levels", default="1,2,4,8,16,32,64,128",
+        help="comma separated numbers of concurrent clients to try")
+    parser.add_argument("--duration", type=float, default=10,
+        help="seconds to measure each level for")
+    parser.add_argument("--slo-ms", type=float, default=500,
+        help="p99 latency a level must stay under to count as handled")
+    args = parser.parse_args()
+
+    levels = [int(l) for l in args.levels.split(",")]
+    for target in args.target:
+        name, base_url = target.split("=", 1)
+        print("== {} ({})".format(name, base_url))
+        print("{:>8} {:>10} {:>9} {:>9} {:>7}".format(
+            "clients", "req/s", "p50 ms", "p99 ms", "errors"))
+        handled = 0
+        for clients in levels:
+            result = run_level(base_url, args, clients)
+            print("{:>8} {:>10.1f} {:>9.1f} {:>9.1f} {:>7}".format(clients,
+                result["requests_per_s"], result.get("p50_ms", 0),
+                result.get("p99_ms", 0), result["errors"]))
+            if result["errors"] == 0 and result.get("p99_ms", 0) < args.slo_ms:
+                handled = clients
+        print("handled {} concurrent connections within a {:.0f}ms p99".format(
+            handled, args.slo_ms))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# a tiny HTTP client that talks to a running labelous server the way a logged in
+# browser running the tool would. only uses the standard library so the
+# benchmarks can run anywhere.
+
+import http.client
+import http.cookies
+import re
+import time
+import urllib.parse
+
+class LabelousClient:
+    # base_url is something like http://localhost:8000
+    def __init__(self, base_url):
+        url = urllib.parse.urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.cookies = {}
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port,
+                timeout=60)
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    # make a request over our persistent connection. returns the status,
+    # response headers, body, and how long it took in seconds.
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers["Cookie"] = "; ".join(
+                "{}={}".format(k, v) for k, v in self.cookies.items())
+        start = time.perf_counter()
+        try:
+            conn = self._connect()
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        except (http.client.HTTPException, OSError):
+            # the server may have closed our keep-alive connection. try once
+            # more with a fresh one.
+            self.close()
+            conn = self._connect()
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        elapsed = time.perf_counter() - start
+
+        for header in resp.headers.get_all("Set-Cookie") or []:
+            cookie = http.cookies.SimpleCookie(header)
+            for name, morsel in cookie.items():
+                self.cookies[name] = morsel.value
+        if resp.getheader("Connection", "").lower() == "close":
+            self.close()
+        return resp.status, resp.headers, data, elapsed
+
+    def get(self, path, headers=None):
+        return self.request("GET", path, headers=headers)
+
+    def post(self, path, body, content_type, headers=None):
+        headers = dict(headers or {})
+        headers["Content-Type"] = content_type
+        return self.request("POST", path, body=body, headers=headers)
+
+    # log in through the normal login form so we get a real session
+    def login(self, username, password):
+        status, _, page, _ = self.get("/accounts/login/")
+        match = re.search(rb'name="csrfmiddlewaretoken" value="([^"]+)"', page)
+        if status != 200 or match is None:
+            raise Exception("couldn't load login page")
+        form = urllib.parse.urlencode({
+            "username": username,
+            "password": password,
+            "csrfmiddlewaretoken": match.group(1).decode("ascii"),
+            "next": "/",
+        })
+        status, _, _, _ = self.post("/accounts/login/", form,
+            "application/x-www-form-urlencoded")
+        if status != 302 or "sessionid" not in self.cookies:
+            raise Exception("login failed for {}".format(username))
+
+# summarize a list of latencies (in seconds) as milliseconds
+def latency_summary(latencies):
+    if len(latencies) == 0:
+        return {"count": 0}
+    latencies = sorted(latencies)
+    def pct(p):
+        return 1000*latencies[min(len(latencies)-1, int(p*len(latencies)))]
+    return {
+        "count": len(latencies),
+        "mean_ms": 1000*sum(latencies)/len(latencies),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": 1000*latencies[-1],
+    }
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# replay realistic LabelMe tool sessions against a running labelous server.
+# each simulated annotator logs in and then repeats what the tool does:
+#
+#   1. load tool.xhtml and all the assets it references
+#   2. GET the annotation document and the image
+#   3. draw a few new polygons, POSTing the full document to submit.cgi after
+#      every added vertex, just like the tool does
+#   4. ask fetch_image.cgi (or fetch_prev_image.cgi) for the next image and
+#      go back to 2
+#
+# run the server against a local Postgres with L_QUERY_COUNT_HEADER = True so
+# query counts are reported too. annotators log in as <prefix><n> for n in
+# 0..N-1, which is what the generate_dataset command creates. e.g.
+#
+#   python bench/loadtest.py --url http://localhost:8000 --annotators 20 \
+#       --user-prefix synth_user_ --password synth --duration 60 \
+#       --out results/baseline.json
+#
+# add --json to use the JSON annotation document (see
+# label_app/json_format.py) instead of XML.
+#
+# afterwards the results can be compared with an earlier run:
+#
+#   python bench/loadtest.py ... --out results/new.json \
+#       --compare results/baseline.json
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+from lm_client import LabelousClient, latency_summary
+
+# every request is recorded under one of these names
+ENDPOINTS = ("tool", "asset", "annotation_xml", "image", "submit", "next",
+    "prev")
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.recording = False
+        self.latencies = {e: [] for e in ENDPOINTS}
+        self.queries = {e: [] for e in ENDPOINTS}
+        self.errors = {e: 0 for e in ENDPOINTS}
+
+    def record(self, endpoint, status, headers, elapsed):
+        if not self.recording:
+            return
+        with self.lock:
+            if status >= 400:
+                self.errors[endpoint] += 1
+                return
+            self.latencies[endpoint].append(elapsed)
+            queries = headers.get("X-Labelous-Queries")
+            if queries is not None:
+                self.queries[endpoint].append(int(queries))
+
+    def summary(self, duration):
+        out = {}
+        for endpoint in ENDPOINTS:
+            result = latency_summary(self.latencies[endpoint])
+            result["requests_per_s"] = result["count"]/duration
+            result["errors"] = self.errors[endpoint]
+            queries = self.queries[endpoint]
+            if len(queries) > 0:
+                result["queries_mean"] = sum(queries)/len(queries)
+                result["queries_max"] = max(queries)
+            out[endpoint] = result
+        return out
+
+class Annotator:
+    def __init__(self, args, number, recorder, stop):
+        self.args = args
+        self.client = LabelousClient(args.url)
+        self.username = "{}{}".format(args.user_prefix, number)
+        self.recorder = recorder
+        self.stop = stop
+        self.random = random.Random(args.seed+number)
+
+    def request(self, endpoint, method, path, body=None, headers=None):
+        if method == "GET":
+            status, headers, data, elapsed = self.client.get(path, headers)
+        else:
+            status, headers, data, elapsed = self.client.post(path, body,
+                "application/json" if self.args.json else "text/xml")
+        self.recorder.record(endpoint, status, headers, elapsed)
+        if self.args.think_ms > 0:
+            time.sleep(self.random.expovariate(1000/self.args.think_ms))
+        return status, data
+
+    def load_tool(self):
+        _, page = self.request("tool", "GET", "/label/")
+        # pull out everything the page loads from our server
+        assets = set(re.findall(
+            rb'(?:src|href)="((?:annotationTools|Icons)/[^"?#]+)"', page))
+        for asset in sorted(assets):
+            self.request("asset", "GET", "/label/"+asset.decode("utf8"))
+
+    # draw new polygons on the current document, posting after each vertex
+    def edit(self, doc):
+        root = ET.fromstring(doc)
+        for _ in range(self.args.polygons_per_image):
+            obj = ET.SubElement(root, "object")
+            ET.SubElement(obj, "name").text = self.random.choice(
+                ("car", "person", "tree", "building", "sign"))
+            ET.SubElement(obj, "deleted").text = "0"
+            ET.SubElement(obj, "verified").text = "0"
+            ET.SubElement(obj, "occluded").text = "no"
+            ET.SubElement(obj, "attributes")
+            polygon = ET.SubElement(obj, "polygon")
+            ET.SubElement(polygon, "username").text = "hi"
+            cx = self.random.uniform(100, 900)
+            cy = self.random.uniform(100, 700)
+            vertices = self.random.randint(3, self.args.max_vertices)
+            for v in range(vertices):
+                pt = ET.SubElement(polygon, "pt")
+                ET.SubElement(pt, "x").text = "{:.2f}".format(
+                    cx + self.random.uniform(-80, 80))
+                ET.SubElement(pt, "y").text = "{:.2f}".format(
+                    cy + self.random.uniform(-80, 80))
+                # the tool only submits once the polygon is closed, then
+                # again for every later edit
+                if v >= 2:
+                    self.request("submit", "POST",
+                        "/label/annotationTools/perl/submit.cgi",
+                        ET.tostring(root))
+                if self.stop.is_set():
+                    return
+
+    # the same, but with the JSON document
+    def edit_json(self, doc):
+        doc = json.loads(doc)
+        objects = doc["objects"]
+        objects["deleted"] = [0]*len(objects.pop("verified"))
+        for _ in range(self.args.polygons_per_image):
+            objects["id"].append(None)
+            objects["name"].append(self.random.choice(
+                ("car", "person", "tree", "building", "sign")))
+            objects["deleted"].append(0)
+            objects["occluded"].append(0)
+            objects["attributes"].append("")
+            objects["counts"].append(0)
+            cx = self.random.uniform(100, 900)
+            cy = self.random.uniform(100, 700)
+            vertices = self.random.randint(3, self.args.max_vertices)
+            for v in range(vertices):
+                objects["points"].append(
+                    round(cx + self.random.uniform(-80, 80), 2))
+                objects["points"].append(
+                    round(cy + self.random.uniform(-80, 80), 2))
+                objects["counts"][-1] += 1
+                if v >= 2:
+                    self.request("submit", "POST",
+                        "/label/annotationTools/perl/submit.cgi",
+                        json.dumps(doc).encode("utf8"))
+                if self.stop.is_set():
+                    return
+
+    def run(self):
+        self.client.login(self.username, self.args.password)
+        self.load_tool()
+        # img0 never exists, so this wraps around to the first annotation
+        image_id = 0
+        direction = "next"
+        while not self.stop.is_set():
+            if direction == "next":
+                path = "/label/annotationTools/perl/fetch_image.cgi"
+            else:
+                path = "/label/annotationTools/perl/fetch_prev_image.cgi"
+            status, data = self.request(direction, "GET",
+                "{}?image=img{}.jpg".format(path, image_id))
+            if status != 200:
+                # the user has no annotations at all
+                return
+            image_id = int(re.search(rb"<file>img([0-9]+)\.jpg</file>",
+                data).group(1))
+
+            status, doc = self.request("annotation_xml", "GET",
+                "/label/Annotations/f/img{}.xml".format(image_id),
+                headers={"Accept": "application/json"} if self.args.json
+                    else None)
+            self.request("image", "GET",
+                "/label/Images/f/img{}.jpg".format(image_id))
+            if status == 200 and self.args.json:
+                self.edit_json(doc)
+            elif status == 200:
+                self.edit(doc)
+
+            # annotators mostly move forward, but sometimes go back
+            direction = "prev" if self.random.random() < 0.2 else "next"
+
+def print_summary(summary, baseline=None):
+    print("{:>15} {:>9} {:>8} {:>8} {:>8} {:>8} {:>6}".format("endpoint",
+        "req/s", "p50 ms", "p95 ms", "p99 ms", "queries", "errors"))
+    for endpoint, result in summary.items():
+        if result["count"] == 0 and result["errors"] == 0:
+            continue
+        print("{:>15} {:>9.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8} {:>6}".format(
+            endpoint, result["requests_per_s"], result.get("p50_ms", 0),
+            result.get("p95_ms", 0), result.get("p99_ms", 0),
+            "{:.1f}".format(result["queries_mean"])
+                if "queries_mean" in result else "-",
+            result["errors"]))
+        if baseline is not None and endpoint in baseline:
+            old = baseline[endpoint]
+            def change(key):
+                if not old.get(key) or key not in result:
+                    return "-"
+                return "{:+.0f}%".format(100*(result[key]/old[key] - 1))
+            print("{:>15} {:>9} {:>8} {:>8} {:>8} {:>8}".format("vs baseline",
+                change("requests_per_s"), change("p50_ms"), change("p95_ms"),
+                change("p99_ms"), change("queries_mean")))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="replay LabelMe tool sessions against a labelous server")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--annotators", type=int, default=10)
+    parser.add_argument("--user-prefix", default="synth_user_")
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--duration", type=float, default=60,
+        help="seconds to measure for, after the warmup")
+    parser.add_argument("--warmup", type=float, default=5,
+        help="seconds to run before measuring")
+    parser.add_argument("--think-ms", type=float, default=0,
+        help="mean pause between an annotator's requests")
+    parser.add_argument("--polygons-per-image", type=int, default=3)
+    parser.add_argument("--max-vertices", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true",
+        help="use the JSON annotation document instead of XML")
+    parser.add_argument("--out", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    args = parser.parse_args()
+
+    recorder = Recorder()
+    stop = threading.Event()
+    annotators = [Annotator(args, n, recorder, stop)
+        for n in range(args.annotators)]
+    threads = [threading.Thread(target=a.run, daemon=True) for a in annotators]
+    for thread in threads:
+        thread.start()
+
+    time.sleep(args.warmup)
+    recorder.recording = True
+    time.sleep(args.duration)
+    recorder.recording = False
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    summary = recorder.summary(args.duration)
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)["endpoints"]
+    print_summary(summary, baseline)
+
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump({
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "args": vars(args),
+                "endpoints": summary,
+            }, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/bin/sh
+# set up a local postgres primary with a streaming read replica, to try out
+# L_READ_REPLICAS. both are created from scratch under $DIR and run as the
+# current user. the primary gets the role and database from settings.py.
+#
+#   sh bench/local_replica.sh [DIR]
+#
+# then add the replica to settings.py:
+#
+#   DATABASES['replica1'] = dict(DATABASES['default'], PORT=5433)
+#   L_READ_REPLICAS = ['replica1']
+#
+# and run the migrations as usual. stop everything with
+#
+#   pg_ctl -D DIR/primary stop; pg_ctl -D DIR/replica stop
+
+set -e
+
+DIR=${1:-./pg_local}
+PRIMARY_PORT=${PRIMARY_PORT:-5432}
+REPLICA_PORT=${REPLICA_PORT:-5433}
+# simulate replication lag, to see that users still read their own writes
+REPLICA_DELAY=${REPLICA_DELAY:-0}
+
+mkdir -p "$DIR"
+initdb -D "$DIR/primary" -A trust >/dev/null
+cat >> "$DIR/primary/postgresql.conf" <<EOF
+port = $PRIMARY_PORT
+wal_level = replica
+max_wal_senders = 4
+EOF
+echo "host replication all 127.0.0.1/32 trust" >> "$DIR/primary/pg_hba.conf"
+pg_ctl -D "$DIR/primary" -l "$DIR/primary.log" -w start
+
+psql -h localhost -p "$PRIMARY_PORT" -d postgres -v ON_ERROR_STOP=1 <<EOF
+CREATE ROLE labelous_login LOGIN PASSWORD 'hello';
+CREATE DATABASE labelous OWNER labelous_login;
+EOF
+
+# copy the primary and start it up as a hot standby that follows it
+pg_basebackup -h localhost -p "$PRIMARY_PORT" -D "$DIR/replica" -R -X stream
+cat >> "$DIR/replica/postgresql.conf" <<EOF
+port = $REPLICA_PORT
+hot_standby = on
+recovery_min_apply_delay = '${REPLICA_DELAY}s'
+EOF
+pg_ctl -D "$DIR/replica" -l "$DIR/replica.log" -w start
+
+echo "primary on port $PRIMARY_PORT, replica on port $REPLICA_PORT"
@@ -1,7 +1,18 @@
 from django.contrib import admin
+from django.db import transaction
 
 from .models import Image
+import label_app.models
 class ImageAdmin(admin.ModelAdmin):
     readonly_fields = ('upload_time',)
 
+    # the annotations keep a copy of the priority for the review queue (see
+    # label_app/review_views.py)
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and "priority" in form.changed_data:
+            label_app.models.Annotation.objects.filter(image=obj).update(
+                priority=obj.priority)
+
 admin.site.register(Image, ImageAdmin)
@@ -0,0 +1,71 @@
+# async versions of the image views, used when L_ASYNC_VIEWS is on and we are
+# running under an ASGI server. they need Django 4.2 or newer for the async ORM
+# and async streaming responses.
+
+from django.http import StreamingHttpResponse, Http404
+from django.contrib.auth.views import redirect_to_login
+from asgiref.sync import sync_to_async
+
+import asyncio
+import functools
+
+from . import models
+from . import transcode
+from labelous import db_router
+from label_app import prefetch
+
+# how much of an image file we read at once while streaming it
+CHUNK_SIZE = 64*1024
+
+# async equivalent of django's login_required. request.user is loaded lazily
+# with sync database calls, so we have to force it from a thread before the
+# async view touches it.
+def async_login_required(view):
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        is_authenticated = await sync_to_async(
+            lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+# yield the contents of the file in chunks without blocking the event loop
+# while the disk is read
+async def stream_file(path):
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        while True:
+            chunk = await asyncio.to_thread(f.read, CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
+
+# serve images to the labeler
+@async_login_required
+@db_router.replica_reads
+async def image_file(request, image_id):
+    # regex only allows numbers through
+    image_id = int(image_id)
+
+    try:
+        image = await models.Image.objects.aget(pk=image_id)
+    except models.Image.DoesNotExist:
+        image = None
+
+    if image is None or not image.visible:
+        raise Http404("Image does not exist.")
+
+    # this might have to transcode the image, which is slow
+    path, content_type = await asyncio.to_thread(transcode.negotiate, image,
+        request.META.get("HTTP_ACCEPT", ""))
+    size = (await asyncio.to_thread(path.stat)).st_size
+    resp = StreamingHttpResponse(stream_file(path), content_type=content_type)
+    resp["Content-Length"] = size
+    resp["Vary"] = "Accept"
+    # this asks the cache whether the image was just warmed, so it can block
+    await asyncio.to_thread(prefetch.warm, request.user.pk, image_id,
+        request.META.get("HTTP_ACCEPT", ""))
+    return resp
@@ -0,0 +1,42 @@
+# sign URLs so they can be served without looking up the user's session. a
+# signed URL proves that we handed it out to a logged in user recently, so the
+# view serving it only has to check the signature, which needs no database
+# access at all.
+
+from django.conf import settings
+from django.utils.crypto import salted_hmac, constant_time_compare
+from django.core.exceptions import PermissionDenied
+
+import time
+
+_SALT = "labelous.image_mgr.signing"
+
+def _signature(path, expires):
+    return salted_hmac(_SALT, "{}:{}".format(path, expires),
+        algorithm="sha256").hexdigest()[:32]
+
+# return the path with a signature attached that is valid for at least
+# L_SIGNED_URL_LIFETIME seconds. the expiry is rounded to a multiple of the
+# lifetime so the same URL is handed out for a while, letting browsers and any
+# proxy in front of us actually cache what it points to.
+def sign_path(path):
+    lifetime = settings.L_SIGNED_URL_LIFETIME
+    expires = (int(time.time())//lifetime + 2)*lifetime
+    return "{}?e={}&s={}".format(path, expires, _signature(path, expires))
+
+# make sure the request has a valid, unexpired signature for its path. returns
+# the number of seconds until it expires.
+def check_signature(request):
+    try:
+        expires = int(request.GET["e"])
+        signature = request.GET["s"]
+    except (KeyError, ValueError) as e:
+        raise PermissionDenied("missing signature") from e
+
+    remaining = expires - int(time.time())
+    if remaining <= 0:
+        raise PermissionDenied("signature expired")
+    if not constant_time_compare(signature,
+            _signature(request.path, expires)):
+        raise PermissionDenied("bad signature")
+    return remaining
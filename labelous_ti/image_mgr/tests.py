@@ -1,3 +1,96 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, override_settings
 
-# Create your tests here.
+import pathlib
+import random
+import tempfile
+
+from . import models
+from . import transcode
+
+# what real browsers send when loading an <img>
+CHROME_ACCEPT = ("image/avif,image/webp,image/apng,image/svg+xml,image/*,"
+    "*/*;q=0.8")
+FIREFOX_ACCEPT = "image/avif,image/webp,*/*"
+OLD_SAFARI_ACCEPT = ("image/png,image/svg+xml,image/*;q=0.8,video/*;q=0.8,"
+    "*/*;q=0.5")
+OLD_FIREFOX_ACCEPT = "image/webp,*/*"
+
+# the EXIF tag saying which way up the image is
+ORIENTATION = 0x0112
+
+class NegotiateTests(SimpleTestCase):
+    def setUp(self):
+        if transcode.PIL is None:
+            self.skipTest("Pillow is not installed")
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = pathlib.Path(temp_dir.name)
+        settings = override_settings(L_IMAGE_PATH=self.dir,
+            L_TRANSCODE_CACHE_PATH=self.dir/"cache")
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    # make an original that's too big to send as is: noise doesn't compress
+    def make_image(self, name, pil_format, exif=b""):
+        if pil_format not in transcode.PIL.Image.SAVE:
+            self.skipTest("Pillow can't write {}".format(pil_format))
+        rng = random.Random(1)
+        im = transcode.PIL.Image.frombytes("RGB", (300, 300),
+            bytes(rng.getrandbits(8) for _ in range(300*300*3)))
+        im.save(self.dir/name, pil_format, lossless=True, quality=100,
+            exif=exif)
+        return models.Image(pk=1, file_path=name)
+
+    def best_new_format(self):
+        for mime_type, pil_format, _ in transcode.FORMATS:
+            if pil_format in transcode.PIL.Image.SAVE:
+                return mime_type
+
+    def test_wildcards_accept_jpeg(self):
+        accepted = transcode._accepted_types(OLD_SAFARI_ACCEPT)
+        self.assertTrue(transcode._accepts(accepted, "image/jpeg"))
+        self.assertFalse(transcode._accepts(accepted, "image/webp"))
+        self.assertFalse(transcode._accepts(accepted, "image/avif"))
+
+    def test_refused_jpeg(self):
+        accepted = transcode._accepted_types("image/jpeg;q=0,image/*")
+        self.assertFalse(transcode._accepts(accepted, "image/jpeg"))
+
+    def test_modern_browsers_get_new_formats(self):
+        image = self.make_image("big.png", "PNG")
+        for accept in (CHROME_ACCEPT, FIREFOX_ACCEPT):
+            path, mime_type = transcode.negotiate(image, accept)
+            self.assertEqual(mime_type, self.best_new_format())
+            self.assertNotEqual(path, self.dir/"big.png")
+
+    def test_old_browsers_get_jpeg(self):
+        image = self.make_image("big.png", "PNG")
+        path, mime_type = transcode.negotiate(image, OLD_SAFARI_ACCEPT)
+        self.assertEqual(mime_type, "image/jpeg")
+        self.assertEqual(path.suffix, ".jpg")
+
+    def test_no_accept_header_gets_jpeg(self):
+        image = self.make_image("big.png", "PNG")
+        _, mime_type = transcode.negotiate(image, "")
+        self.assertEqual(mime_type, "image/jpeg")
+
+    def test_webp_original_only_to_browsers_that_take_it(self):
+        image = self.make_image("big.webp", "WEBP")
+        _, mime_type = transcode.negotiate(image, OLD_SAFARI_ACCEPT)
+        self.assertEqual(mime_type, "image/jpeg")
+        path, mime_type = transcode.negotiate(image, OLD_FIREFOX_ACCEPT)
+        self.assertEqual(mime_type, "image/webp")
+        self.assertEqual(path, self.dir/"big.webp")
+
+    def test_transcodes_keep_orientation(self):
+        # a camera photo taken with the camera turned: Orientation=6 means
+        # it's shown rotated 90 degrees clockwise
+        exif = transcode.PIL.Image.Exif()
+        exif[ORIENTATION] = 6
+        image = self.make_image("turned.jpg", "JPEG", exif.tobytes())
+        for accept in (CHROME_ACCEPT, "image/webp"):
+            path, mime_type = transcode.negotiate(image, accept)
+            self.assertNotEqual(path, self.dir/"turned.jpg")
+            with transcode.PIL.Image.open(path) as im:
+                self.assertEqual(im.getexif().get(ORIENTATION), 6,
+                    mime_type)
@@ -0,0 +1,172 @@
+# serve images in the most compact format the browser accepts. the originals
+# can be huge PNGs or TIFFs, so when the browser says it takes AVIF or WebP
+# (or at least JPEG), we send a transcoded copy instead. transcodes are made
+# the first time they're asked for and kept in a disk cache which is limited
+# to L_TRANSCODE_CACHE_SIZE bytes; the least recently used ones are thrown out
+# when it gets too big.
+
+# cache entries are named after the image ID and the size and modification time
+# of the original, so replacing the original automatically makes its old
+# transcodes unused (and they get evicted eventually).
+
+# Pillow is needed to transcode. without it, we just serve the originals.
+
+from django.conf import settings
+
+import mimetypes
+import os
+import tempfile
+import threading
+
+try:
+    import PIL.Image
+    PIL.Image.init()
+except ImportError:
+    PIL = None
+
+# the formats we can make, most preferred first, as (mime type, Pillow format
+# name, file extension)
+FORMATS = (
+    ("image/avif", "AVIF", "avif"),
+    ("image/webp", "WEBP", "webp"),
+    ("image/jpeg", "JPEG", "jpg"),
+)
+
+# originals smaller than this aren't worth transcoding
+MIN_TRANSCODE_SIZE = 64*1024
+
+_evict_lock = threading.Lock()
+
+# return the set of mime types (and wildcards like image/*) the Accept header
+# says are acceptable, and the set it explicitly says aren't
+def _accepted_types(accept):
+    if accept.strip() == "":
+        # no Accept header means anything goes
+        return {"*/*"}, set()
+    types = set()
+    refused = set()
+    for item in accept.split(","):
+        parts = item.strip().split(";")
+        q = 1
+        for param in parts[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        if q > 0:
+            types.add(parts[0].strip().lower())
+        else:
+            refused.add(parts[0].strip().lower())
+    return types, refused
+
+# return True if the browser takes mime_type. browsers list the newer formats
+# they take, but not JPEG; they cover it with image/* or */* instead. those
+# are taken to mean JPEG only, since plenty of browsers that send them can't
+# show AVIF or WebP.
+def _accepts(accepted, mime_type):
+    types, refused = accepted
+    if mime_type in types:
+        return True
+    if mime_type != "image/jpeg" or mime_type in refused:
+        return False
+    return "image/*" in types or "*/*" in types
+
+# decide how to serve the given image to a browser that sent the given Accept
+# header. returns the path of the file to send and its mime type.
+def negotiate(image, accept):
+    source = settings.L_IMAGE_PATH/image.file_path
+    source_type = mimetypes.guess_type(str(source))[0] or "image/jpeg"
+    if PIL is None:
+        return source, source_type
+
+    stat = source.stat()
+    if stat.st_size < MIN_TRANSCODE_SIZE:
+        return source, source_type
+
+    accepted = _accepted_types(accept)
+    for mime_type, pil_format, extension in FORMATS:
+        if pil_format not in PIL.Image.SAVE:
+            # this Pillow can't write it
+            continue
+        if not _accepts(accepted, mime_type):
+            continue
+        if mime_type == source_type:
+            # it's already in the best format the browser takes
+            return source, source_type
+        try:
+            return _cached(image, source, stat, pil_format, extension), \
+                mime_type
+        except Exception:
+            # can't be transcoded (broken file, animated, whatever). the
+            # original is still fine.
+            return source, source_type
+
+    return source, source_type
+
+def _cached(image, source, stat, pil_format, extension):
+    quality = settings.L_TRANSCODE_QUALITY[pil_format]
+    cache_dir = settings.L_TRANSCODE_CACHE_PATH
+    path = cache_dir/"{}-{}-{}-q{}.{}".format(image.pk, stat.st_size,
+        stat.st_mtime_ns, quality, extension)
+    try:
+        # mark it as recently used
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with PIL.Image.open(source) as im:
+        # keep the EXIF data, most importantly the orientation. browsers turn
+        # the image by it, so without it a rotated camera photo would show up
+        # turned differently than the original and polygons drawn on one
+        # wouldn't line up with the other.
+        exif = im.info.get("exif", b"")
+        if im.mode not in ("RGB", "L") and pil_format == "JPEG":
+            im = im.convert("RGB")
+        # write to a temporary file first so nobody can see it half written
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                im.save(f, pil_format, quality=quality,
+                    progressive=(pil_format == "JPEG"), optimize=True,
+                    exif=exif)
+            os.replace(temp_path, path)
+        except:
+            os.unlink(temp_path)
+            raise
+
+    _evict(cache_dir)
+    return path
+
+# throw out the least recently used transcodes until the cache fits in 90% of
+# its limit (so we don't have to do this on every single write)
+def _evict(cache_dir):
+    if not _evict_lock.acquire(blocking=False):
+        # somebody else is already on it
+        return
+    try:
+        entries = []
+        total = 0
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith(".tmp"):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        limit = settings.L_TRANSCODE_CACHE_SIZE
+        if total <= limit:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= limit*0.9:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+    finally:
+        _evict_lock.release()
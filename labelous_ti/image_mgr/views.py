@@ -2,13 +2,19 @@ from django.shortcuts import render
 from django.http import HttpResponse, Http404
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.urls import reverse
 
 import shutil
 
 from . import models
+from . import signing
+from . import transcode
+from labelous import db_router
+from label_app import prefetch
 
 # serve images to the labeler
 @login_required
+@db_router.replica_reads
 def image_file(request, image_id):
     # regex only allows numbers through
     image_id = int(image_id)
@@ -22,9 +28,52 @@ def image_file(request, image_id):
     if not exists or not image.visible:
         raise Http404("Image does not exist.")
 
+    resp = serve_image(request, image)
+    # the user will probably want the images next to this one soon
+    prefetch.warm(request.user.pk, image_id,
+        request.META.get("HTTP_ACCEPT", ""))
+    return resp
+
+# send the image in the best format the browser accepts
+def serve_image(request, image):
+    path, content_type = transcode.negotiate(image,
+        request.META.get("HTTP_ACCEPT", ""))
     # still clubbing baby seals
-    f = open(settings.L_IMAGE_PATH/image.file_path, "rb")
-    resp = HttpResponse(content_type="image/jpeg")
+    f = open(path, "rb")
+    resp = HttpResponse(content_type=content_type)
     shutil.copyfileobj(f, resp)
     f.close()
+    # caches have to keep a copy per format
+    resp["Vary"] = "Accept"
+    return resp
+
+# return a signed URL for the given image which can be fetched without logging
+# in (for a while). only hand these out to users allowed to see the image.
+def signed_image_url(image_id):
+    return signing.sign_path(
+        reverse("signed_image", kwargs={"image_id": image_id}))
+
+# serve images from signed URLs. this doesn't touch request.user, so the session
+# and user are never loaded. we still check that the image is visible, so hiding
+# an image takes effect immediately (except for copies already cached
+# downstream, which expire with the signature).
+def signed_image_file(request, image_id):
+    remaining = signing.check_signature(request)
+    # regex only allows numbers through
+    image_id = int(image_id)
+
+    try:
+        # we don't know who the user is, so we can't check if they need to
+        # read their own writes. but nobody can write images anyway.
+        image = models.Image.objects.using(db_router.replica_alias()).get(
+            pk=image_id)
+    except models.Image.DoesNotExist:
+        raise Http404("Image does not exist.")
+    if not image.visible:
+        raise Http404("Image does not exist.")
+
+    resp = serve_image(request, image)
+    # the URL is only valid until the signature expires, so anybody may cache
+    # it until then
+    resp["Cache-Control"] = "public, max-age={}".format(remaining)
     return resp
@@ -1,11 +1,213 @@
 from django.contrib import admin
+from django.db import transaction
+
+from datetime import datetime, timezone
+
+from labelous.paginator import EstimatedCountPaginator
+from . import history
+from . import labels
+from . import stats
+
+# there are far too many annotations and polygons to count or to list in a
+# select box, so these avoid both. the bulk actions each run as a single UPDATE
+# no matter how many rows are selected (plus, for polygons, one statement to
+# find the ones that change and one to add them to the history).
 
 from .models import Annotation
 class AnnotationAdmin(admin.ModelAdmin):
-    readonly_fields = ('creation_time', 'last_edit_time',)
+    # the review fields are managed by the review queue (see review_views.py)
+    # and the priority is copied from the image when saving
+    readonly_fields = ('creation_time', 'last_edit_time', 'priority',
+        'reviewer', 'claim_time', 'review_time',)
+    list_display = ('pk', 'annotator', 'image_id', 'locked', 'finished',
+        'deleted', 'reviewer', 'last_edit_time',)
+    list_select_related = ('annotator', 'reviewer',)
+    list_filter = ('locked', 'finished', 'deleted',)
+    raw_id_fields = ('annotator', 'image',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('lock', 'unlock', 'finish', 'soft_delete',)
+
+    # this counts as editing them: cached documents are keyed on the last edit
+    # time (see views.objects_cache_key), and compact_deleted goes by it
+    def _update(self, request, queryset, message, **fields):
+        updated = queryset.update(last_edit_time=datetime.now(timezone.utc),
+            **fields)
+        self.message_user(request, "{} {} annotation(s).".format(
+            message, updated))
+
+    def lock(self, request, queryset):
+        self._update(request, queryset, "Locked", locked=True)
+    lock.short_description = "Lock selected annotations"
+
+    def unlock(self, request, queryset):
+        self._update(request, queryset, "Unlocked", locked=False)
+    unlock.short_description = "Unlock selected annotations"
+
+    def finish(self, request, queryset):
+        self._update(request, queryset, "Finished", finished=True)
+    finish.short_description = "Mark selected annotations finished"
+
+    # deleted annotations don't count in their users' totals (see stats.py)
+    @transaction.atomic
+    def soft_delete(self, request, queryset):
+        stats.add_to_users(dict(Annotation.objects.select_for_update().filter(
+            pk__in=queryset.values("pk"), deleted=False).values_list(
+                "pk", "annotator_id")), -1)
+        self._update(request, queryset, "Deleted", deleted=True)
+    soft_delete.short_description = "Soft-delete selected annotations"
+
+    # saving a change counts as an edit too, for the same reasons
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        if not change or form.has_changed():
+            obj.last_edit_time = datetime.now(timezone.utc)
+        # the review queue orders by the image's priority, which may be a
+        # different image now
+        obj.priority = obj.image.priority
+        old = None
+        if change:
+            old = Annotation.objects.select_for_update().get(pk=obj.pk)
+        super().save_model(request, obj, form, change)
+        # move its counts if it was deleted, undeleted or handed to somebody
+        # else
+        if old is not None and (old.deleted, old.annotator_id) != (
+                obj.deleted, obj.annotator_id):
+            if not old.deleted:
+                stats.add_to_users({obj.pk: old.annotator_id}, -1)
+            if not obj.deleted:
+                stats.add_to_users({obj.pk: obj.annotator_id}, 1)
+
+    # deleting annotations deletes their polygons, which have to stop counting
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, Annotation.objects.filter(pk=obj.pk))
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        pks = list(queryset.select_for_update().values_list("pk", flat=True))
+        tally = stats.Tally()
+        tally.add_polygons(Polygon.objects.filter(annotation__in=pks), -1)
+        tally.save()
+        super().delete_queryset(request, Annotation.objects.filter(pk__in=pks))
 admin.site.register(Annotation, AnnotationAdmin)
 
 from .models import Polygon
 class PolygonAdmin(admin.ModelAdmin):
     readonly_fields = ('creation_time', 'last_edit_time',)
+    list_display = ('pk', 'annotation_id', 'label', 'points_preview', 'locked',
+        'deleted', 'last_edit_time',)
+    list_select_related = ('label',)
+    list_filter = ('locked', 'deleted', 'occluded',)
+    raw_id_fields = ('annotation',)
+    autocomplete_fields = ('label',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('lock', 'unlock', 'soft_delete',)
+
+    # polygons can have thousands of points; only show the first few
+    def points_preview(self, polygon):
+        points = polygon.points
+        preview = ", ".join("({:.0f}, {:.0f})".format(points[i], points[i+1])
+            for i in range(0, min(len(points), 6), 2))
+        if len(points) > 6:
+            preview += ", ..."
+        return "{} [{} vertices]".format(preview, len(points)//2)
+    points_preview.short_description = "points"
+
+    # changing polygons counts as editing their annotations, so documents
+    # cached for them aren't used anymore (see views.objects_cache_key)
+    def _touch_annotations(self, annotation_ids, now):
+        Annotation.objects.filter(pk__in=annotation_ids).update(
+            last_edit_time=now)
+
+    # "select all" can pick tens of millions of polygons, so none of this
+    # loads them: everything is done by the database.
+    @transaction.atomic
+    def _update(self, request, queryset, message, changed, **fields):
+        now = datetime.now(timezone.utc)
+        # only the polygons that actually change go in the history. this
+        # stops selecting them once they're changed, so that's done last.
+        changing = Polygon.objects.filter(
+            pk__in=queryset.exclude(**fields).values("pk"))
+        # locking doesn't change what's counted in the statistics; deleting
+        # stops the live ones counting
+        tally = stats.Tally()
+        if fields.get("deleted"):
+            tally.add_polygons(changing, -1)
+        history.record_all(changing, changed, request.user, now, **fields)
+        self._touch_annotations(changing.values("annotation_id"), now)
+        updated = changing.update(last_edit_time=now, **fields)
+        tally.save()
+        self.message_user(request, "{} {} polygon(s).".format(
+            message, updated))
+
+    # the fields of the change form that are recorded in the history
+    _history_fields = {"label": history.LABEL, "notes": history.NOTES,
+        "occluded": history.OCCLUDED, "points": history.POINTS,
+        "deleted": history.DELETED, "locked": history.LOCKED}
+
+    def save_model(self, request, obj, form, change):
+        now = datetime.now(timezone.utc)
+        obj.last_edit_time = now
+        tally = stats.Tally()
+        if change:
+            tally.add_polygon(Polygon.objects.get(pk=obj.pk), -1)
+        super().save_model(request, obj, form, change)
+        tally.add_polygon(obj)
+        tally.save()
+        if change:
+            changed = 0
+            for name in form.changed_data:
+                changed |= self._history_fields.get(name, 0)
+        else:
+            changed = history.ALL
+        if changed != 0:
+            history.record([(obj, changed)], request.user, now)
+        self._touch_annotations((obj.annotation_id,), now)
+
+    # deleted polygons have to stop counting
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, Polygon.objects.filter(pk=obj.pk))
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        pks = list(queryset.values_list("pk", flat=True))
+        polygons = Polygon.objects.filter(pk__in=pks)
+        tally = stats.Tally()
+        tally.add_polygons(polygons, -1)
+        self._touch_annotations(set(polygons.values_list(
+            "annotation_id", flat=True)), datetime.now(timezone.utc))
+        tally.save()
+        super().delete_queryset(request, polygons)
+
+    def lock(self, request, queryset):
+        self._update(request, queryset, "Locked", history.LOCKED,
+            locked=True)
+    lock.short_description = "Lock selected polygons"
+
+    def unlock(self, request, queryset):
+        self._update(request, queryset, "Unlocked", history.LOCKED,
+            locked=False)
+    unlock.short_description = "Unlock selected polygons"
+
+    def soft_delete(self, request, queryset):
+        self._update(request, queryset, "Deleted", history.DELETED,
+            deleted=True)
+    soft_delete.short_description = "Soft-delete selected polygons"
 admin.site.register(Polygon, PolygonAdmin)
+
+from .models import Label
+class LabelAdmin(admin.ModelAdmin):
+    readonly_fields = ('creation_time',)
+    list_display = ('name', 'simplify_tolerance',)
+    search_fields = ('name',)
+
+    # don't hand out the IDs of deleted labels (see labels.py)
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        labels.forget_label_ids()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        labels.forget_label_ids()
+admin.site.register(Label, LabelAdmin)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class LabelAppConfig(AppConfig):
     name = 'label_app'
+
+    def ready(self):
+        # registers them
+        from . import checks
@@ -0,0 +1,108 @@
+# async versions of the tool's annotation views, used when L_ASYNC_VIEWS is on
+# and we are running under an ASGI server. they need Django 4.2 or newer for
+# the async ORM. see views.py for how all of this is supposed to work; these
+# have to behave identically.
+
+from django.http import HttpResponse, Http404
+from django.conf import settings
+from django.core.cache import cache
+from asgiref.sync import sync_to_async
+
+import secrets
+
+from . import models
+from . import views
+from . import prefetch
+from image_mgr.async_views import async_login_required
+from labelous import db_router
+from labelous import profiling
+
+@async_login_required
+@db_router.replica_reads
+async def get_annotation_xml(request, image_id):
+    # the profile covers everything the event loop's thread does meanwhile,
+    # including other requests' work, so it's noisier than the sync view's
+    with profiling.maybe_profile(request, "get"):
+        return await _get_annotation_xml(request, image_id)
+
+async def _get_annotation_xml(request, image_id):
+    # regex only allows numbers through
+    image_id = int(image_id)
+
+    try:
+        annotation = await models.Annotation.objects.aget(
+            annotator=request.user, image__pk=image_id, image__visible=True,
+            deleted=False)
+    except models.Annotation.DoesNotExist:
+        raise Http404("Annotation does not exist.")
+    request.l_annotation_id = annotation.pk
+
+    # hand out a new lease, exactly like the sync view
+    lease = secrets.randbits(63)
+    await cache.aset(views.lease_cache_key(annotation.pk), lease,
+        settings.L_LEASE_SECONDS)
+    edit_key = views.format_edit_key(lease, annotation.version)
+
+    polygons = annotation.polygons.filter(deleted=False)
+    key = views.objects_cache_key(annotation)
+    columns = await cache.aget(key)
+    if columns is None:
+        polygons = [p async for p in polygons.select_related("label")]
+        columns = views.polygon_columns(annotation, polygons)
+        if not db_router.reading_replica():
+            await cache.aset(key, columns, settings.L_PREFETCH_TTL)
+
+    resp = views.annotation_response(request, annotation, edit_key, columns)
+    links = await sync_to_async(prefetch.preload_links)(request.user.pk,
+        image_id)
+    if links is not None:
+        resp["Link"] = links
+    return resp
+
+# the update has to happen inside a transaction, and the async ORM can't do
+# transactions yet. so we just run the normal processing (including pinning the
+# user to the primary, which talks to the cache) in a thread; the event loop
+# stays free while it waits on the database.
+@async_login_required
+async def post_annotation_xml(request):
+    await sync_to_async(views.accept_annotation)(request)
+    return views.submit_response(request)
+# see the DANGER in views.py. csrf_exempt can't wrap async views until Django
+# 5.0, so we set the flag it would set ourselves.
+post_annotation_xml.csrf_exempt = True
+
+# find the image of the annotation next to the given image in the loop through
+# the user's annotations. direction is "pk" for next and "-pk" for previous.
+async def _adjacent_annotation(request, direction):
+    image_id = views.image_id_from_query(request)
+
+    if direction == "pk":
+        annotations = models.Annotation.objects.filter(image__pk__gt=image_id)
+    else:
+        annotations = models.Annotation.objects.filter(image__pk__lt=image_id)
+    mine = {"annotator": request.user, "deleted": False}
+
+    adjacent_image_id = await annotations.filter(**mine).order_by(
+        direction).values_list("image_id", flat=True).afirst()
+    if adjacent_image_id is None:
+        # we must be at the end of the loop. wrap around to the other end.
+        adjacent_image_id = await models.Annotation.objects.filter(
+            **mine).order_by(direction).values_list(
+                "image_id", flat=True).afirst()
+        if adjacent_image_id is None:
+            raise models.Annotation.DoesNotExist()
+
+    return HttpResponse(
+        "<out><dir>f</dir><file>img{}.jpg</file></out>".format(
+            adjacent_image_id),
+        content_type="text/xml")
+
+@async_login_required
+@db_router.replica_reads
+async def next_annotation(request):
+    return await _adjacent_annotation(request, "pk")
+
+@async_login_required
+@db_router.replica_reads
+async def prev_annotation(request):
+    return await _adjacent_annotation(request, "-pk")
@@ -0,0 +1,123 @@
+# fetch the polygons of many annotations at once, for reviewers and QA
+# scripts. getting them one at a time through the tool's annotation view means
+# a request, a new edit lease and a handful of queries per annotation; this
+# hands out no leases and gets each chunk of annotations and all of their
+# polygons in two queries.
+
+# GET label/annotations/batch with either:
+#   images=1,2,3: the annotations of these images
+#   annotations=4,5,6: these annotations
+# and optionally:
+#   all=1: every annotator's annotations of the images, not just the user's
+#     own (staff only)
+#   after=N: only annotations with an ID above N
+#   limit=N: at most this many annotations (and at most L_BATCH_LIMIT)
+
+# the response is JSON, streamed out as it's built:
+# {"annotations": [{"anno_id": 4, "image_id": 1, "annotator_id": 7,
+#   "finished": false, "locked": false, "version": 3,
+#   "last_edit_time": "...", "objects": {...}}, ...],
+#  "next": 9}
+# where objects holds the live polygons as columns, exactly like the JSON
+# annotation document (see json_format.py). annotations come in ID order; if
+# next isn't null, there may be more, and asking again with after=next gets
+# them.
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousOperation, PermissionDenied
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import StreamingHttpResponse
+
+import json
+
+from . import models
+from . import views
+from labelous import db_router
+
+# parse a comma-separated list of IDs
+def parse_ids(text):
+    try:
+        ids = [int(i) for i in text.split(",") if i.strip() != ""]
+    except ValueError as e:
+        raise SuspiciousOperation("bad ids") from e
+    if len(ids) == 0 or len(ids) > settings.L_BATCH_LIMIT:
+        raise SuspiciousOperation("bad ids")
+    return ids
+
+def batch_annotations(request):
+    annotations = models.Annotation.objects.filter(deleted=False)
+    if "images" in request.GET:
+        annotations = annotations.filter(
+            image_id__in=parse_ids(request.GET["images"]))
+    elif "annotations" in request.GET:
+        annotations = annotations.filter(
+            pk__in=parse_ids(request.GET["annotations"]))
+    else:
+        raise SuspiciousOperation("no ids")
+
+    everyone = request.GET.get("all") == "1"
+    if everyone and not request.user.is_staff:
+        raise PermissionDenied("only staff can see everyone's annotations")
+    if not request.user.is_staff:
+        # users see only what they could see in the tool
+        annotations = annotations.filter(image__visible=True)
+    if not everyone:
+        annotations = annotations.filter(annotator=request.user)
+
+    try:
+        after = int(request.GET.get("after", 0))
+        limit = int(request.GET.get("limit", settings.L_BATCH_LIMIT))
+    except ValueError as e:
+        raise SuspiciousOperation("bad query") from e
+    limit = max(0, min(limit, settings.L_BATCH_LIMIT))
+
+    # the response is generated after we return, so it can't rely on
+    # replica_reads and picks where to read from now
+    alias = db_router.read_alias(request)
+
+    return StreamingHttpResponse(
+        _generate(annotations.using(alias), alias, after, limit),
+        content_type="application/json")
+
+def _generate(annotations, alias, after, limit):
+    yield '{"annotations":['
+    sent = 0
+    last_pk = after
+    more = False
+    while sent < limit:
+        chunk = list(annotations.filter(pk__gt=last_pk).order_by("pk")[
+            :min(settings.L_BATCH_CHUNK, limit-sent)])
+        if len(chunk) == 0:
+            break
+        last_pk = chunk[-1].pk
+
+        # the tool's view may have gathered some of them already
+        keys = {a.pk: views.objects_cache_key(a) for a in chunk}
+        cached = cache.get_many(keys.values())
+        missing = [a for a in chunk if keys[a.pk] not in cached]
+        prefetch_related_objects(missing, Prefetch("polygons",
+            queryset=models.Polygon.objects.using(alias).filter(
+                deleted=False).select_related("label").order_by("pk"),
+            to_attr="live_polygons"))
+
+        parts = []
+        for annotation in chunk:
+            columns = cached.get(keys[annotation.pk])
+            if columns is None:
+                columns = views.polygon_columns(annotation,
+                    annotation.live_polygons)
+            parts.append(json.dumps({
+                "anno_id": annotation.pk,
+                "image_id": annotation.image_id,
+                "annotator_id": annotation.annotator_id,
+                "finished": annotation.finished,
+                "locked": annotation.locked,
+                "version": annotation.version,
+                "last_edit_time": annotation.last_edit_time.isoformat(),
+                "objects": columns,
+            }, separators=(",", ":")))
+        yield ("," if sent > 0 else "")+",".join(parts)
+        sent += len(chunk)
+        more = sent == limit
+    yield '],"next":{}}}'.format(json.dumps(last_pk if more else None))
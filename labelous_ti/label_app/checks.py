@@ -0,0 +1,26 @@
+# make sure labelous is set up in a way it can actually work
+
+from django.conf import settings
+from django.core import checks
+
+# these keep their data in each process, so nothing in them is seen by the
+# others
+_PRIVATE_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+# edit leases and read replica pins are kept in the default cache. if the
+# processes don't share it, a tab opened through one process isn't seen by the
+# others, and an older tab's submission can overwrite a newer one's.
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    caches = getattr(settings, "CACHES", {})
+    backend = caches.get("default", {}).get("BACKEND",
+        "django.core.cache.backends.locmem.LocMemCache")
+    if backend in _PRIVATE_CACHES:
+        return [checks.Error(
+            "the default cache isn't shared between processes",
+            hint="set CACHES to memcached, redis or the database cache",
+            id="label_app.E001")]
+    return []
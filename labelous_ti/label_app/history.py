@@ -0,0 +1,113 @@
+# the edit history of polygons. every accepted change to a polygon adds a
+# PolygonEdit row holding just the fields that changed, so the history costs
+# little more than the changes themselves and the polygon table only ever holds
+# the current state. replaying an annotation's edits up to some time gives its
+# state at that time.
+
+# points are the bulk of it. they are stored as the differences between
+# consecutive coordinates in hundredths of a pixel (which is all the precision
+# the tool gets), packed as 32 bit ints and compressed. neighbouring vertices
+# are close together, so the differences are small and compress well.
+
+from django.db import connection
+
+from types import SimpleNamespace
+import struct
+import zlib
+
+from . import models
+
+# the bits of PolygonEdit.changed
+CREATED = 1
+LABEL = 2
+NOTES = 4
+OCCLUDED = 8
+POINTS = 16
+DELETED = 32
+LOCKED = 64
+# everything a new polygon has
+ALL = CREATED|LABEL|NOTES|OCCLUDED|POINTS|DELETED|LOCKED
+
+def pack_points(points):
+    prev = 0
+    deltas = []
+    for v in points:
+        v = round(v*100)
+        deltas.append(v-prev)
+        prev = v
+    return zlib.compress(struct.pack("<{}i".format(len(deltas)), *deltas))
+
+def unpack_points(data):
+    data = zlib.decompress(bytes(data))
+    points = []
+    v = 0
+    for delta in struct.unpack("<{}i".format(len(data)//4), data):
+        v += delta
+        points.append(v/100)
+    return points
+
+# make (but don't save) the history entry recording that the given fields of
+# the polygon changed to their current values. the polygon must have been
+# saved so it has an ID.
+def edit(polygon, changed, editor, time):
+    e = models.PolygonEdit(polygon_id=polygon.pk,
+        annotation_id=polygon.annotation_id,
+        editor_id=None if editor is None else editor.pk,
+        time=time, changed=changed)
+    if changed & LABEL: e.label_id = polygon.label_id
+    if changed & NOTES: e.notes = polygon.notes
+    if changed & OCCLUDED: e.occluded = polygon.occluded
+    if changed & POINTS: e.points = pack_points(polygon.points)
+    if changed & DELETED: e.deleted = polygon.deleted
+    if changed & LOCKED: e.locked = polygon.locked
+    return e
+
+# save history entries for a bunch of polygons at once. edits is a list of
+# (polygon, changed) pairs.
+def record(edits, editor, time):
+    models.PolygonEdit.objects.bulk_create(
+        [edit(polygon, changed, editor, time) for polygon, changed in edits],
+        batch_size=5000)
+
+# record the same change to every polygon in the queryset, without loading
+# them: the history entries are made by the database. values are the fields
+# that changed (only the ones that aren't points) and their new value, e.g.
+# locked=True. must be called before the change is made, while the queryset
+# still selects the polygons.
+def record_all(queryset, changed, editor, time, **values):
+    sql, params = queryset.values("pk", "annotation_id").query.sql_with_params()
+    qn = connection.ops.quote_name
+    columns = ["polygon_id", "annotation_id", "editor_id", "time", "changed"]
+    columns.extend(values.keys())
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO {} ({}) SELECT p.{}, p.{}, {} "
+            "FROM ({}) AS p".format(qn(models.PolygonEdit._meta.db_table),
+                ", ".join(qn(c) for c in columns), qn("id"),
+                qn("annotation_id"), ", ".join(["%s"]*(len(columns)-2)), sql),
+            [None if editor is None else editor.pk, time, changed,
+                *values.values(), *params])
+
+# rebuild the polygons the annotation had at the given time. returns a list of
+# objects with the polygon's id, label_id, notes, occluded, points, deleted and
+# locked, including the deleted ones.
+def annotation_at(annotation_id, time, using="default"):
+    polygons = {}
+    edits = models.PolygonEdit.objects.using(using).filter(
+        annotation_id=annotation_id, time__lte=time).order_by("time", "pk")
+    for e in edits.iterator():
+        if e.changed & CREATED:
+            polygon = SimpleNamespace(id=e.polygon_id)
+            polygons[e.polygon_id] = polygon
+        else:
+            try:
+                polygon = polygons[e.polygon_id]
+            except KeyError:
+                # its creation wasn't recorded, so we can't know its state
+                continue
+        if e.changed & LABEL: polygon.label_id = e.label_id
+        if e.changed & NOTES: polygon.notes = e.notes
+        if e.changed & OCCLUDED: polygon.occluded = e.occluded
+        if e.changed & POINTS: polygon.points = unpack_points(e.points)
+        if e.changed & DELETED: polygon.deleted = e.deleted
+        if e.changed & LOCKED: polygon.locked = e.locked
+    return list(polygons.values())
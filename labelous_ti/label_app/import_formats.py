@@ -0,0 +1,127 @@
+# the parsers for the import_annotations command. they run in its pool of
+# worker processes, which may be started fresh (the "spawn" start method, the
+# default on macOS and Windows) without Django set up, so this mustn't import
+# Django or anything that does, like our models.
+
+# they only deal in plain data: each returns a list of (image file name,
+# [(label, points, occluded, notes)]) and how many objects were skipped because
+# they were malformed. they raise an exception if the whole file is. labels
+# aren't normalized here; get_label_id does that when they're written.
+
+import functools
+import json
+import os
+
+import defusedxml.ElementTree
+
+def _round(v):
+    # same precision the tool gets
+    return float("{:.2f}".format(float(v)))
+
+# make sure the object is something we can store
+def _check_polygon(name, points):
+    if not isinstance(name, str) or name.strip() == "":
+        raise ValueError("no label")
+    if len(points) < 6 or len(points) % 2 != 0:
+        raise ValueError("not a polygon")
+    return name, points
+
+def parse_labelme(path):
+    root = defusedxml.ElementTree.parse(path, forbid_dtd=True,
+        forbid_entities=True, forbid_external=True).getroot()
+    filename = (root.findtext("filename") or "").strip()
+    if filename == "":
+        raise ValueError("no filename")
+    folder = (root.findtext("folder") or "").strip()
+    polygons = []
+    bad = 0
+    for obj in root.findall("object"):
+        if (obj.findtext("deleted") or "0").strip() == "1":
+            continue
+        try:
+            # objects drawn as boxes or masks don't have a <polygon>
+            points = []
+            for pt in obj.find("polygon").findall("pt"):
+                points.append(_round(pt.findtext("x")))
+                points.append(_round(pt.findtext("y")))
+            name, points = _check_polygon(obj.findtext("name") or "", points)
+        except Exception:
+            bad += 1
+            continue
+        polygons.append((name, points,
+            (obj.findtext("occluded") or "no").strip() == "yes",
+            (obj.findtext("attributes") or "").strip()))
+    return [(os.path.join(folder, filename), polygons)], bad
+
+# the image file names and category names of a COCO dataset, by ID. a results
+# file only has the IDs, so every worker needs the names from the dataset the
+# results are for, and reads it once.
+@functools.lru_cache(maxsize=None)
+def _coco_names(path):
+    with open(path) as f:
+        coco = json.load(f)
+    return ({image["id"]: image["file_name"] for image in coco["images"]},
+        {c["id"]: c["name"] for c in coco["categories"]})
+
+# a COCO file is either a whole dataset, with its images, categories and
+# annotations, or the results of a model: just a list of annotations, with
+# scores, whose IDs refer to the dataset in gt_path
+def parse_coco(path, min_score, gt_path=None):
+    with open(path) as f:
+        coco = json.load(f)
+    if isinstance(coco, list):
+        if gt_path is None:
+            raise ValueError("results file, but no --coco-gt")
+        filenames, categories = _coco_names(gt_path)
+        annotations = coco
+    else:
+        filenames = {image["id"]: image["file_name"]
+            for image in coco["images"]}
+        categories = {c["id"]: c["name"] for c in coco["categories"]}
+        annotations = coco["annotations"]
+    by_image = {}
+    bad = 0
+    for anno in annotations:
+        try:
+            score = anno.get("score")
+            if score is not None and score < min_score:
+                continue
+            segmentation = anno.get("segmentation")
+            if isinstance(segmentation, list) and len(segmentation) > 0:
+                # each part of the object becomes its own polygon
+                parts = [[_round(v) for v in part] for part in segmentation]
+            elif "bbox" in anno:
+                # run-length masks and plain detections: use the box
+                x, y, w, h = anno["bbox"]
+                parts = [[_round(x), _round(y), _round(x+w), _round(y),
+                    _round(x+w), _round(y+h), _round(x), _round(y+h)]]
+            else:
+                raise ValueError("no shape")
+            notes = "" if score is None else "score={:.3f}".format(score)
+            filename = filenames[anno["image_id"]]
+            category = categories[anno["category_id"]]
+        except Exception:
+            bad += 1
+            continue
+        polygons = by_image.setdefault(filename, [])
+        for points in parts:
+            try:
+                name, points = _check_polygon(category, points)
+            except ValueError:
+                bad += 1
+                continue
+            polygons.append((name, points, bool(anno.get("iscrowd", 0)),
+                notes))
+    return list(by_image.items()), bad
+
+# returns (parsed, malformed objects, None), or (None, None, the error) if the
+# file couldn't be parsed at all
+def parse_file(path, fmt, min_score, gt_path=None):
+    try:
+        if fmt == "labelme":
+            parsed, bad = parse_labelme(path)
+        else:
+            parsed, bad = parse_coco(path, min_score, gt_path)
+    except Exception as e:
+        return None, None, "{}: {}".format(type(e).__name__, e)
+    return parsed, bad, None
@@ -0,0 +1,149 @@
+# a JSON version of the annotation document, for tools that ask for it. the
+# XML document spends most of its bytes (and our time) wrapping each vertex in
+# <pt><x>..</x><y>..</y></pt>; here each field of the polygons is one array,
+# with all the points in a single flat array, so the document is a fraction of
+# the size and is encoded and decoded in a few passes over whole arrays.
+
+# the tool asks for it by including application/json in the Accept header of
+# the annotation request, and sends it back with a Content-Type of
+# application/json. the document looks like:
+
+# {"anno_id": 12, "edit_key": "...", "image_id": 34, "image_url": "...",
+#  "objects": {"id": [56, 78], "name": ["cat", "dog"], "verified": [0, 1],
+#   "occluded": [0, 0], "attributes": ["", "fluffy"], "counts": [3, 4],
+#   "points": [x0, y0, x1, y1, x2, y2, x0, y0, ...]}}
+
+# every array in objects has one entry per polygon, in order, except points,
+# which holds all the polygons' points one after the other: counts says how
+# many vertices each has. it's sent back the same way, except polygons have a
+# "deleted" entry instead of "verified", and new ones have an id of null and go
+# at the end. as with the XML, a polygon's position is its index.
+
+# image_url is a signed URL for the image, like <c_image_url> in the XML; the
+# same caveat about the tool not using it yet applies.
+
+from django.core.exceptions import SuspiciousOperation
+
+import json
+import math
+import types
+
+from . import labels
+import image_mgr.views
+
+# return True if the request's Accept header takes JSON
+def accepts_json(request):
+    for item in request.META.get("HTTP_ACCEPT", "").split(","):
+        parts = item.strip().split(";")
+        if parts[0].strip().lower() != "application/json":
+            continue
+        # unless it says it really doesn't
+        return not any(p.strip() in ("q=0", "q=0.0") for p in parts[1:])
+    return False
+
+# return True if the request's body is JSON
+def is_json(request):
+    return request.content_type == "application/json"
+
+# build the JSON document for the given annotation, with its polygons as
+# columns (from views.polygon_columns). returns the encoded document.
+def build_annotation_json(annotation, edit_key, columns):
+    return json.dumps({
+        "anno_id": annotation.pk,
+        "edit_key": edit_key,
+        "image_id": annotation.image_id,
+        "image_url": image_mgr.views.signed_image_url(annotation.image_id),
+        "objects": columns,
+    }, separators=(",", ":"))
+
+def _is_number(v):
+    # bool is a kind of int, but true isn't a coordinate
+    return type(v) in (int, float)
+
+# pull what we need out of the decoded JSON document, exactly like
+# views.read_annotation_xml does for XML. we are just as suspicious of it.
+def read_annotation_json(data):
+    if not isinstance(data, dict):
+        raise SuspiciousOperation("not an annotation")
+    doc = types.SimpleNamespace()
+
+    if type(data.get("image_id")) is not int:
+        raise SuspiciousOperation("invalid image")
+    doc.image_id = data["image_id"]
+    if type(data.get("anno_id")) is not int:
+        raise SuspiciousOperation("invalid anno id")
+    doc.anno_id = data["anno_id"]
+    if not isinstance(data.get("edit_key"), str):
+        raise SuspiciousOperation("invalid edit key")
+    doc.edit_key = data["edit_key"]
+
+    try:
+        objects = data["objects"]
+        ids = objects["id"]
+        names = objects["name"]
+        deleted = objects["deleted"]
+        occluded = objects["occluded"]
+        attributes = objects["attributes"]
+        counts = objects["counts"]
+        points = objects["points"]
+
+        columns = (ids, names, deleted, occluded, attributes, counts)
+        if not all(isinstance(c, list) and len(c) == len(ids)
+                for c in columns):
+            raise Exception("bad columns")
+        if not isinstance(points, list):
+            raise Exception("bad points")
+
+        # it has an ID and it must be correct, or it's new
+        known_ids = [i for i in ids if i is not None]
+        if not all(type(i) is int for i in known_ids):
+            raise Exception("bad id")
+        if len(set(known_ids)) != len(known_ids):
+            raise Exception("duplicate id")
+        if not all(v in (0, 1) for v in deleted):
+            raise Exception("bad deleted")
+        if not all(v in (0, 1) for v in occluded):
+            raise Exception("bad occluded")
+        attributes = ["" if a is None else a for a in attributes]
+        if not all(isinstance(a, str) for a in attributes):
+            raise Exception("bad attributes")
+        if not all(type(c) is int and c >= 0 for c in counts):
+            raise Exception("bad counts")
+        if sum(counts)*2 != len(points):
+            raise Exception("bad points")
+        if not all(_is_number(v) for v in points):
+            raise Exception("bad points")
+        # round to the same precision we send, like the XML path does, so
+        # unchanged points compare equal to what the database has
+        points = [round(float(v), 2) for v in points]
+        if not all(map(math.isfinite, points)):
+            raise Exception("bad points")
+
+        # look up each label's ID now so we only have to compare IDs later.
+        # labels that don't exist yet are created once the submission is known
+        # to be accepted.
+        if not all(isinstance(n, str) for n in names):
+            raise Exception("bad name")
+        names = [labels.normalize_name(n) for n in names]
+        if "" in names:
+            raise Exception("empty name")
+        label_ids = {name: labels.find_label_id(name) for name in set(names)}
+    except Exception as e:
+        raise SuspiciousOperation("invalid polygon") from e
+
+    doc.polygons = []
+    offset = 0
+    for index, count in enumerate(counts):
+        doc.polygons.append(types.SimpleNamespace(
+            id=ids[index],
+            index=index,
+            label_name=names[index],
+            label_id=label_ids[names[index]],
+            deleted=bool(deleted[index]),
+            occluded=bool(occluded[index]),
+            attributes=attributes[index],
+            points=points[offset:offset+count*2],
+        ))
+        offset += count*2
+
+    return doc
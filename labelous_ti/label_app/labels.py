@@ -0,0 +1,135 @@
+# manage the label vocabulary. polygons refer to labels by ID, so every time a
+# document comes in we need to turn its label strings into IDs. the set of
+# labels is small and basically never changes, so we keep the name -> ID
+# mapping in memory instead of asking the database for every polygon.
+
+from django.conf import settings
+from django.db.models.functions import Coalesce
+
+import bisect
+import heapq
+import threading
+import time
+
+from . import models
+
+_lock = threading.Lock()
+# normalized name -> label ID. labels are never renamed, but a label nothing
+# uses can be deleted in the admin, which only clears this process's copy. the
+# other processes find out when they try to use the ID and get an
+# IntegrityError, and call forget_label_ids.
+_ids_by_name = {}
+
+# turn whatever the user typed into the canonical form of the label. this
+# merges the most common variants: different case and stray whitespace.
+def normalize_name(name):
+    return " ".join(name.split()).lower()
+
+# return the ID of the label with the given name, or None if there is no such
+# label yet.
+def find_label_id(name):
+    name = normalize_name(name)
+    try:
+        return _ids_by_name[name]
+    except KeyError:
+        pass
+
+    label_id = models.Label.objects.filter(name=name).values_list(
+        "pk", flat=True).first()
+    if label_id is not None:
+        with _lock:
+            _ids_by_name[name] = label_id
+    return label_id
+
+# return the ID of the label with the given name, creating it if necessary.
+# this writes, so it should only be done for data that's going to be saved.
+def get_label_id(name):
+    name = normalize_name(name)
+    if name == "":
+        raise ValueError("empty label name")
+    label_id = find_label_id(name)
+    if label_id is not None:
+        return label_id
+
+    # get_or_create handles somebody else creating it at the same time
+    label, _ = models.Label.objects.get_or_create(name=name)
+    with _lock:
+        _ids_by_name[name] = label.pk
+    return label.pk
+
+# throw away the remembered IDs, because one of them might have been deleted
+def forget_label_ids():
+    with _lock:
+        _ids_by_name.clear()
+
+# THE AUTOCOMPLETE INDEX
+
+# the autocomplete endpoint gets hit on basically every keystroke, so it's
+# served entirely from memory. we keep all the label names sorted, so the ones
+# starting with a given prefix are a contiguous run we can find with bisect.
+# the index is rebuilt from the database when it gets older than
+# L_LABEL_INDEX_TTL seconds.
+
+_index = None
+
+class _LabelIndex:
+    def __init__(self, names, uses):
+        self.names = names # sorted
+        self.uses = uses # uses[i] is how many live polygons have names[i]
+        self.build_time = time.monotonic()
+
+def _build_index():
+    # the counts come from the statistics table, so this doesn't have to count
+    # every polygon
+    labels = models.Label.objects.annotate(
+        uses=Coalesce("stats__polygons", 0)
+    ).order_by("name").values_list("name", "uses")
+    names = []
+    uses = []
+    for name, use_count in labels:
+        names.append(name)
+        uses.append(use_count)
+    return _LabelIndex(names, uses)
+
+def _get_index():
+    global _index
+    index = _index
+    if (index is None or
+            time.monotonic() - index.build_time > settings.L_LABEL_INDEX_TTL):
+        # if two threads rebuild at once, one of them just wastes its time
+        index = _build_index()
+        _index = index
+    return index
+
+# return up to limit label names starting with prefix, most used first
+def autocomplete(prefix, limit):
+    prefix = normalize_name(prefix)
+    index = _get_index()
+    start = bisect.bisect_left(index.names, prefix)
+    # every name that starts with prefix sorts before prefix followed by the
+    # largest possible character
+    end = bisect.bisect_left(index.names, prefix+"\U0010ffff", lo=start)
+    best = heapq.nlargest(limit, range(start, end),
+        key=lambda i: index.uses[i])
+    return [index.names[i] for i in best]
+
+# SIMPLIFICATION TOLERANCES
+
+# label ID -> tolerance for the labels that have one set, and when we loaded
+# them. they are reloaded as often as the autocomplete index, so changes made in
+# the admin take effect within L_LABEL_INDEX_TTL seconds.
+_tolerances = None
+_tolerances_time = None
+
+# return the tolerance polygons with the given label should be simplified with,
+# or None if they shouldn't be.
+def simplify_tolerance(label_id):
+    global _tolerances, _tolerances_time
+    now = time.monotonic()
+    if (_tolerances is None or
+            now - _tolerances_time > settings.L_LABEL_INDEX_TTL):
+        _tolerances = dict(models.Label.objects.filter(
+            simplify_tolerance__isnull=False).values_list(
+                "pk", "simplify_tolerance"))
+        _tolerances_time = now
+    return _tolerances.get(label_id, settings.L_SIMPLIFY_TOLERANCE)
@@ -0,0 +1,109 @@
+# permanently remove soft-deleted polygons and annotations that haven't been
+# touched in a while, so the tables (and the indexes on them) only hold data
+# somebody can still see. everything removed is first written to a gzipped
+# JSON lines file in L_ARCHIVE_PATH, one row per line, in case we ever need it
+# back.
+
+# the work is done in small batches, each in its own transaction, with a pause
+# in between, so this can run while people are annotating without holding
+# locks for long or swamping the database.
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.conf import settings
+from django.db import transaction
+
+import gzip
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+from label_app import models
+from label_app import stats
+
+class Command(BaseCommand):
+    help = "Archive and remove old soft-deleted polygons and annotations."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--retention-days", type=float, default=30,
+            help="only remove things deleted at least this long ago")
+        parser.add_argument("--batch", type=int, default=1000,
+            help="rows to remove per transaction")
+        parser.add_argument("--sleep", type=float, default=0.5,
+            help="seconds to wait between batches")
+        parser.add_argument("--dry-run", action="store_true",
+            help="just say how much would be removed")
+
+    def handle(self, *args, **options):
+        self.options = options
+        cutoff = datetime.now(timezone.utc) - timedelta(
+            days=options["retention_days"])
+        # the deleted flag doesn't record when it was set, but everything that
+        # sets it (submissions, the admin's actions and change forms) updates
+        # the last edit time too
+        polygons = models.Polygon.objects.filter(deleted=True,
+            last_edit_time__lt=cutoff)
+        annotations = models.Annotation.objects.filter(deleted=True,
+            last_edit_time__lt=cutoff)
+
+        if options["dry_run"]:
+            self.stdout.write("would remove {} polygons and {} annotations "
+                "(plus their polygons)".format(
+                    polygons.count(), annotations.count()))
+            return
+
+        archive_dir = settings.L_ARCHIVE_PATH
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        archive_path = archive_dir/"compaction-{:%Y%m%d-%H%M%S}.jsonl.gz".format(
+            datetime.now())
+        with gzip.open(archive_path, "wt", encoding="utf8") as archive:
+            self.archive = archive
+            removed = self.compact(polygons, self.remove_polygons)
+            self.stdout.write("removed {} polygons".format(removed))
+            removed = self.compact(annotations, self.remove_annotations)
+            self.stdout.write("removed {} annotations".format(removed))
+        self.stdout.write("archived to {}".format(archive_path))
+
+    # run remove on batches of primary keys from queryset until there are none
+    # left
+    def compact(self, queryset, remove):
+        total = 0
+        while True:
+            with transaction.atomic():
+                # lock the rows so nobody can undelete them while we work.
+                # skip any already locked; we'll get them next time.
+                pks = list(queryset.select_for_update(skip_locked=True).order_by(
+                    "pk").values_list("pk", flat=True)[:self.options["batch"]])
+                if len(pks) == 0:
+                    return total
+                remove(pks)
+            # everything in the transaction is now committed, so make sure it's
+            # really in the archive too
+            self.archive.flush()
+            total += len(pks)
+            self.stdout.write("  {}...".format(total))
+            time.sleep(self.options["sleep"])
+
+    def write(self, kind, rows):
+        for row in rows:
+            row["type"] = kind
+            self.archive.write(json.dumps(row, cls=DjangoJSONEncoder))
+            self.archive.write("\n")
+
+    def remove_polygons(self, pks):
+        polygons = models.Polygon.objects.filter(pk__in=pks)
+        self.write("polygon", polygons.values())
+        polygons.delete()
+
+    def remove_annotations(self, pks):
+        annotations = models.Annotation.objects.filter(pk__in=pks)
+        self.write("annotation", annotations.values())
+        # their live polygons go too, so they stop counting
+        tally = stats.Tally()
+        tally.add_polygons(models.Polygon.objects.filter(annotation__in=pks),
+            -1)
+        tally.save()
+        # deleting an annotation takes all its polygons with it, deleted or not
+        self.write("polygon", models.Polygon.objects.filter(
+            annotation__in=pks).values())
+        annotations.delete()
@@ -0,0 +1,202 @@
+# fill the database with a large amount of fake but realistically shaped data
+# so we can see how things perform at production scale. everything is written
+# with bulk inserts, and polygons (the bulk of the data) with COPY, so tens of
+# millions of polygons only take minutes.
+
+# the users are named <prefix><n> and all share one password, so
+# bench/loadtest.py can log in as them.
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+
+import base64
+import io
+import math
+import random
+from datetime import datetime, timedelta, timezone
+
+from label_app import models
+from label_app import labels
+from label_app import stats
+import image_mgr.models
+
+# a 64x48 gray JPEG to stand in for the real images
+PLACEHOLDER_JPEG = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDABALDA4MChAODQ4SERATGCgaGBYWGDEjJR0oOjM9"
+    "PDkzODdASFxOQERXRTc4UG1RV19iZ2hnPk1xeXBkeFxlZ2P/2wBDARESEhgVGC8aGi9jQjhC"
+    "Y2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2P/wAAR"
+    "CAAwAEADASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAA"
+    "AgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkK"
+    "FhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWG"
+    "h4iJipKTlJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi4+Tl"
+    "5ufo6erx8vP09fb3+Pn6/8QAHwEAAwEBAQEBAQEBAQAAAAAAAAECAwQFBgcICQoL/8QAtREA"
+    "AgECBAQDBAcFBAQAAQJ3AAECAxEEBSExBhJBUQdhcRMiMoEIFEKRobHBCSMzUvAVYnLRChYk"
+    "NOEl8RcYGRomJygpKjU2Nzg5OkNERUZHSElKU1RVVldYWVpjZGVmZ2hpanN0dXZ3eHl6goOE"
+    "hYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExcbHyMnK0tPU1dbX2Nna4uPk"
+    "5ebn6Onq8vP09fb3+Pn6/9oADAMBAAIRAxEAPwAooooAKKKKACiiigAooooAKKKKACiiigAo"
+    "oooAKKKKACiiigAooooAKKKKACiiigD/2Q==")
+
+class Command(BaseCommand):
+    help = "Generate a large synthetic dataset for performance testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--user-prefix", default="synth_user_")
+        parser.add_argument("--password", default="synth")
+        parser.add_argument("--images", type=int, default=10000)
+        parser.add_argument("--image-files", action="store_true",
+            help="write a placeholder file for every image instead of having "
+                "them all share one")
+        parser.add_argument("--annotators-per-image", type=float, default=2,
+            help="mean number of users annotating each image")
+        parser.add_argument("--polygons", type=float, default=15,
+            help="mean number of polygons per annotation")
+        parser.add_argument("--vertices", type=float, default=12,
+            help="median number of vertices per polygon")
+        parser.add_argument("--max-vertices", type=int, default=2000)
+        parser.add_argument("--labels", type=int, default=200,
+            help="size of the label vocabulary. label use follows Zipf's law.")
+        parser.add_argument("--deleted-ratio", type=float, default=0.1,
+            help="fraction of polygons and annotations marked deleted")
+        parser.add_argument("--finished-ratio", type=float, default=0.3)
+        parser.add_argument("--days", type=float, default=365,
+            help="spread creation times over this many days")
+        parser.add_argument("--batch", type=int, default=2000,
+            help="images to generate per transaction")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options["seed"])
+        self.now = datetime.now(timezone.utc)
+
+        users = self.create_users()
+        label_ids = [labels.get_label_id("synthetic {}".format(n))
+            for n in range(options["labels"])]
+        # zipf: the nth most common label is used 1/n as much as the first
+        weights = [1/(n+1) for n in range(len(label_ids))]
+        self.label_cum_weights = []
+        total = 0
+        for weight in weights:
+            total += weight
+            self.label_cum_weights.append(total)
+        self.label_ids = label_ids
+
+        num_polygons = 0
+        num_annotations = 0
+        for start in range(0, options["images"], options["batch"]):
+            count = min(options["batch"], options["images"]-start)
+            with transaction.atomic():
+                images = self.create_images(start, count, users[0])
+                annotations = self.create_annotations(images, users)
+                num_polygons += self.create_polygons(annotations)
+                # COPY skips the statistics, so count what it wrote
+                tally = stats.Tally({a.pk: a.annotator_id
+                    for a in annotations if not a.deleted})
+                tally.add_polygons(models.Polygon.objects.filter(
+                    annotation__in=annotations))
+                tally.save()
+            num_annotations += len(annotations)
+            self.stdout.write("{} images, {} annotations, {} polygons".format(
+                start+count, num_annotations, num_polygons))
+
+    def random_time(self):
+        return self.now - timedelta(
+            seconds=self.rng.uniform(0, self.options["days"]*86400))
+
+    def create_users(self):
+        # hashing is deliberately slow, so do it once and share the hash
+        password = make_password(self.options["password"])
+        prefix = self.options["user_prefix"]
+        names = ["{}{}".format(prefix, n) for n in range(self.options["users"])]
+        existing = set(User.objects.filter(
+            username__in=names).values_list("username", flat=True))
+        User.objects.bulk_create(
+            [User(username=name, password=password)
+                for name in names if name not in existing],
+            batch_size=1000)
+        return list(User.objects.filter(username__in=names).order_by("pk"))
+
+    def create_images(self, start, count, uploader):
+        image_dir = settings.L_IMAGE_PATH/"synthetic"
+        image_dir.mkdir(exist_ok=True)
+        if not self.options["image_files"]:
+            placeholder = image_dir/"placeholder.jpg"
+            if not placeholder.exists():
+                placeholder.write_bytes(PLACEHOLDER_JPEG)
+
+        images = []
+        for n in range(start, start+count):
+            if self.options["image_files"]:
+                path = image_dir/"img{}.jpg".format(n)
+                path.write_bytes(PLACEHOLDER_JPEG)
+            else:
+                path = image_dir/"placeholder.jpg"
+            images.append(image_mgr.models.Image(
+                file_path=str(path.relative_to(settings.L_IMAGE_PATH)),
+                available=True, visible=True, uploader=uploader,
+                priority=self.rng.uniform(0, 2)))
+        # postgres gives us back the IDs
+        return image_mgr.models.Image.objects.bulk_create(images)
+
+    def create_annotations(self, images, users):
+        mean_annotators = self.options["annotators_per_image"]
+        annotations = []
+        for image in images:
+            # roughly poisson, and at least one
+            k = max(1, round(self.rng.expovariate(1/mean_annotators)))
+            for annotator in self.rng.sample(users, min(k, len(users))):
+                creation_time = self.random_time()
+                annotations.append(models.Annotation(
+                    annotator=annotator, image=image, priority=image.priority,
+                    finished=self.rng.random() < self.options["finished_ratio"],
+                    deleted=self.rng.random() < self.options["deleted_ratio"],
+                    last_edit_time=creation_time))
+        return models.Annotation.objects.bulk_create(annotations)
+
+    # make a random star-shaped (and therefore simple) polygon
+    def random_points(self):
+        rng = self.rng
+        vertices = int(rng.lognormvariate(math.log(self.options["vertices"]),
+            0.8))
+        vertices = max(3, min(vertices, self.options["max_vertices"]))
+        cx, cy = rng.uniform(50, 1000), rng.uniform(50, 700)
+        radius = rng.uniform(5, 200)
+        angles = sorted(rng.uniform(0, 2*math.pi) for _ in range(vertices))
+        points = []
+        for angle in angles:
+            r = radius*rng.uniform(0.5, 1)
+            points.append("{:.2f}".format(cx + r*math.cos(angle)))
+            points.append("{:.2f}".format(cy + r*math.sin(angle)))
+        return points
+
+    # write the polygons with COPY, which is many times faster than INSERT
+    def create_polygons(self, annotations):
+        rng = self.rng
+        mean_polygons = self.options["polygons"]
+        rows = io.StringIO()
+        count = 0
+        for annotation in annotations:
+            num = round(rng.expovariate(1/mean_polygons))
+            creation_time = annotation.last_edit_time.isoformat()
+            for _ in range(num):
+                label_id = rng.choices(self.label_ids,
+                    cum_weights=self.label_cum_weights)[0]
+                rows.write("{}\t{}\t{}\t{}\t\t{{{}}}\t{}\t{}\t{}\n".format(
+                    annotation.pk, creation_time, creation_time, label_id,
+                    ",".join(self.random_points()),
+                    "t" if rng.random() < 0.1 else "f", "f",
+                    "t" if rng.random() < self.options["deleted_ratio"]
+                        else "f"))
+                count += 1
+
+        rows.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert("COPY {} (annotation_id, creation_time, "
+                "last_edit_time, label_id, notes, points, occluded, locked, "
+                "deleted) FROM STDIN".format(models.Polygon._meta.db_table),
+                rows)
+        return count
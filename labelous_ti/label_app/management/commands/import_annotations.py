@@ -0,0 +1,188 @@
+# import existing annotations in bulk, instead of going through the tool one
+# document at a time. understands LabelMe XML files (one per image) and COCO
+# JSON files: either whole datasets, or a model's predictions in the COCO
+# results format (a list of annotations, whose image and category IDs are
+# looked up in the dataset given with --coco-gt). we keep a prediction's
+# "score" in the polygon's notes and can filter on it.
+
+# files are parsed in a pool of processes, since that's the slow part (see
+# import_formats.py), and matched to images by their file_path. everything
+# lands on one user's annotations (e.g. a "model" user for predictions).
+# running the same import again doesn't duplicate anything: polygons identical
+# to one already on the annotation are skipped.
+
+# files that can't be read at all, and objects in them that aren't usable
+# polygons (LabelMe boxes and masks, missing names or points, ...), are skipped
+# and counted instead of stopping the import.
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import transaction
+
+import concurrent.futures
+import os
+import pathlib
+from datetime import datetime, timezone
+
+from label_app import models
+from label_app import import_formats
+from label_app import labels
+from label_app import simplify
+from label_app import history
+from label_app import stats
+import image_mgr.models
+
+class Command(BaseCommand):
+    help = "Import LabelMe XML or COCO JSON annotations in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+",
+            help="files, or directories to search for them")
+        parser.add_argument("--format", choices=("labelme", "coco"),
+            required=True)
+        parser.add_argument("--user", required=True,
+            help="username the annotations will belong to")
+        parser.add_argument("--match", choices=("path", "basename"),
+            default="basename",
+            help="match files to images by their whole path (relative to the "
+                "image directory) or just the file name")
+        parser.add_argument("--coco-gt",
+            help="the COCO dataset that COCO results files refer to")
+        parser.add_argument("--min-score", type=float, default=0,
+            help="skip COCO predictions scoring lower than this")
+        parser.add_argument("--lock", action="store_true",
+            help="lock the imported polygons so annotators can't change them")
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+        parser.add_argument("--batch", type=int, default=500,
+            help="images to write per transaction")
+
+    def handle(self, *args, **options):
+        self.options = options
+        try:
+            self.user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError("no user {}".format(options["user"]))
+
+        extension = ".xml" if options["format"] == "labelme" else ".json"
+        files = []
+        for path in options["paths"]:
+            path = pathlib.Path(path)
+            if path.is_dir():
+                files.extend(sorted(path.rglob("*"+extension)))
+            else:
+                files.append(path)
+        coco_gt = options["coco_gt"]
+        if coco_gt is not None:
+            if not os.path.isfile(coco_gt):
+                raise CommandError("no file {}".format(coco_gt))
+            # it may be in a directory we searched, but it isn't predictions
+            coco_gt = os.path.abspath(coco_gt)
+            files = [f for f in files if os.path.abspath(f) != coco_gt]
+
+        # find every image's ID by what we'll match it with
+        self.image_ids = {}
+        for pk, file_path in image_mgr.models.Image.objects.values_list(
+                "pk", "file_path").iterator():
+            if options["match"] == "basename":
+                file_path = os.path.basename(file_path)
+            self.image_ids[file_path] = pk
+
+        self.imported = 0
+        self.skipped = 0
+        self.unmatched = 0
+        malformed = 0
+        failed = 0
+        pending = []
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=options["workers"]) as pool:
+            results = pool.map(import_formats.parse_file, files,
+                [options["format"]]*len(files),
+                [options["min_score"]]*len(files),
+                [coco_gt]*len(files), chunksize=16)
+            for path, (parsed, bad, error) in zip(files, results):
+                if error is not None:
+                    failed += 1
+                    self.stderr.write("skipping {}: {}".format(path, error))
+                    continue
+                malformed += bad
+                pending.extend(parsed)
+                if len(pending) >= options["batch"]:
+                    self.write(pending)
+                    pending = []
+        if len(pending) > 0:
+            self.write(pending)
+
+        self.stdout.write("done: imported {} polygons, skipped {} already "
+            "present, {} annotated images matched no image, skipped {} "
+            "malformed objects and {} unreadable files".format(
+                self.imported, self.skipped, self.unmatched, malformed,
+                failed))
+
+    # write a batch of parsed (file name, polygons) to the database
+    @transaction.atomic
+    def write(self, parsed):
+        polygons_by_image = {}
+        for filename, polygons in parsed:
+            if self.options["match"] == "basename":
+                filename = os.path.basename(filename)
+            try:
+                image_id = self.image_ids[filename]
+            except KeyError:
+                self.unmatched += 1
+                continue
+            polygons_by_image.setdefault(image_id, []).extend(polygons)
+
+        now = datetime.now(timezone.utc)
+        # every image needs one live annotation for the user
+        annotations = models.Annotation.objects.filter(annotator=self.user,
+            image__in=polygons_by_image.keys(), deleted=False)
+        annotation_ids = {a.image_id: a.pk for a in annotations}
+        priorities = dict(image_mgr.models.Image.objects.filter(
+            pk__in=polygons_by_image.keys()).values_list("pk", "priority"))
+        new = models.Annotation.objects.bulk_create([
+            models.Annotation(annotator=self.user, image_id=image_id,
+                priority=priorities[image_id], last_edit_time=now)
+            for image_id in polygons_by_image.keys()
+            if image_id not in annotation_ids])
+        for annotation in new:
+            annotation_ids[annotation.image_id] = annotation.pk
+
+        # what's already there, so we don't import it twice
+        existing = set(models.Polygon.objects.filter(
+            annotation__in=annotation_ids.values(), deleted=False).values_list(
+                "annotation_id", "label_id", "points"))
+        existing = {(a, l, tuple(p)) for a, l, p in existing}
+
+        to_create = []
+        for image_id, polygons in polygons_by_image.items():
+            annotation_id = annotation_ids[image_id]
+            for name, points, occluded, notes in polygons:
+                label_id = labels.get_label_id(name)
+                tolerance = labels.simplify_tolerance(label_id)
+                original_vertex_count = None
+                if tolerance is not None:
+                    simplified = simplify.simplify(points, tolerance)
+                    if len(simplified) < len(points):
+                        original_vertex_count = len(points)//2
+                        points = simplified
+                key = (annotation_id, label_id, tuple(points))
+                if key in existing:
+                    self.skipped += 1
+                    continue
+                existing.add(key)
+                to_create.append(models.Polygon(annotation_id=annotation_id,
+                    label_id=label_id, points=points, occluded=occluded,
+                    notes=notes, original_vertex_count=original_vertex_count,
+                    locked=self.options["lock"], last_edit_time=now))
+
+        models.Polygon.objects.bulk_create(to_create, batch_size=5000)
+        history.record([(p, history.ALL) for p in to_create], None, now)
+        tally = stats.Tally({pk: self.user.pk for pk in annotation_ids.values()})
+        for polygon in to_create:
+            tally.add_polygon(polygon)
+        tally.save()
+        models.Annotation.objects.filter(
+            pk__in={p.annotation_id for p in to_create}).update(
+                last_edit_time=now)
+        self.imported += len(to_create)
+        self.stdout.write("imported {} polygons".format(self.imported))
@@ -0,0 +1,79 @@
+# look at the profiles saved by labelous.profiling. with no options, lists them
+# with what was being done, the annotation, its document size and how long it
+# took. with --aggregate, combines all the matching profiles and prints where
+# the time went across all of them.
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+import datetime
+import io
+import pstats
+
+from labelous.profiling import PROFILE_NAME_RE
+
+class Command(BaseCommand):
+    help = "List and aggregate profiles of annotation requests."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--kind", choices=("get", "submit"),
+            help="only profiles of fetches or submissions")
+        parser.add_argument("--annotation", type=int,
+            help="only profiles of this annotation ID")
+        parser.add_argument("--min-size", type=int, default=0,
+            help="only profiles of documents at least this many bytes")
+        parser.add_argument("--min-ms", type=int, default=0,
+            help="only profiles of requests that took at least this long")
+        parser.add_argument("--aggregate", action="store_true",
+            help="print combined statistics instead of listing the profiles")
+        parser.add_argument("--sort", default="cumulative",
+            help="pstats sort key for --aggregate")
+        parser.add_argument("--limit", type=int, default=30,
+            help="number of functions to print with --aggregate")
+
+    def handle(self, *args, **options):
+        profiles = []
+        profile_dir = settings.L_PROFILE_DIR
+        if profile_dir.exists():
+            for path in sorted(profile_dir.iterdir()):
+                match = PROFILE_NAME_RE.match(path.name)
+                if match is None:
+                    continue
+                info = match.groupdict()
+                if options["kind"] is not None and \
+                        info["kind"] != options["kind"]:
+                    continue
+                if options["annotation"] is not None and \
+                        info["anno"] != str(options["annotation"]):
+                    continue
+                if int(info["size"]) < options["min_size"]:
+                    continue
+                if int(info["ms"]) < options["min_ms"]:
+                    continue
+                profiles.append((path, info))
+
+        if len(profiles) == 0:
+            self.stdout.write("no matching profiles in {}".format(profile_dir))
+            return
+
+        if not options["aggregate"]:
+            self.stdout.write("{:>6} {:>8} {:>10} {:>8}  {:<19}  {}".format(
+                "kind", "anno", "bytes", "ms", "when", "file"))
+            for path, info in profiles:
+                when = datetime.datetime.fromtimestamp(int(info["time"]))
+                self.stdout.write("{:>6} {:>8} {:>10} {:>8}  {:%Y-%m-%d %H:%M:%S}"
+                    "  {}".format(info["kind"], info["anno"], info["size"],
+                        info["ms"], when, path.name))
+            return
+
+        # pstats writes in little pieces, which self.stdout would put on
+        # separate lines
+        out = io.StringIO()
+        stats = pstats.Stats(str(profiles[0][0]), stream=out)
+        for path, _ in profiles[1:]:
+            stats.add(str(path))
+        total_ms = sum(int(info["ms"]) for _, info in profiles)
+        self.stdout.write("{} profiles, {} ms total".format(
+            len(profiles), total_ms))
+        stats.sort_stats(options["sort"]).print_stats(options["limit"])
+        self.stdout.write(out.getvalue())
@@ -0,0 +1,105 @@
+# recount the statistics tables (see stats.py) from the polygons themselves and
+# fix whatever has drifted, e.g. after data was changed outside of labelous or
+# loaded by generate_dataset.
+
+# annotations are recounted in small batches, each with its annotations locked
+# so submissions to them wait instead of being miscounted. user and label
+# totals are each recounted in one go with their table locked against writes,
+# so submissions that change polygons wait until that's done. counting labels
+# means counting every polygon, so run it when things are quiet.
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Sum, F
+
+from label_app import models
+from label_app.stats import Cardinality
+
+class Command(BaseCommand):
+    help = "Recount the polygon statistics tables and fix any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--only", choices=("annotations", "users",
+            "labels"), help="only recount this table")
+        parser.add_argument("--batch", type=int, default=2000,
+            help="annotations to recount per transaction")
+
+    def handle(self, *args, **options):
+        only = options["only"]
+        # users are totalled from the annotations, so those go first
+        if only in (None, "annotations"):
+            fixed = self.reconcile_annotations(options["batch"])
+            self.stdout.write("fixed {} annotations".format(fixed))
+        if only in (None, "users"):
+            fixed = self.reconcile_users()
+            self.stdout.write("fixed {} users".format(fixed))
+        if only in (None, "labels"):
+            fixed = self.reconcile_labels()
+            self.stdout.write("fixed {} labels".format(fixed))
+
+    def reconcile_annotations(self, batch):
+        fixed = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                pks = list(models.Annotation.objects.select_for_update(
+                    ).filter(pk__gt=last_pk).order_by("pk").values_list(
+                        "pk", flat=True)[:batch])
+                if len(pks) == 0:
+                    break
+                last_pk = pks[-1]
+
+                counts = models.Polygon.objects.filter(annotation__in=pks,
+                    deleted=False).values("annotation_id").annotate(
+                        polygons=Count("pk"),
+                        entries=Sum(Cardinality(F("points"))))
+                true = {c["annotation_id"]: (c["polygons"], c["entries"]//2)
+                    for c in counts}
+                fixed += self.replace(models.AnnotationStats.objects.filter(
+                    annotation__in=pks), "annotation_id", true)
+        return fixed
+
+    @transaction.atomic
+    def reconcile_users(self):
+        self.lock(models.UserStats)
+        counts = models.AnnotationStats.objects.filter(
+            annotation__deleted=False).values(
+                "annotation__annotator_id").annotate(
+                polygons=Sum("polygons"), vertices=Sum("vertices"))
+        true = {c["annotation__annotator_id"]:
+            (c["polygons"], c["vertices"]) for c in counts}
+        return self.replace(models.UserStats.objects.all(), "user_id", true)
+
+    @transaction.atomic
+    def reconcile_labels(self):
+        self.lock(models.LabelStats)
+        counts = models.Polygon.objects.filter(deleted=False).values(
+            "label_id").annotate(polygons=Count("pk"))
+        true = {c["label_id"]: (c["polygons"],) for c in counts}
+        return self.replace(models.LabelStats.objects.all(), "label_id", true)
+
+    # keep other transactions from changing the table until ours finishes. they
+    # can still read it.
+    def lock(self, model):
+        with connection.cursor() as cursor:
+            cursor.execute("LOCK TABLE {} IN EXCLUSIVE MODE".format(
+                connection.ops.quote_name(model._meta.db_table)))
+
+    # replace the rows in queryset with the true counts, a dict of primary key
+    # -> tuple of counts (in field order). returns how many were wrong.
+    def replace(self, queryset, key, true):
+        model = queryset.model
+        fields = [f.name for f in model._meta.concrete_fields
+            if not f.primary_key]
+        recorded = {row[0]: row[1:]
+            for row in queryset.values_list(key, *fields)}
+        zeroes = (0,)*len(fields)
+        wrong = sum(1 for pk in set(recorded.keys())|set(true.keys())
+            if recorded.get(pk, zeroes) != true.get(pk, zeroes))
+        if wrong > 0:
+            queryset.delete()
+            model.objects.bulk_create([
+                model(**{key: pk}, **dict(zip(fields, counts)))
+                for pk, counts in true.items() if counts != zeroes],
+                batch_size=5000)
+        return wrong
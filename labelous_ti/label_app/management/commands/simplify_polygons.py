@@ -0,0 +1,82 @@
+# simplify the polygons already in the database the same way newly submitted
+# ones are (see simplify.py), using each label's tolerance unless one is given
+# on the command line. polygons that were simplified before keep their
+# original vertex count.
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from datetime import datetime, timezone
+
+from label_app import models
+from label_app import labels
+from label_app import simplify
+from label_app import history
+from label_app import stats
+
+class Command(BaseCommand):
+    help = "Simplify the points of existing polygons."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tolerance", type=float,
+            help="use this tolerance for every label")
+        parser.add_argument("--batch", type=int, default=2000,
+            help="polygons to process per transaction")
+
+    def handle(self, *args, **options):
+        tolerance = options["tolerance"]
+        last_pk = 0
+        examined = 0
+        simplified = 0
+        removed_vertices = 0
+        while True:
+            with transaction.atomic():
+                # walk through the table in primary key order. locking means
+                # the tool can't change a polygon between us reading and
+                # writing it.
+                polygons = list(models.Polygon.objects.select_for_update(
+                    ).filter(pk__gt=last_pk, deleted=False).order_by("pk").only(
+                        "pk", "annotation_id", "label_id", "points",
+                        "original_vertex_count")[:options["batch"]])
+                if len(polygons) == 0:
+                    break
+                last_pk = polygons[-1].pk
+                examined += len(polygons)
+
+                now = datetime.now(timezone.utc)
+                changed = []
+                tally = stats.Tally()
+                for polygon in polygons:
+                    poly_tolerance = tolerance
+                    if poly_tolerance is None:
+                        poly_tolerance = labels.simplify_tolerance(
+                            polygon.label_id)
+                        if poly_tolerance is None:
+                            continue
+                    points = simplify.simplify(polygon.points, poly_tolerance)
+                    if len(points) == len(polygon.points):
+                        continue
+                    removed_vertices += (len(polygon.points)-len(points))//2
+                    tally.add(polygon.annotation_id, polygon.label_id,
+                        len(polygon.points)//2, -1)
+                    tally.add(polygon.annotation_id, polygon.label_id,
+                        len(points)//2)
+                    if polygon.original_vertex_count is None:
+                        polygon.original_vertex_count = len(polygon.points)//2
+                    polygon.points = points
+                    polygon.last_edit_time = now
+                    changed.append(polygon)
+
+                models.Polygon.objects.bulk_update(changed, ("points",
+                    "original_vertex_count", "last_edit_time"))
+                history.record([(p, history.POINTS) for p in changed], None,
+                    now)
+                tally.save()
+                # the annotations changed too
+                models.Annotation.objects.filter(
+                    pk__in={p.annotation_id for p in changed}).update(
+                        last_edit_time=now)
+                simplified += len(changed)
+
+            self.stdout.write("examined {}, simplified {}, removed {} "
+                "vertices".format(examined, simplified, removed_vertices))
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_app', '0007_auto_20200215_2139'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Label',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('creation_time', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='polygon',
+            name='label',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='polygons', to='label_app.label'),
+        ),
+    ]
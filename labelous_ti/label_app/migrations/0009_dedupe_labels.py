@@ -0,0 +1,63 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:42
+
+from django.db import migrations
+
+# a copy of labels.normalize_name as it was when this was written, so this
+# keeps doing the same thing if that changes
+def normalize_name(name):
+    return " ".join(name.split()).lower()
+
+# turn every distinct label string into an interned label, merging the ones
+# that only differ by case and whitespace, then point each polygon at its label.
+def dedupe_labels(apps, schema_editor):
+    Label = apps.get_model("label_app", "Label")
+    Polygon = apps.get_model("label_app", "Polygon")
+    db_alias = schema_editor.connection.alias
+
+    raw_names = Polygon.objects.using(db_alias).values_list(
+        "label_as_str", flat=True).distinct()
+    ids_by_name = {}
+    ids_by_raw_name = {}
+    for raw_name in raw_names:
+        name = normalize_name(raw_name)
+        if name == "":
+            # the tool never let these through, but just in case
+            name = "unlabeled"
+        if name not in ids_by_name:
+            ids_by_name[name] = Label.objects.using(db_alias).get_or_create(
+                name=name)[0].pk
+        ids_by_raw_name[raw_name] = ids_by_name[name]
+
+    # do one big UPDATE per chunk of names instead of one per name so we scan
+    # the polygon table as few times as possible
+    polygon_table = schema_editor.quote_name(Polygon._meta.db_table)
+    mapping = list(ids_by_raw_name.items())
+    with schema_editor.connection.cursor() as cursor:
+        for start in range(0, len(mapping), 1000):
+            chunk = mapping[start:start+1000]
+            cursor.execute(
+                "UPDATE {} AS p SET label_id = m.id FROM (VALUES {}) "
+                "AS m (raw_name, id) WHERE p.label_as_str = m.raw_name".format(
+                    polygon_table, ",".join(["(%s, %s)"]*len(chunk))),
+                [v for pair in chunk for v in pair])
+
+# put the strings back so the old column can be restored
+def undedupe_labels(apps, schema_editor):
+    Label = apps.get_model("label_app", "Label")
+    Polygon = apps.get_model("label_app", "Polygon")
+    db_alias = schema_editor.connection.alias
+
+    for label in Label.objects.using(db_alias).all():
+        Polygon.objects.using(db_alias).filter(label=label).update(
+            label_as_str=label.name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_app', '0008_label'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_labels, undedupe_labels),
+    ]
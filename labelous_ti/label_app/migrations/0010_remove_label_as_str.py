@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_app', '0009_dedupe_labels'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='polygon',
+            name='label_as_str',
+        ),
+        migrations.AlterField(
+            model_name='polygon',
+            name='label',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='polygons', to='label_app.label'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.16 on 2026-10-18 20:49
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # build the indexes without locking the (huge) tables against writes
+    atomic = False
+
+    dependencies = [
+        ('label_app', '0010_remove_label_as_str'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='annotation',
+            index=models.Index(condition=models.Q(('deleted', False)), fields=['annotator', 'image'], name='anno_live_annotator_image'),
+        ),
+        AddIndexConcurrently(
+            model_name='annotation',
+            index=models.Index(condition=models.Q(('deleted', True)), fields=['last_edit_time'], name='anno_deleted_edit_time'),
+        ),
+        AddIndexConcurrently(
+            model_name='polygon',
+            index=models.Index(condition=models.Q(('deleted', False)), fields=['annotation'], name='poly_live_annotation'),
+        ),
+        AddIndexConcurrently(
+            model_name='polygon',
+            index=models.Index(condition=models.Q(('deleted', True)), fields=['last_edit_time'], name='poly_deleted_edit_time'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-18 20:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_app', '0011_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='label',
+            name='simplify_tolerance',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='polygon',
+            name='original_vertex_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.16 on 2026-10-18 20:58
+
+from django.conf import settings
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('label_app', '0012_simplification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PolygonEdit',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('time', models.DateTimeField()),
+                ('changed', models.SmallIntegerField()),
+                ('notes', models.TextField(null=True)),
+                ('occluded', models.BooleanField(null=True)),
+                ('locked', models.BooleanField(null=True)),
+                ('deleted', models.BooleanField(null=True)),
+                ('points', models.BinaryField(null=True)),
+                ('annotation', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='label_app.annotation')),
+                ('editor', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('label', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='label_app.label')),
+                ('polygon', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='edits', to='label_app.polygon')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['annotation', 'time'], name='edit_annotation_time'), django.contrib.postgres.indexes.BrinIndex(fields=['time'], name='edit_time_brin')],
+            },
+        ),
+    ]
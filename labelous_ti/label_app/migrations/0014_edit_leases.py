@@ -0,0 +1,32 @@
+# Generated by Django 4.2.16 on 2026-10-18 21:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_app', '0013_polygon_history'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='annotation',
+            name='edit_key',
+        ),
+        migrations.AddField(
+            model_name='annotation',
+            name='lease',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='annotation',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='polygon',
+            name='anno_lease',
+            field=models.BigIntegerField(blank=True, default=None, null=True),
+        ),
+    ]
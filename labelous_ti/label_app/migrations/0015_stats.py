@@ -0,0 +1,63 @@
+# Generated by Django 4.2.16 on 2026-10-18 21:07
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# count up the polygons that already exist
+def seed_stats(apps, schema_editor):
+    tables = {name: apps.get_model("label_app", name)._meta.db_table
+        for name in ("Annotation", "Polygon", "AnnotationStats", "UserStats",
+            "LabelStats")}
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO {AnnotationStats} (annotation_id, polygons, vertices)
+            SELECT annotation_id, count(*), sum(cardinality(points))/2
+            FROM {Polygon} WHERE NOT deleted GROUP BY annotation_id
+        """.format(**tables))
+        cursor.execute("""
+            INSERT INTO {UserStats} (user_id, polygons, vertices)
+            SELECT a.annotator_id, sum(s.polygons), sum(s.vertices)
+            FROM {AnnotationStats} s JOIN {Annotation} a ON a.id = s.annotation_id
+            WHERE NOT a.deleted GROUP BY a.annotator_id
+        """.format(**tables))
+        cursor.execute("""
+            INSERT INTO {LabelStats} (label_id, polygons)
+            SELECT label_id, count(*)
+            FROM {Polygon} WHERE NOT deleted GROUP BY label_id
+        """.format(**tables))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('label_app', '0014_edit_leases'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnnotationStats',
+            fields=[
+                ('annotation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='label_app.annotation')),
+                ('polygons', models.IntegerField(default=0)),
+                ('vertices', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LabelStats',
+            fields=[
+                ('label', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='label_app.label')),
+                ('polygons', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='labelous_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('polygons', models.IntegerField(default=0)),
+                ('vertices', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.16 on 2026-10-18 21:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('label_app', '0015_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='annotation',
+            name='claim_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='annotation',
+            name='priority',
+            field=models.FloatField(default=1),
+        ),
+        migrations.AddField(
+            model_name='annotation',
+            name='reviewer',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reviews', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,85 @@
+from django.db import migrations, transaction
+
+from datetime import timedelta
+import struct
+import zlib
+
+# copies of history.pack_points and the bits of PolygonEdit.changed as they
+# were when this was written, so this keeps working if they change
+CREATED = 1
+ALL = 127
+
+def pack_points(points):
+    prev = 0
+    deltas = []
+    for v in points:
+        v = round(v*100)
+        deltas.append(v-prev)
+        prev = v
+    return zlib.compress(struct.pack("<{}i".format(len(deltas)), *deltas))
+
+# start every existing polygon's history off with its current state. replaying
+# has to see a polygon's creation to know about it at all.
+
+# polygons without any history get it as of their last edit; replaying to
+# before then won't show them. polygons edited since the history table was
+# created, but before this ran, have edits but no creation. they get it just
+# before their first recorded edit (or when they were created, if that's
+# earlier), so replaying to after that edit is right; replaying to before it
+# shows the values that edit set.
+
+# there can be tens of millions of polygons, so this isn't one big transaction:
+# each batch commits on its own. polygons that already have their creation
+# recorded (made since the history table was created, or by an earlier run of
+# this that was interrupted) are left alone, so it's safe to run again.
+def seed_history(apps, schema_editor):
+    Polygon = apps.get_model("label_app", "Polygon")
+    PolygonEdit = apps.get_model("label_app", "PolygonEdit")
+    db_alias = schema_editor.connection.alias
+
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=db_alias):
+            polygons = list(Polygon.objects.using(db_alias).filter(
+                pk__gt=last_pk).order_by("pk")[:5000])
+            if len(polygons) == 0:
+                break
+            last_pk = polygons[-1].pk
+            created = set()
+            first_edit = {}
+            for pk, changed, time in PolygonEdit.objects.using(
+                    db_alias).filter(polygon__in=[p.pk for p in polygons]
+                    ).values_list("polygon_id", "changed", "time"):
+                if changed & CREATED:
+                    created.add(pk)
+                if pk not in first_edit or time < first_edit[pk]:
+                    first_edit[pk] = time
+            to_create = []
+            for p in polygons:
+                if p.pk in created:
+                    continue
+                if p.pk in first_edit:
+                    # replaying goes in time order, so this has to come
+                    # strictly before the edit
+                    time = min(p.creation_time,
+                        first_edit[p.pk]-timedelta(microseconds=1))
+                else:
+                    time = p.last_edit_time
+                to_create.append(PolygonEdit(polygon_id=p.pk,
+                    annotation_id=p.annotation_id, time=time, changed=ALL,
+                    label_id=p.label_id, notes=p.notes, occluded=p.occluded,
+                    locked=p.locked, deleted=p.deleted,
+                    points=pack_points(p.points)))
+            PolygonEdit.objects.using(db_alias).bulk_create(to_create)
+
+class Migration(migrations.Migration):
+    # see above
+    atomic = False
+
+    dependencies = [
+        ('label_app', '0016_review_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_history, migrations.RunPython.noop),
+    ]
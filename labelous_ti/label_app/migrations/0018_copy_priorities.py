@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+# copy each image's priority onto its annotations. one UPDATE of the whole
+# table would lock every annotation until it finished, so this goes through
+# them in batches by ID, each committed on its own.
+def copy_priorities(apps, schema_editor):
+    Annotation = apps.get_model("label_app", "Annotation")
+    Image = apps.get_model("image_mgr", "Image")
+    db_alias = schema_editor.connection.alias
+
+    last_pk = Annotation.objects.using(db_alias).aggregate(
+        models.Max("pk"))["pk__max"] or 0
+    for start in range(0, last_pk, 10000):
+        Annotation.objects.using(db_alias).filter(pk__gt=start,
+            pk__lte=start+10000).update(priority=models.Subquery(
+                Image.objects.using(db_alias).filter(
+                    pk=models.OuterRef("image_id")).values("priority")[:1]))
+
+
+class Migration(migrations.Migration):
+    # see above
+    atomic = False
+
+    dependencies = [
+        ('label_app', '0017_seed_history'),
+        ('image_mgr', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_priorities, migrations.RunPython.noop),
+    ]
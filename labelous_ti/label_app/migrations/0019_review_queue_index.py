@@ -0,0 +1,18 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # build the index without locking the (huge) table against writes
+    atomic = False
+
+    dependencies = [
+        ('label_app', '0018_copy_priorities'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='annotation',
+            index=models.Index(condition=models.Q(('deleted', False), ('finished', True), ('locked', False)), fields=['-priority', 'last_edit_time'], name='anno_review_queue'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 21:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_app', '0019_review_queue_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='annotation',
+            name='review_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
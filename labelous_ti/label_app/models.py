@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import BrinIndex
 from django.core.exceptions import ValidationError
 
 from image_mgr.models import Image
@@ -22,10 +23,60 @@ class Annotation(models.Model):
     deleted = models.BooleanField(default=False)
     # when this annotation was created
     creation_time = models.DateTimeField(auto_now_add=True)
-    # annotation updates are only accepted if they have this key
-    edit_key = models.BinaryField(max_length=16)
+    # goes up by one every time a submission changes the annotation. see
+    # "edit leases" in views.py.
+    version = models.IntegerField(default=0)
+    # the edit lease the last changing submission was made under
+    lease = models.BigIntegerField(null=True, blank=True)
     # when this annotation, or any of its polygons, was last changed.
     last_edit_time = models.DateTimeField()
+    # a copy of the image's priority, so the review queue can be ordered by an
+    # index. ImageAdmin keeps it up to date.
+    priority = models.FloatField(default=1)
+    # who claimed this annotation for review (see review_views.py), or last reviewed
+    # it, and when it was claimed. the claim is released when it's reviewed
+    # or runs out after L_REVIEW_CLAIM_SECONDS.
+    reviewer = models.ForeignKey(User, on_delete=models.SET_NULL, null=True,
+        blank=True, db_index=False, related_name="reviews")
+    claim_time = models.DateTimeField(null=True, blank=True)
+    # when the reviewer last approved or rejected it
+    review_time = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # almost every query only wants annotations that aren't deleted, so we
+        # index only those. the deleted ones are only looked for by the
+        # compact_deleted command.
+        indexes = [
+            models.Index(fields=["annotator", "image"],
+                condition=models.Q(deleted=False),
+                name="anno_live_annotator_image"),
+            models.Index(fields=["last_edit_time"],
+                condition=models.Q(deleted=True),
+                name="anno_deleted_edit_time"),
+            # the review queue, in the order it's claimed. it only holds what's
+            # waiting to be reviewed, so it stays small however many
+            # annotations there are.
+            models.Index(fields=["-priority", "last_edit_time"],
+                condition=models.Q(finished=True, locked=False,
+                    deleted=False),
+                name="anno_review_queue"),
+        ]
+
+# a label that polygons can have. labels are interned so each polygon only
+# stores a small ID instead of its own copy of the string, and so every
+# polygon with the "same" label really does have the same label.
+class Label(models.Model):
+    # the label's text, normalized by labels.normalize_name
+    name = models.CharField(max_length=255, unique=True)
+    # when this label was first used
+    creation_time = models.DateTimeField(auto_now_add=True)
+    # polygons with this label are simplified (see simplify.py) so no removed
+    # vertex is more than this many pixels from the result. if None,
+    # L_SIMPLIFY_TOLERANCE is used.
+    simplify_tolerance = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
 
 def validate_is_points(value):
     if len(value) % 2 != 0:
@@ -40,21 +91,106 @@ class Polygon(models.Model):
     creation_time = models.DateTimeField(auto_now_add=True)
     # when this polygon was last edited
     last_edit_time = models.DateTimeField()
-    # this polygon's label. for now a string, but will be changed later
-    label_as_str = models.CharField(max_length=255)
+    # this polygon's label. we don't let labels be deleted while polygons still
+    # use them.
+    label = models.ForeignKey(Label, on_delete=models.PROTECT,
+        related_name="polygons")
     # any notes the user attached to this polygon
     notes = models.TextField(blank=True)
     # the points in this polygon as consecutive x, y entries. we could use a
     # nested array, but it's hard to deal with in the admin interface. so
     # instead we just enforce that this field's length is a multiple of 2.
     points = ArrayField(models.FloatField(), validators=[validate_is_points])
+    # if the points were simplified before being stored, how many vertices
+    # there were originally. None if they weren't.
+    original_vertex_count = models.IntegerField(null=True, blank=True)
     # occluded: if the polygon is considered occluded by another object.
     # the annotator has a checkbox to set it.
     occluded = models.BooleanField(default=False)
-    # index of the polygon within the annotation file; used to update polygons
-    # correctly
+    # index of the polygon within the annotation file, and the edit lease of
+    # that file; used to update polygons correctly
     anno_index = models.IntegerField(null=True, blank=True, default=None)
+    anno_lease = models.BigIntegerField(null=True, blank=True, default=None)
     # locked: if true, the annotator cannot touch it anymore
     locked = models.BooleanField(default=False)
     # deleted: if true, polygon can't be seen anymore
     deleted = models.BooleanField(default=False)
+
+    class Meta:
+        # see Annotation
+        indexes = [
+            models.Index(fields=["annotation"],
+                condition=models.Q(deleted=False),
+                name="poly_live_annotation"),
+            models.Index(fields=["last_edit_time"],
+                condition=models.Q(deleted=True),
+                name="poly_deleted_edit_time"),
+        ]
+
+# one accepted change to a polygon, for the edit history (see history.py).
+# rows are only ever added, never changed. only the fields in changed are
+# filled in; the rest are None. the polygon, annotation, editor and label
+# aren't enforced by the database so the history outlives them (e.g. after
+# compact_deleted removes a polygon) and adding to it never has to check them.
+# only the indexes replaying needs are kept, so adding stays cheap.
+class PolygonEdit(models.Model):
+    # there can be many more of these than polygons
+    id = models.BigAutoField(primary_key=True)
+    # the polygon that was changed
+    polygon = models.ForeignKey(Polygon, on_delete=models.DO_NOTHING,
+        db_constraint=False, related_name="edits")
+    # the annotation it's on, so its history can be found quickly
+    annotation = models.ForeignKey(Annotation, on_delete=models.DO_NOTHING,
+        db_constraint=False, db_index=False, related_name="+")
+    # who made the change. None if it wasn't made by a user (e.g. an import)
+    editor = models.ForeignKey(User, on_delete=models.DO_NOTHING,
+        db_constraint=False, db_index=False, null=True, related_name="+")
+    # when the change was made
+    time = models.DateTimeField()
+    # which fields changed, as history.CREATED, history.LABEL, etc. or'd
+    # together
+    changed = models.SmallIntegerField()
+    # the new values of the fields that changed
+    label = models.ForeignKey(Label, on_delete=models.DO_NOTHING,
+        db_constraint=False, db_index=False, null=True, related_name="+")
+    notes = models.TextField(null=True)
+    occluded = models.BooleanField(null=True)
+    locked = models.BooleanField(null=True)
+    deleted = models.BooleanField(null=True)
+    # packed by history.pack_points
+    points = models.BinaryField(null=True)
+
+    class Meta:
+        indexes = [
+            # replaying an annotation reads its edits in time order
+            models.Index(fields=["annotation", "time"],
+                name="edit_annotation_time"),
+            # rows are added in time order, so a BRIN index finds ranges of
+            # time while staying tiny
+            BrinIndex(fields=["time"], name="edit_time_brin"),
+        ]
+
+# running totals of live (undeleted) polygons, so nobody has to count them.
+# they are kept up to date by stats.py in the same transaction as the changes
+# they count, and the reconcile_stats command fixes them if they drift. a
+# missing row means zero.
+
+# the polygons on one annotation
+class AnnotationStats(models.Model):
+    annotation = models.OneToOneField(Annotation, on_delete=models.CASCADE,
+        primary_key=True, related_name="stats")
+    polygons = models.IntegerField(default=0)
+    vertices = models.BigIntegerField(default=0)
+
+# the polygons on all of one user's live annotations
+class UserStats(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+        primary_key=True, related_name="labelous_stats")
+    polygons = models.IntegerField(default=0)
+    vertices = models.BigIntegerField(default=0)
+
+# the polygons with one label
+class LabelStats(models.Model):
+    label = models.OneToOneField(Label, on_delete=models.CASCADE,
+        primary_key=True, related_name="stats")
+    polygons = models.IntegerField(default=0)
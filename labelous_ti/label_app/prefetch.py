@@ -0,0 +1,176 @@
+# get ready for the images the user is about to look at. when the user clicks
+# next in the tool, it asks fetch_image.cgi for the next image's name, and only
+# then loads its annotation document and the image itself, so the user waits
+# for all of that every single time. but we know the order the user goes
+# through their annotations in (the same loop next_annotation and
+# prev_annotation walk), so we can do the slow parts ahead of time.
+
+# whenever an image is served, the next and previous L_PREFETCH_COUNT images in
+# the loop are warmed in a background thread: their files are pulled into the
+# OS page cache, their transcodes (for the browser that asked) are made, and
+# the polygons of their annotation documents are gathered (from the primary)
+# and put in the default cache. the annotation document can't be built entirely ahead of time
+# because fetching it hands out a new edit lease.
+
+# annotation documents also carry Link rel=preload headers for the adjacent
+# images, so the browser fetches them before the user even clicks.
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.urls import reverse
+
+import concurrent.futures
+import logging
+import os
+import threading
+
+from . import models
+import image_mgr.models
+from image_mgr import transcode
+from labelous import db_router
+
+logger = logging.getLogger(__name__)
+
+# warming mostly waits on the disk and the database, so a couple of threads
+# are plenty
+_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2,
+    thread_name_prefix="labelous_prefetch")
+# how many warmings are waiting or running. the pool's queue has no limit of
+# its own, so we keep count and drop new ones past L_PREFETCH_QUEUE_SIZE:
+# under that much load, they'd be done too late to help anyway.
+_pending = 0
+_pending_lock = threading.Lock()
+
+# return the image IDs of the user's annotations, in the order next_annotation
+# goes through them (by annotation ID). cached for a while since users rarely
+# get new annotations.
+def navigation_order(user_id):
+    key = "labelous_nav:{}".format(user_id)
+    order = cache.get(key)
+    if order is None:
+        order = list(models.Annotation.objects.using(
+            db_router.replica_alias()).filter(
+                annotator_id=user_id, deleted=False).order_by(
+                    "pk").values_list("image_id", flat=True))
+        cache.set(key, order, settings.L_PREFETCH_TTL)
+    return order
+
+# return the image IDs the user will get by pressing next count times, and by
+# pressing previous count times, starting from the given image. this is the
+# same search next_annotation and prev_annotation do, just in memory.
+def neighbours(user_id, image_id, count):
+    order = navigation_order(user_id)
+    next_ids = []
+    prev_ids = []
+    if len(order) == 0:
+        return next_ids, prev_ids
+
+    curr = image_id
+    for _ in range(count):
+        # the first annotation whose image has a bigger ID, or wrap around
+        curr = next((i for i in order if i > curr), order[0])
+        if curr == image_id or curr in next_ids:
+            break
+        next_ids.append(curr)
+
+    curr = image_id
+    for _ in range(count):
+        # the last annotation whose image has a smaller ID, or wrap around
+        curr = next((i for i in reversed(order) if i < curr), order[-1])
+        if curr == image_id or curr in prev_ids:
+            break
+        prev_ids.append(curr)
+
+    return next_ids, prev_ids
+
+# return a Link header value asking the browser to preload the images next to
+# the given one, or None if there aren't any
+def preload_links(user_id, image_id):
+    if settings.L_PRELOAD_COUNT == 0:
+        return None
+    next_ids, prev_ids = neighbours(user_id, image_id,
+        settings.L_PRELOAD_COUNT)
+    # it's the same URL the tool will load, so the browser can use the copy it
+    # preloaded
+    links = ["<{}>; rel=preload; as=image".format(
+            reverse("image_file", kwargs={"image_id": i}))
+        for i in next_ids+prev_ids]
+    return ", ".join(links) if len(links) > 0 else None
+
+# start warming the images next to the one just served to the user. accept is
+# the Accept header the image was requested with, so we transcode to the same
+# format. this returns immediately.
+def warm(user_id, image_id, accept):
+    global _pending
+    if settings.L_PREFETCH_COUNT == 0:
+        return
+    with _pending_lock:
+        if _pending >= settings.L_PREFETCH_QUEUE_SIZE:
+            return
+        _pending += 1
+    try:
+        # the tool loads an image more than once in a row sometimes; only warm
+        # once for it
+        if not cache.add("labelous_prefetch:{}:{}".format(user_id, image_id),
+                True, 30):
+            _done()
+            return
+        _pool.submit(_warm, user_id, image_id, accept)
+    except Exception:
+        _done()
+        # it's only an optimization
+        logger.warning("prefetch failed", exc_info=True)
+
+def _done():
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+def _warm(user_id, image_id, accept):
+    # views imports us
+    from . import views
+
+    try:
+        next_ids, prev_ids = neighbours(user_id, image_id,
+            settings.L_PREFETCH_COUNT)
+        image_ids = next_ids+prev_ids
+        if len(image_ids) == 0:
+            return
+
+        alias = db_router.replica_alias()
+        images = image_mgr.models.Image.objects.using(alias).in_bulk(image_ids)
+        for image in images.values():
+            if not image.visible:
+                continue
+            path, _ = transcode.negotiate(image, accept)
+            _read_ahead(path)
+
+        # the polygons are cached as current, so they have to come from the
+        # primary. a replica could be behind.
+        annotations = models.Annotation.objects.using("default").filter(
+            annotator_id=user_id, image_id__in=image_ids, deleted=False)
+        for annotation in annotations:
+            if cache.get(views.objects_cache_key(annotation)) is not None:
+                continue
+            polygons = list(annotation.polygons.using("default").filter(
+                deleted=False).select_related("label"))
+            cache.set(views.objects_cache_key(annotation),
+                views.polygon_columns(annotation, polygons),
+                settings.L_PREFETCH_TTL)
+    except Exception:
+        # it's only an optimization
+        logger.warning("prefetch failed", exc_info=True)
+    finally:
+        # this thread's connections would otherwise stay open forever
+        connections.close_all()
+        _done()
+
+# get the file into the OS page cache without reading it ourselves
+def _read_ahead(path):
+    with open(path, "rb") as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        else:
+            while f.read(1024*1024):
+                pass
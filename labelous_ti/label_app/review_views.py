@@ -0,0 +1,139 @@
+# the review queue. an annotator marks an annotation finished when they want it
+# reviewed; a reviewer (any staff member) then approves it, which locks it, or
+# rejects it, which sends it back to the annotator by unmarking it finished.
+# the queue is every finished annotation that isn't locked or deleted, highest
+# image priority first, then longest waiting. a partial index (see
+# Annotation.Meta) holds exactly those in exactly that order, so taking
+# annotations off the front doesn't get slower as the backlog grows.
+
+# reviewers claim annotations before reviewing them so two reviewers don't get
+# the same ones. claiming locks the rows it takes and skips rows somebody else
+# is claiming at that moment, so any number of reviewers can claim at once
+# without waiting on each other. a claim runs out after
+# L_REVIEW_CLAIM_SECONDS, so annotations claimed by a reviewer who wandered off
+# go back in the queue.
+
+# all of these take and return JSON:
+#   POST label/review/claim {"count": 10}
+#     -> {"annotations": [{"anno_id": 1, "image_id": 2, "annotator_id": 3}]}
+#   POST label/review/approve
+#     {"annotations": [{"id": 1, "last_edit_time": "..."}, ...]}
+#     -> {"approved": 1}
+#   POST label/review/reject (the same) -> {"rejected": 1}
+# the polygons are fetched with the batch view (see batch_views.py), and each
+# annotation's last_edit_time from it is sent back with the decision. the
+# annotator can keep editing while it's being reviewed, so approve and reject
+# only touch annotations that haven't changed since, and that the reviewer
+# still has claimed, and say how many that was. the others have to be fetched
+# and looked at again.
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import SuspiciousOperation
+from django.db import transaction
+from django.db.models import Q
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+
+import json
+from datetime import datetime, timedelta, timezone
+
+from . import models
+
+# the annotations waiting for review. this has to match the index's condition
+# for the index to be used.
+def queue():
+    return models.Annotation.objects.filter(finished=True, locked=False,
+        deleted=False)
+
+# claims made before this have run out
+def _claim_expiry(now):
+    return now - timedelta(seconds=settings.L_REVIEW_CLAIM_SECONDS)
+
+# the annotations the reviewer has claimed (and whose claims haven't run out)
+# which are still as they were when the reviewer fetched them. seen is a list
+# of (annotation ID, last edit time).
+def _claimed_by(reviewer, seen, now):
+    unchanged = Q(pk__in=[])
+    for pk, last_edit_time in seen:
+        unchanged |= Q(pk=pk, last_edit_time=last_edit_time)
+    return queue().filter(unchanged, reviewer=reviewer,
+        claim_time__gte=_claim_expiry(now))
+
+def _read_body(request):
+    try:
+        data = json.loads(request.body)
+    except ValueError as e:
+        raise SuspiciousOperation("bad json") from e
+    if not isinstance(data, dict):
+        raise SuspiciousOperation("bad json")
+    return data
+
+# read the annotations the decision is for, as a list of (ID, last edit time)
+def _read_seen(request):
+    annotations = _read_body(request).get("annotations")
+    if not isinstance(annotations, list):
+        raise SuspiciousOperation("bad annotations")
+    if len(annotations) > settings.L_BATCH_LIMIT:
+        raise SuspiciousOperation("too many annotations")
+    seen = []
+    try:
+        for annotation in annotations:
+            pk = annotation["id"]
+            if type(pk) is not int:
+                raise Exception("bad id")
+            last_edit_time = datetime.fromisoformat(
+                annotation["last_edit_time"])
+            if last_edit_time.tzinfo is None:
+                raise Exception("no time zone")
+            seen.append((pk, last_edit_time))
+    except Exception as e:
+        raise SuspiciousOperation("bad annotations") from e
+    return seen
+
+@require_POST
+@staff_member_required
+def claim(request):
+    count = _read_body(request).get("count", 1)
+    if type(count) is not int:
+        raise SuspiciousOperation("bad count")
+    count = max(0, min(count, settings.L_BATCH_LIMIT))
+
+    now = datetime.now(timezone.utc)
+    with transaction.atomic():
+        # walk the queue in index order, passing over annotations somebody
+        # else has claimed and rows another reviewer is claiming right now
+        annotations = list(queue().filter(
+                Q(claim_time__isnull=True) |
+                Q(claim_time__lt=_claim_expiry(now))
+            ).order_by("-priority", "last_edit_time").select_for_update(
+                skip_locked=True).values_list(
+                    "pk", "image_id", "annotator_id")[:count])
+        models.Annotation.objects.filter(
+            pk__in=[a[0] for a in annotations]).update(
+                reviewer=request.user, claim_time=now)
+
+    return JsonResponse({"annotations": [
+        {"anno_id": pk, "image_id": image_id, "annotator_id": annotator_id}
+        for pk, image_id, annotator_id in annotations]})
+
+@require_POST
+@staff_member_required
+def approve(request):
+    now = datetime.now(timezone.utc)
+    # locking takes it out of the queue. the reviewer is kept as a record of
+    # who approved it. locking changes the document (everything is verified),
+    # so it counts as an edit.
+    approved = _claimed_by(request.user, _read_seen(request), now).update(
+        locked=True, claim_time=None, review_time=now, last_edit_time=now)
+    return JsonResponse({"approved": approved})
+
+@require_POST
+@staff_member_required
+def reject(request):
+    now = datetime.now(timezone.utc)
+    # back to the annotator. it comes back in the queue when they mark it
+    # finished again.
+    rejected = _claimed_by(request.user, _read_seen(request), now).update(
+        finished=False, claim_time=None, review_time=now)
+    return JsonResponse({"rejected": rejected})
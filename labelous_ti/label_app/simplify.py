@@ -0,0 +1,91 @@
+# simplify polygons by removing vertices that barely change their shape. when
+# someone traces freehand, the tool records a vertex every few pixels, and we
+# end up with thousands of them along nearly straight lines. every later fetch
+# and submit has to push all of them around.
+
+# we use the Douglas-Peucker algorithm: keep the two ends of a chain of
+# vertices, find the vertex in between farthest from the line joining them, and
+# if it's farther than the tolerance, keep it and repeat on both halves.
+# otherwise everything in between is dropped. the distance calculation is done
+# with numpy if it's installed, which is much faster on long chains.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# return the index of the vertex between start and end (exclusive) farthest
+# from the segment between them, along with its squared distance
+def _farthest(xs, ys, start, end):
+    ax, ay = xs[start], ys[start]
+    dx, dy = xs[end]-ax, ys[end]-ay
+    length_sq = dx*dx + dy*dy
+
+    if numpy is not None:
+        px = xs[start+1:end] - ax
+        py = ys[start+1:end] - ay
+        if length_sq > 0:
+            # project onto the segment, clamped so we measure to the ends
+            # instead of the infinite line
+            t = numpy.clip((px*dx + py*dy)/length_sq, 0, 1)
+            px = px - t*dx
+            py = py - t*dy
+        dist_sq = px*px + py*py
+        i = int(numpy.argmax(dist_sq))
+        return start+1+i, float(dist_sq[i])
+
+    best_i, best_dist_sq = start+1, -1
+    for i in range(start+1, end):
+        px, py = xs[i]-ax, ys[i]-ay
+        if length_sq > 0:
+            t = min(1, max(0, (px*dx + py*dy)/length_sq))
+            px, py = px - t*dx, py - t*dy
+        dist_sq = px*px + py*py
+        if dist_sq > best_dist_sq:
+            best_i, best_dist_sq = i, dist_sq
+    return best_i, best_dist_sq
+
+# simplify the polygon given as a flat list of x, y coordinates so that no
+# removed vertex was more than tolerance away from the result. returns a new
+# flat list, or the same list if nothing could be removed.
+def simplify(points, tolerance):
+    n = len(points)//2
+    if n <= 3 or tolerance <= 0:
+        return points
+
+    # the polygon is a closed ring, so it has no ends to start from. we split
+    # it at the first vertex and the vertex farthest from it, which are surely
+    # both important, and simplify the two chains between them.
+    xs = list(points[0::2])
+    ys = list(points[1::2])
+    x0, y0 = xs[0], ys[0]
+    far = max(range(n), key=lambda i: (xs[i]-x0)**2 + (ys[i]-y0)**2)
+    # repeat the first vertex at the end so the second chain can end on it
+    xs.append(x0)
+    ys.append(y0)
+    if numpy is not None:
+        xs = numpy.array(xs)
+        ys = numpy.array(ys)
+
+    keep = [False]*(n+1)
+    keep[0] = keep[far] = keep[n] = True
+    tolerance_sq = tolerance*tolerance
+    chains = [(0, far), (far, n)]
+    while len(chains) > 0:
+        start, end = chains.pop()
+        if end - start < 2:
+            continue
+        i, dist_sq = _farthest(xs, ys, start, end)
+        if dist_sq > tolerance_sq:
+            keep[i] = True
+            chains.append((start, i))
+            chains.append((i, end))
+
+    kept = [i for i in range(n) if keep[i]]
+    if len(kept) == n or len(kept) < 3:
+        # nothing to remove, or so thin it would stop being a polygon
+        return points
+    out = []
+    for i in kept:
+        out.extend((points[2*i], points[2*i+1]))
+    return out
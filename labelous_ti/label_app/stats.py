@@ -0,0 +1,126 @@
+# keep the statistics tables (AnnotationStats, UserStats and LabelStats) up to
+# date. whatever changes polygons adds up what it did in a Tally and saves it in
+# the same transaction, which adds it onto the totals with one upsert per
+# table. adding is all it ever does, so concurrent changes can't overwrite each
+# other's counts.
+
+# users' totals only count the polygons of their live annotations, the ones
+# they can see. deleting, undeleting or handing over an annotation moves its
+# counts with add_to_users.
+
+# the rows are upserted in primary key order, so two transactions touching the
+# same rows always lock them in the same order and can't deadlock. the busiest
+# rows (popular labels) stay locked until the transaction ends, which is why
+# the tally is saved as the last thing before committing.
+
+from django.db import connection
+from django.db.models import Count, Sum, F, Func
+
+import collections
+
+from . import models
+
+# the number of entries in an array column
+class Cardinality(Func):
+    function = "cardinality"
+
+class Tally:
+    # annotators maps the IDs of live annotations to their annotator's ID, if
+    # they're already known. the rest are looked up when saving.
+    def __init__(self, annotators=None):
+        self.annotators = dict(annotators or {})
+        # annotation ID -> [polygons, vertices]
+        self.annotations = collections.defaultdict(lambda: [0, 0])
+        # label ID -> polygons
+        self.labels = collections.defaultdict(int)
+
+    # count a live polygon on the given annotation with the given label and
+    # number of vertices. sign is -1 to uncount one instead.
+    def add(self, annotation_id, label_id, vertices, sign=1):
+        counts = self.annotations[annotation_id]
+        counts[0] += sign
+        counts[1] += sign*vertices
+        self.labels[label_id] += sign
+
+    # count a polygon (model instance or anything with the same attributes)
+    # in its current state, if it's live
+    def add_polygon(self, polygon, sign=1):
+        if not polygon.deleted:
+            self.add(polygon.annotation_id, polygon.label_id,
+                len(polygon.points)//2, sign)
+
+    # count all the live polygons in the queryset, without loading them
+    def add_polygons(self, queryset, sign=1):
+        groups = queryset.filter(deleted=False).values(
+            "annotation_id", "label_id").annotate(
+                polygons=Count("pk"), entries=Sum(Cardinality(F("points"))))
+        for group in groups:
+            counts = self.annotations[group["annotation_id"]]
+            counts[0] += sign*group["polygons"]
+            counts[1] += sign*((group["entries"] or 0)//2)
+            self.labels[group["label_id"]] += sign*group["polygons"]
+
+    def save(self):
+        annotations = {pk: counts for pk, counts in self.annotations.items()
+            if counts != [0, 0]}
+        labels = {pk: n for pk, n in self.labels.items() if n != 0}
+
+        missing = set(annotations.keys()) - set(self.annotators.keys())
+        if len(missing) > 0:
+            self.annotators.update(models.Annotation.objects.filter(
+                pk__in=missing, deleted=False).values_list(
+                    "pk", "annotator_id"))
+        users = collections.defaultdict(lambda: [0, 0])
+        for pk, (polygons, vertices) in annotations.items():
+            if pk not in self.annotators:
+                # deleted, so it's not in anyone's totals
+                continue
+            counts = users[self.annotators[pk]]
+            counts[0] += polygons
+            counts[1] += vertices
+
+        _add(models.AnnotationStats, ("polygons", "vertices"),
+            [(pk, *counts) for pk, counts in annotations.items()])
+        _add(models.UserStats, ("polygons", "vertices"),
+            [(pk, *counts) for pk, counts in users.items() if counts != [0, 0]])
+        _add(models.LabelStats, ("polygons",),
+            [(pk, n) for pk, n in labels.items()])
+
+        self.annotations.clear()
+        self.labels.clear()
+
+# add (sign 1) or take away (sign -1) the counts of the given annotations
+# (a dict of annotation ID -> annotator ID) to or from their annotators'
+# totals, for when they're undeleted, deleted or change hands. the annotations
+# should be locked so submissions can't change their counts meanwhile.
+def add_to_users(annotators, sign):
+    users = collections.defaultdict(lambda: [0, 0])
+    for pk, polygons, vertices in models.AnnotationStats.objects.filter(
+            annotation__in=annotators.keys()).values_list(
+                "annotation_id", "polygons", "vertices"):
+        counts = users[annotators[pk]]
+        counts[0] += sign*polygons
+        counts[1] += sign*vertices
+    _add(models.UserStats, ("polygons", "vertices"),
+        [(pk, *counts) for pk, counts in users.items() if counts != [0, 0]])
+
+# add the given rows of (primary key, values of fields...) onto the model's
+# table, creating the rows that don't exist yet
+def _add(model, fields, rows):
+    if len(rows) == 0:
+        return
+    rows.sort()
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    key = qn(model._meta.pk.column)
+    columns = [qn(model._meta.get_field(f).column) for f in fields]
+    placeholder = "({})".format(", ".join(["%s"]*(len(fields)+1)))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO {table} ({key}, {columns}) VALUES {values} "
+            "ON CONFLICT ({key}) DO UPDATE SET {updates}".format(
+                table=table, key=key, columns=", ".join(columns),
+                values=", ".join([placeholder]*len(rows)),
+                updates=", ".join("{c} = {t}.{c} + EXCLUDED.{c}".format(
+                    c=c, t=table) for c in columns)),
+            [v for row in rows for v in row])
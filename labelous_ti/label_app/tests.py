@@ -1,3 +1,399 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+    override_settings)
 
-# Create your tests here.
+import json
+import pathlib
+import tempfile
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import xml.etree.ElementTree as ET
+
+from labelous import db_router
+from labelous import profiling
+from . import models
+from . import views
+from . import labels
+from . import history
+from . import json_format
+import image_mgr.models
+
+# leases live in the default cache, which has to be shared in production. the
+# tests are one process, so a private one will do.
+LOCAL_CACHE = {"default": {
+    "BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+GET_URL = "/label/Annotations/f/img{}.xml"
+SUBMIT_URL = "/label/annotationTools/perl/submit.cgi"
+
+# the submit path's tests, which go through the views like the tool does. they
+# need the database (postgres).
+class ToolMixin:
+    def setUp(self):
+        settings = override_settings(CACHES=LOCAL_CACHE)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+        # the label IDs are remembered across tests, but the labels aren't
+        labels.forget_label_ids()
+        self.addCleanup(labels.forget_label_ids)
+
+        self.user = User.objects.create_user("annotator", password="x")
+        self.image = image_mgr.models.Image.objects.create(file_path="a.jpg",
+            available=True, visible=True, uploader=self.user)
+        self.annotation = models.Annotation.objects.create(
+            annotator=self.user, image=self.image,
+            last_edit_time=datetime.now(timezone.utc))
+        self.client.force_login(self.user)
+
+    # get the annotation document like the tool does
+    def get(self):
+        resp = self.client.get(GET_URL.format(self.image.pk))
+        self.assertEqual(resp.status_code, 200)
+        return ET.fromstring(resp.content)
+
+    # send the document back. returns the response's status code.
+    def submit(self, root):
+        return self.client.post(SUBMIT_URL, ET.tostring(root),
+            content_type="text/xml").status_code
+
+    # add a new polygon to the document, like drawing one in the tool
+    def draw(self, root, name, points):
+        obj = ET.SubElement(root, "object")
+        ET.SubElement(obj, "name").text = name
+        ET.SubElement(obj, "deleted").text = "0"
+        ET.SubElement(obj, "verified").text = "0"
+        ET.SubElement(obj, "occluded").text = "no"
+        ET.SubElement(obj, "attributes").text = ""
+        polygon = ET.SubElement(obj, "polygon")
+        ET.SubElement(polygon, "username").text = "hi"
+        for i in range(0, len(points), 2):
+            pt = ET.SubElement(polygon, "pt")
+            ET.SubElement(pt, "x").text = str(points[i])
+            ET.SubElement(pt, "y").text = str(points[i+1])
+        return obj
+
+    def live_polygons(self):
+        return list(models.Polygon.objects.filter(
+            annotation=self.annotation, deleted=False).order_by("pk"))
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = db_router.ReplicaRouter()
+
+    def test_migrations_only_on_primary(self):
+        self.assertTrue(self.router.allow_migrate("default", "label_app"))
+        self.assertFalse(self.router.allow_migrate("replica", "label_app"))
+
+    def test_writes_go_to_primary(self):
+        token = db_router._replica.set("replica")
+        try:
+            self.assertEqual(self.router.db_for_write(models.Annotation),
+                "default")
+            self.assertEqual(self.router.db_for_read(models.Annotation),
+                "replica")
+            self.assertTrue(db_router.reading_replica())
+        finally:
+            db_router._replica.reset(token)
+        self.assertEqual(self.router.db_for_read(models.Annotation),
+            "default")
+        self.assertFalse(db_router.reading_replica())
+
+    def test_relations_across_aliases(self):
+        self.assertTrue(self.router.allow_relation(models.Annotation(),
+            models.Polygon()))
+
+class ProfilingTests(SimpleTestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = pathlib.Path(temp_dir.name)
+        settings = override_settings(L_PROFILE_SAMPLE_RATE=1,
+            L_PROFILE_DIR=self.dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_overlapping_profiles(self):
+        # like two async requests on the event loop's thread: the second
+        # isn't profiled, and doesn't break the first
+        with profiling.maybe_profile(SimpleNamespace(), "get"):
+            with profiling.maybe_profile(SimpleNamespace(), "get"):
+                pass
+        self.assertEqual(len(list(self.dir.glob("*.prof"))), 1)
+        with profiling.maybe_profile(SimpleNamespace(), "post"):
+            pass
+        self.assertEqual(len(list(self.dir.glob("*.prof"))), 2)
+
+class EditLeaseTests(ToolMixin, TestCase):
+    def test_new_lease_rejects_old(self):
+        old = self.get()
+        new = self.get()
+        # the first tab's key is stale once the second tab has loaded
+        self.draw(old, "cat", [1, 2, 30, 4, 5, 60])
+        self.assertEqual(self.submit(old), 400)
+        self.assertEqual(self.live_polygons(), [])
+        self.draw(new, "cat", [1, 2, 30, 4, 5, 60])
+        self.assertEqual(self.submit(new), 200)
+        self.assertEqual(len(self.live_polygons()), 1)
+
+    def test_same_lease_resubmit(self):
+        root = self.get()
+        obj = self.draw(root, "cat", [1, 2, 30, 4, 5, 60])
+        self.assertEqual(self.submit(root), 200)
+        # the tool keeps sending the whole document. the polygon it drew is
+        # found again by its index, not created twice.
+        obj.find("polygon/pt/x").text = "10"
+        self.assertEqual(self.submit(root), 200)
+        polygons = self.live_polygons()
+        self.assertEqual(len(polygons), 1)
+        self.assertEqual(polygons[0].points, [10, 2, 30, 4, 5, 60])
+        self.annotation.refresh_from_db()
+        self.assertEqual(self.annotation.version, 2)
+
+    def test_forgotten_lease_still_checks_version(self):
+        old = self.get()
+        new = self.get()
+        self.draw(new, "cat", [1, 2, 30, 4, 5, 60])
+        self.assertEqual(self.submit(new), 200)
+        # without the lease, the version still shows the old tab is behind
+        cache.clear()
+        self.draw(old, "dog", [1, 2, 30, 4, 5, 60])
+        self.assertEqual(self.submit(old), 400)
+        self.assertEqual([p.label.name for p in self.live_polygons()],
+            ["cat"])
+
+    def test_locked_annotation_rejected(self):
+        root = self.get()
+        models.Annotation.objects.filter(pk=self.annotation.pk).update(
+            locked=True)
+        self.draw(root, "cat", [1, 2, 30, 4, 5, 60])
+        self.assertEqual(self.submit(root), 400)
+        self.assertEqual(self.live_polygons(), [])
+
+# foreign keys are only checked when the transaction commits, which a TestCase
+# never does
+class DeletedLabelTests(ToolMixin, TransactionTestCase):
+    def test_integrity_error_forgets_label_ids(self):
+        label = models.Label.objects.create(name="cat")
+        self.assertEqual(labels.find_label_id("cat"), label.pk)
+        # deleted by another process, which can't tell this one
+        models.Label.objects.filter(pk=label.pk).delete()
+
+        root = self.get()
+        self.draw(root, "cat", [1, 2, 30, 4, 5, 60])
+        self.assertEqual(self.submit(root), 400)
+        self.assertEqual(labels._ids_by_name, {})
+        self.assertEqual(self.live_polygons(), [])
+        # the tool submits again, and then the label is made anew
+        self.assertEqual(self.submit(root), 200)
+        polygons = self.live_polygons()
+        self.assertEqual(len(polygons), 1)
+        self.assertEqual(polygons[0].label.name, "cat")
+        self.assertNotEqual(polygons[0].label_id, label.pk)
+
+class PackPointsTests(SimpleTestCase):
+    def test_pack_points(self):
+        points = [0.0, 1.25, -3.5, 1000.01, 999.99, 0.01]
+        self.assertEqual(history.unpack_points(history.pack_points(points)),
+            points)
+
+class HistoryTests(ToolMixin, TestCase):
+    def state(self, polygon):
+        return (polygon.label_id, polygon.notes, polygon.occluded,
+            polygon.points, polygon.deleted, polygon.locked)
+
+    def test_annotation_at(self):
+        root = self.get()
+        first = self.draw(root, "cat", [1, 2, 30, 4, 5, 60])
+        second = self.draw(root, "cat", [10, 20, 300, 40, 50, 600])
+        self.assertEqual(self.submit(root), 200)
+        self.annotation.refresh_from_db()
+        before = self.annotation.last_edit_time
+        before_states = {p.pk: self.state(p) for p in self.live_polygons()}
+
+        first.find("deleted").text = "1"
+        second.find("name").text = "dog"
+        second.find("occluded").text = "yes"
+        self.assertEqual(self.submit(root), 200)
+        self.annotation.refresh_from_db()
+        after = self.annotation.last_edit_time
+
+        replayed = history.annotation_at(self.annotation.pk, before)
+        self.assertEqual({p.id: self.state(p) for p in replayed},
+            before_states)
+        replayed = history.annotation_at(self.annotation.pk, after)
+        self.assertEqual({p.id: self.state(p) for p in replayed},
+            {p.pk: self.state(p) for p in models.Polygon.objects.filter(
+                annotation=self.annotation)})
+        self.assertEqual(history.annotation_at(self.annotation.pk,
+            before-timedelta(seconds=1)), [])
+
+class JSONFormatTests(ToolMixin, TestCase):
+    def test_read_matches_xml(self):
+        cat = models.Label.objects.create(name="cat")
+        xml = ("<annotation><filename>img5.jpg</filename><folder>f</folder>"
+            "<c_anno_id>7</c_anno_id><edit_key>k</edit_key>"
+            "<object><c_poly_id>3</c_poly_id><name> Cat </name>"
+            "<deleted>0</deleted><verified>0</verified>"
+            "<occluded>yes</occluded><attributes>fluffy</attributes>"
+            "<polygon><username>hi</username>"
+            "<pt><x>1</x><y>2.5</y></pt><pt><x>3.25</x><y>4</y></pt>"
+            "<pt><x>5</x><y>6</y></pt></polygon></object>"
+            "<object><name>dog</name><deleted>1</deleted>"
+            "<occluded>no</occluded><attributes></attributes>"
+            "<polygon><username>hi</username>"
+            "<pt><x>7</x><y>8</y></pt><pt><x>9</x><y>10</y></pt>"
+            "<pt><x>11</x><y>12</y></pt><pt><x>13</x><y>14</y></pt>"
+            "</polygon></object></annotation>")
+        data = {"anno_id": 7, "edit_key": "k", "image_id": 5, "objects": {
+            "id": [3, None], "name": [" Cat ", "dog"], "deleted": [0, 1],
+            "occluded": [1, 0], "attributes": ["fluffy", ""],
+            "counts": [3, 4],
+            "points": [1, 2.5, 3.25, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]}}
+
+        from_xml = views.read_annotation_xml(ET.fromstring(xml))
+        from_json = json_format.read_annotation_json(data)
+        for field in ("image_id", "anno_id", "edit_key"):
+            self.assertEqual(getattr(from_json, field),
+                getattr(from_xml, field))
+        self.assertEqual([vars(p) for p in from_json.polygons],
+            [vars(p) for p in from_xml.polygons])
+        self.assertEqual(from_json.polygons[0].label_id, cat.pk)
+        self.assertIsNone(from_json.polygons[1].label_id)
+
+    def test_documents_match(self):
+        now = datetime.now(timezone.utc)
+        for name, points, notes in (("cat", [1.5, 2, 30, 4, 5, 60], "a & b"),
+                ("dog", [10, 20, 300, 40, 50, 600, 7, 8], "")):
+            models.Polygon.objects.create(annotation=self.annotation,
+                label_id=labels.get_label_id(name), points=points,
+                notes=notes, occluded=name == "dog", last_edit_time=now)
+
+        from_xml = views.read_annotation_xml(self.get())
+        resp = self.client.get(GET_URL.format(self.image.pk),
+            HTTP_ACCEPT="application/json")
+        self.assertEqual(resp["Content-Type"], "application/json")
+        data = json.loads(resp.content)
+        # it's sent back with deleted instead of verified
+        objects = data["objects"]
+        objects["deleted"] = [0]*len(objects.pop("verified"))
+        from_json = json_format.read_annotation_json(data)
+        self.assertEqual([vars(p) for p in from_json.polygons],
+            [vars(p) for p in from_xml.polygons])
+
+        # sending it back unchanged changes nothing
+        resp = self.client.post(SUBMIT_URL, json.dumps(data),
+            content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        self.annotation.refresh_from_db()
+        self.assertEqual(self.annotation.version, 0)
+
+class ReviewTests(ToolMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        models.Annotation.objects.filter(pk=self.annotation.pk).update(
+            finished=True)
+        self.reviewer = User.objects.create_user("reviewer", password="x",
+            is_staff=True)
+        self.client.force_login(self.reviewer)
+
+    def post(self, url, data):
+        resp = self.client.post(url, json.dumps(data),
+            content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def claim(self):
+        claimed = self.post("/label/review/claim", {"count": 10})
+        self.assertEqual([a["anno_id"] for a in claimed["annotations"]],
+            [self.annotation.pk])
+
+    # fetch the annotation like a reviewer would. returns the last edit time
+    # it was fetched with.
+    def fetch(self):
+        resp = self.client.get("/label/annotations/batch",
+            {"annotations": self.annotation.pk, "all": 1})
+        self.assertEqual(resp.status_code, 200)
+        fetched = json.loads(b"".join(resp.streaming_content))
+        return fetched["annotations"][0]["last_edit_time"]
+
+    # the annotator changes it after the reviewer fetched it
+    def edit(self):
+        models.Annotation.objects.filter(pk=self.annotation.pk).update(
+            last_edit_time=datetime.now(timezone.utc)+timedelta(seconds=1))
+
+    def decision(self, last_edit_time):
+        return {"annotations": [{"id": self.annotation.pk,
+            "last_edit_time": last_edit_time}]}
+
+    def test_approve(self):
+        self.claim()
+        seen = self.fetch()
+        self.edit()
+        self.assertEqual(self.post("/label/review/approve",
+            self.decision(seen)), {"approved": 0})
+        self.annotation.refresh_from_db()
+        self.assertFalse(self.annotation.locked)
+        self.assertIsNone(self.annotation.review_time)
+
+        # it's still claimed, and has to be looked at again
+        seen = self.fetch()
+        self.assertEqual(self.post("/label/review/approve",
+            self.decision(seen)), {"approved": 1})
+        self.annotation.refresh_from_db()
+        self.assertTrue(self.annotation.locked)
+        self.assertIsNotNone(self.annotation.review_time)
+        self.assertEqual(self.annotation.reviewer, self.reviewer)
+        # it's out of the queue
+        self.assertEqual(self.post("/label/review/claim", {"count": 10}),
+            {"annotations": []})
+
+    def test_reject(self):
+        self.claim()
+        seen = self.fetch()
+        self.edit()
+        self.assertEqual(self.post("/label/review/reject",
+            self.decision(seen)), {"rejected": 0})
+        self.annotation.refresh_from_db()
+        self.assertTrue(self.annotation.finished)
+
+        seen = self.fetch()
+        self.assertEqual(self.post("/label/review/reject",
+            self.decision(seen)), {"rejected": 1})
+        self.annotation.refresh_from_db()
+        self.assertFalse(self.annotation.finished)
+        self.assertIsNotNone(self.annotation.review_time)
+
+    def test_bad_decision(self):
+        self.claim()
+        resp = self.client.post("/label/review/approve", json.dumps(
+            self.decision("2024-01-01T00:00:00")),
+            content_type="application/json")
+        # no time zone
+        self.assertEqual(resp.status_code, 400)
+
+class PolygonAdminTests(ToolMixin, TestCase):
+    def test_soft_delete_action(self):
+        root = self.get()
+        self.draw(root, "cat", [1, 2, 30, 4, 5, 60])
+        self.draw(root, "dog", [10, 20, 300, 40, 50, 600])
+        self.assertEqual(self.submit(root), 200)
+        cat, dog = self.live_polygons()
+
+        admin = User.objects.create_superuser("admin", password="x")
+        self.client.force_login(admin)
+        resp = self.client.post("/admin/label_app/polygon/", {
+            "action": "soft_delete", "_selected_action": [cat.pk]})
+        self.assertEqual(resp.status_code, 302)
+
+        self.assertEqual(self.live_polygons(), [dog])
+        self.assertEqual(models.AnnotationStats.objects.get(
+            annotation=self.annotation).polygons, 1)
+        self.assertEqual(models.UserStats.objects.get(
+            user=self.user).vertices, 3)
+        edit = models.PolygonEdit.objects.filter(polygon=cat).latest("pk")
+        self.assertEqual((edit.changed, edit.deleted, edit.editor_id),
+            (history.DELETED, True, admin.pk))
+        self.annotation.refresh_from_db()
+        self.assertEqual(self.annotation.last_edit_time, edit.time)
@@ -23,6 +23,11 @@ def lm_serve(path):
 def tool(request):
     return lm_serve("tool.xhtml")
 
+# the tool's assets are the same for everybody, so they don't need a login and
+# anything between us and the browser can cache them. they only change when
+# the tool is updated, which is rare enough that an hour of staleness is fine.
 def lm_static(request, file, dir):
-    return lm_serve(dir+"/"+file)
+    resp = lm_serve(dir+"/"+file)
+    resp["Cache-Control"] = "public, max-age=3600"
+    return resp
 
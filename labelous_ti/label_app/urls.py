@@ -1,10 +1,29 @@
 from django.urls import path, re_path
+from django.conf import settings
 
 from . import views
 from . import tool_static_views
+from . import batch_views
+from . import review_views
 import image_mgr.views
 from django.contrib.auth.decorators import login_required
 
+if settings.L_ASYNC_VIEWS:
+    # the async views do their own login checks
+    from . import async_views
+    import image_mgr.async_views
+    image_file = image_mgr.async_views.image_file
+    get_annotation_xml = async_views.get_annotation_xml
+    post_annotation_xml = async_views.post_annotation_xml
+    next_annotation = async_views.next_annotation
+    prev_annotation = async_views.prev_annotation
+else:
+    image_file = image_mgr.views.image_file
+    get_annotation_xml = login_required(views.get_annotation_xml)
+    post_annotation_xml = login_required(views.post_annotation_xml)
+    next_annotation = login_required(views.next_annotation)
+    prev_annotation = login_required(views.prev_annotation)
+
 urlpatterns = [
 
     # the labeler needs a crapton of static files. we are allegedly clubbing
@@ -16,14 +35,20 @@ urlpatterns = [
         {"dir": "annotationTools/js"}),
     path('Icons/<file>', tool_static_views.lm_static,
         {"dir": "Icons"}),
-    re_path(r'^Images/f/img(?P<image_id>[0-9]+).jpg$',
-        image_mgr.views.image_file),
+    re_path(r'^Images/f/img(?P<image_id>[0-9]+).jpg$', image_file,
+        name="image_file"),
+    # the same images, but authorized by a signature instead of the session
+    re_path(r'^Images/s/img(?P<image_id>[0-9]+).jpg$',
+        image_mgr.views.signed_image_file, name="signed_image"),
     re_path(r'^Annotations/f/img(?P<image_id>[0-9]+).xml$',
-        login_required(views.get_annotation_xml)),
-    path('annotationTools/perl/submit.cgi',
-        login_required(views.post_annotation_xml)),
-    path('annotationTools/perl/fetch_image.cgi',
-        login_required(views.next_annotation)),
-    path('annotationTools/perl/fetch_prev_image.cgi',
-        login_required(views.prev_annotation)),
+        get_annotation_xml),
+    path('annotationTools/perl/submit.cgi', post_annotation_xml),
+    path('annotationTools/perl/fetch_image.cgi', next_annotation),
+    path('annotationTools/perl/fetch_prev_image.cgi', prev_annotation),
+    path('labels/autocomplete', login_required(views.label_autocomplete)),
+    path('annotations/batch', login_required(batch_views.batch_annotations),
+        name="batch_annotations"),
+    path('review/claim', review_views.claim),
+    path('review/approve', review_views.approve),
+    path('review/reject', review_views.reject),
 ]
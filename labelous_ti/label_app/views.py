@@ -1,19 +1,37 @@
 from django.shortcuts import render
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, Http404, JsonResponse
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.core.exceptions import SuspiciousOperation
 from django.template.loader import render_to_string
-from django.db import transaction
+from django.db import transaction, IntegrityError
+from django.db.models.functions import Coalesce
+from django.core.cache import cache
 
 from xml.sax.saxutils import escape as xml_escape
 import defusedxml.ElementTree
 import types
+import itertools
+import json
+import time
+import logging
 from datetime import datetime, timezone
 import secrets
 
 from . import models
+from . import labels
+from . import simplify
+from . import prefetch
+from . import history
+from . import json_format
+from . import stats
 import image_mgr.models
+import image_mgr.views
+from labelous import metrics
+from labelous import profiling
+from labelous import db_router
+
+logger = logging.getLogger(__name__)
 
 # THEORY OF OPERATION: COMMUNICATIONS
 
@@ -41,18 +59,33 @@ import image_mgr.models
 # the first tab won't get updated either. To solve this, we use an "edit key".
 
 # Whenever the current annotations are requested, the server generates a random
-# number and stores it as the annotation's edit key, then transmits it to the
-# tool, along with the annotations. When the tool responds with updated
-# annotations, the server checks that the received edit key matches the
-# annotation's stored key. If they don't match, the update is rejected and the
-# tool displays an appropriate error message.
-
-# If the user has the tool open in one tab and opens a second tab, the edit key
-# will be changed. Any edits made in the second tab will be accepted because it
-# has the correct key. An edit made in the first tab will no longer have the
-# correct key, so it will be rejected. The first tab will then tell the user
+# number, the "lease", and remembers it (in the default cache) as the
+# annotation's current lease, then transmits it to the tool as the edit key,
+# along with the annotations. When the tool responds with updated annotations,
+# the server checks that the received lease is the current one. If it isn't, the
+# update is rejected and the tool displays an appropriate error message.
+
+# If the user has the tool open in one tab and opens a second tab, the current
+# lease will be changed. Any edits made in the second tab will be accepted
+# because it has the current lease. An edit made in the first tab will no
+# longer have it, so it will be rejected. The first tab will then tell the user
 # that the annotation open elsewhere and lock itself to prevent further edits.
 
+# The edit key also holds the annotation's version when it was requested. Every
+# submission that changes the annotation adds one to its version and records
+# its lease on the annotation. A submission is only accepted if the annotation
+# is still at the version it was sent at, or the lease's own submissions are
+# the ones that changed it since. This catches an older tab's submission that
+# was accepted just before a newer tab's request, but committed just after the
+# newer tab read the polygons (which it would then overwrite). It also keeps
+# the tabs apart if the cache forgets the current lease: whichever submits
+# first wins.
+
+# None of this writes anything when the annotations are requested, so that's
+# read-only and can be served from a read replica. The default cache must be
+# shared between processes (memcached, redis, ...) for leases to work across
+# them; a system check (checks.py) refuses to start otherwise.
+
 # Careful readers will note that this is very similar to the operation of CSRF
 # tokens. Currently, the edit key cannot be used as one because it is generated
 # by a GET request. Additionally, since it is generated by a GET request, an
@@ -71,27 +104,32 @@ import image_mgr.models
 # each time the tool loads the annotations.
 
 # To correctly update the polygons, we track each polygon's annotation file
-# index in the database. Whenever the annotations are requested, we randomize
-# the edit key, clear the indices from all the polygons, then send the polygons
-# we have along with their database IDs. If the tool sends back a polygon that
-# has a database ID, we look up its database record by the database ID and
-# simply ignore the index.
-
-# Otherwise, we must look up the polygon by its index. If we can't find
-# anything, we assume the polygon is new and create a database record for it,
-# which includes its index. We are assured the polygon is new because indices
-# are unique (for a particular request), and we cleared the indices when the
-# annotations were requested, so the new polygon's index couldn't have matched
-# an old polygon with the same index.
+# index in the database, along with the lease of that file. Whenever the
+# annotations are requested, we hand out a new lease, then send the polygons we
+# have along with their database IDs. If the tool sends back a polygon that has
+# a database ID, we look up its database record by the database ID and simply
+# ignore the index.
+
+# Otherwise, we must look up the polygon by its index, among the polygons
+# created under the file's lease. If we can't find anything, we assume the
+# polygon is new and create a database record for it, which includes its index
+# and the lease. We are assured the polygon is new because indices are unique
+# (for a particular lease), and leases are never reused, so the new polygon's
+# index couldn't have matched an old polygon with the same index from a
+# different file.
 
 # If we find a polygon with that index, we edit it as usual. We are assured we
 # have found the correct polygon because we created a record with its index when
 # it was new, indices don't change after the annotations are requested, and we
-# will reject any updates that don't have the edit key (and thus indices) of the
-# most recent annotation request.
-
+# will reject any updates that don't have the most recent lease.
 
+# this only reads, see "edit leases" above
+@db_router.replica_reads
 def get_annotation_xml(request, image_id):
+    with profiling.maybe_profile(request, "get"):
+        return _get_annotation_xml(request, image_id)
+
+def _get_annotation_xml(request, image_id):
     # regex only allows numbers through
     image_id = int(image_id)
 
@@ -103,7 +141,7 @@ def get_annotation_xml(request, image_id):
         # we don't check for if multiple exist, because if that happens,
         # something has gone horrifically wrong in the database.
 
-    if image.visible is False:
+    if not exists or image.visible is False:
         exists = False
     else:
         try:
@@ -116,20 +154,98 @@ def get_annotation_xml(request, image_id):
 
     if not exists:
         raise Http404("Annotation does not exist.")
-
-    # randomize the edit token. we don't use a transaction here because it's the
-    # annotation update code's responsibility to make sure it doesn't commit
-    # any data when the edit key is incorrect.
-    edit_key = secrets.token_bytes(16)
-    annotation.edit_key = edit_key
-    annotation.save()
-
-    # find all the visible polygons attached to this annotation
+    request.l_annotation_id = annotation.pk
+
+    # hand out a new lease. nothing is written to the database; it's the
+    # annotation update code's responsibility to reject submissions made under
+    # any other lease.
+    lease = secrets.randbits(63)
+    cache.set(lease_cache_key(annotation.pk), lease, settings.L_LEASE_SECONDS)
+    edit_key = format_edit_key(lease, annotation.version)
+
+    # find all the visible polygons attached to this annotation. the annotation
+    # (and its version) must be read before them, so they are at least as new
+    # as the version the tool gets.
     polygons = annotation.polygons.filter(deleted=False)
-    # and remove any old indices, ensuring the database only contains indices
-    # for the file we are about to build
-    polygons.filter(anno_index__isnull=False).update(anno_index=None)
 
+    # the polygons are often already gathered (see prefetch.py). only what
+    # was read from the primary is cached; a replica could be behind.
+    key = objects_cache_key(annotation)
+    columns = cache.get(key)
+    if columns is None:
+        columns = polygon_columns(annotation,
+            list(polygons.select_related("label")))
+        if not db_router.reading_replica():
+            cache.set(key, columns, settings.L_PREFETCH_TTL)
+
+    resp = annotation_response(request, annotation, edit_key, columns)
+    # get the browser started on the images the user will probably go to next
+    links = prefetch.preload_links(request.user.pk, image_id)
+    if links is not None:
+        resp["Link"] = links
+    return resp
+
+# make the response with the annotation document, in whichever format the tool
+# asked for
+def annotation_response(request, annotation, edit_key, columns):
+    if json_format.accepts_json(request):
+        body = json_format.build_annotation_json(annotation, edit_key,
+            columns)
+        resp = HttpResponse(body, content_type="application/json")
+        request.l_document_size = len(body)
+    else:
+        xml = build_annotation_xml(annotation, edit_key, columns)
+        # django will automatically concatenate our xml strings
+        resp = HttpResponse(xml, content_type="text/xml")
+        request.l_document_size = sum(len(s) for s in xml)
+    record_document_counts("get", request.l_document_size,
+        len(columns["id"]), len(columns["points"])//2)
+    # caches have to keep a copy per format
+    resp["Vary"] = "Accept"
+    return resp
+
+# EDIT LEASES
+
+# where the current lease of the annotation with the given ID is kept
+def lease_cache_key(annotation_id):
+    return "labelous_lease:{}".format(annotation_id)
+
+# the edit key holds the lease and the annotation's version, as hex
+def format_edit_key(lease, version):
+    return "{:016x}{:08x}".format(lease, version)
+
+# returns (lease, version). raises an exception if the key is malformed.
+def parse_edit_key(text):
+    if len(text) != 24:
+        raise ValueError("bad edit key length")
+    return int(text[:16], 16), int(text[16:], 16)
+
+# check if a submission made under the given lease, to the given version of the
+# annotation, may be accepted
+def lease_is_current(annotation, lease, version):
+    current = cache.get(lease_cache_key(annotation.pk))
+    if current is not None and current != lease:
+        # the annotation has been requested since
+        return False
+    # it must not have been changed since the tool got it, except by this
+    # lease's own submissions
+    return annotation.version == version or annotation.lease == lease
+
+# record the size and shape of an annotation document that went in direction
+# ("get" or "post"). polygons can be anything with a points attribute.
+def record_document_metrics(direction, size, polygons):
+    record_document_counts(direction, size, len(polygons),
+        sum(len(p.points) for p in polygons)//2)
+
+def record_document_counts(direction, size, polygon_count, vertex_count):
+    metrics.annotation_payload_bytes.observe(size, direction)
+    metrics.annotation_polygons.observe(polygon_count, direction)
+    metrics.annotation_vertices.observe(vertex_count, direction)
+
+# build the annotation document the tool gets for the given annotation. the
+# polygons go in as columns, from polygon_columns. returns a list of strings to
+# be concatenated.
+def build_annotation_xml(annotation, edit_key, columns):
     # because XML is hard and bad, we build the result with string operations.
     xml = ["<annotation>"]
     # the annotation tool doesn't rebuild the document, it only modifies it.
@@ -142,52 +258,100 @@ def get_annotation_xml(request, image_id):
     # than the xml when this document is returned, so we need it to look back up
     # where it came from.
     xml.append("<c_anno_id>{}</c_anno_id>".format(annotation.pk))
-    # store the edit key as a hex string. this, basically, ensures that the user
-    # doesn't get confused by having the same annotation open multiple times,
-    # and that the file's structure still matches the database.
-    xml.append("<edit_key>{}</edit_key>".format(edit_key.hex()))
+    # store the edit key (from format_edit_key). this, basically, ensures that
+    # the user doesn't get confused by having the same annotation open multiple
+    # times, and that the file's structure still matches the database.
+    xml.append("<edit_key>{}</edit_key>".format(edit_key))
     # specify which image file to show for this annotation. since we look up
     # images by their ID, the folder doesn't matter as long as it's constant.
     xml.append("<filename>img{}.jpg</filename><folder>f</folder>".format(
-        image_id))
-    for polygon in polygons:
+        annotation.image_id))
+    # a signed URL for the image, which can be loaded (and cached) without the
+    # server having to look up the user's session. NOTE: the tool doesn't read
+    # this yet (its copy in LabelMeAnnotationTool has to be changed to), so it
+    # still loads the image from Images/f/ with the session. for now only the
+    # annotation list actually loads images by signed URL.
+    xml.append("<c_image_url>{}</c_image_url>".format(xml_escape(
+        image_mgr.views.signed_image_url(annotation.image_id))))
+    xml.append(build_objects_xml(columns))
+    xml.append("</annotation>")
+
+    return xml
+
+# the key the polygons of the annotation are cached under (in the form
+# polygon_columns returns). every change to the polygons updates the
+# annotation's last edit time, and locking the annotation changes how they are
+# shown, so a key is never reused for different polygons. (renaming a label
+# isn't noticed until the entry expires, after L_PREFETCH_TTL.)
+def objects_cache_key(annotation):
+    return "labelous_objects:{}:{}:{}".format(annotation.pk,
+        annotation.last_edit_time.timestamp(), annotation.locked)
+
+# gather what the tool needs to know about the given (visible) polygons of the
+# annotation into a dict of columns, with one entry per polygon in each:
+#   id: the polygon's ID
+#   name: its label
+#   verified: 1 if it's locked (or the annotation is), otherwise 0
+#   occluded: 1 if it's occluded, otherwise 0
+#   attributes: its notes
+#   counts: how many vertices it has
+# plus all the polygons' points, one after the other, in "points". both
+# document formats are built from this.
+def polygon_columns(annotation, polygons):
+    return {
+        "id": [p.pk for p in polygons],
+        "name": [p.label.name for p in polygons],
+        "verified": [1 if p.locked or annotation.locked else 0
+            for p in polygons],
+        "occluded": [1 if p.occluded else 0 for p in polygons],
+        "attributes": [p.notes for p in polygons],
+        "counts": [len(p.points)//2 for p in polygons],
+        "points": list(itertools.chain.from_iterable(
+            p.points for p in polygons)),
+    }
+
+# build the <object>s for the polygons in the given columns (from
+# polygon_columns). returns the xml as one string.
+def build_objects_xml(columns):
+    xml = []
+    all_points = columns["points"]
+    offset = 0
+    for i, count in enumerate(columns["counts"]):
         xml.append("<object>")
         # we need to know the polygon ID so we can update the record if the user
         # changed the points
-        xml.append("<c_poly_id>{}</c_poly_id>".format(polygon.pk))
+        xml.append("<c_poly_id>{}</c_poly_id>".format(columns["id"][i]))
         # the polygon's label as text
-        xml.append("<name>{}</name>".format(xml_escape(polygon.label_as_str)))
+        xml.append("<name>{}</name>".format(xml_escape(columns["name"][i])))
         # if deleted is 1, the polygon won't show up. we avoid sending deleted
         # polygons, so there's no case it would be set to 1.
         # if verified is 1, the polygon will show an error if the user tries to
         # edit it. we map this to the polygon's locked status.
         xml.append("<deleted>0</deleted><verified>{}</verified>".format(
-            1 if polygon.locked or annotation.locked else 0))
+            columns["verified"][i]))
         # whether the user considers the polygon to be occluded. same as
         # database flag.
         xml.append("<occluded>{}</occluded>".format(
-            "yes" if polygon.occluded else "no"))
+            "yes" if columns["occluded"][i] else "no"))
         # any additional notes the user wants to put.
         xml.append("<attributes>{}</attributes>".format(
-            xml_escape(polygon.notes)))
+            xml_escape(columns["attributes"][i])))
         # now the actual polygon points. we need to specify the user that
         # created the polygon. so the tool is happy, we claim this is always the
         # logged in user (or for now, a constant user.)
         xml.append("<polygon><username>hi</username>")
-        points = polygon.points
         # points are stored as a flat array: even indices are x and odd are y
-        for pi in range(0, len(points), 2):
+        for pi in range(offset, offset+count*2, 2):
             # the tool can send non-integer coordinates even if they are a
             # little silly. we specify a limit of 2 decimal places to get good
             # accuracy and make sure the numbers are reasonable length.
             # (i.e. not 3.5000000000000000069 or w/e)
             xml.append("<pt><x>{:.2f}</x><y>{:.2f}</y></pt>".format(
-                points[pi], points[pi+1]))
+                all_points[pi], all_points[pi+1]))
+        offset += count*2
         xml.append("</polygon></object>")
-    xml.append("</annotation>")
 
-    # django will automatically concatenate our xml strings
-    return HttpResponse(xml, content_type="text/xml")
+    return "".join(xml)
 
 
 # handle a returned annotation XML document. note that we get no additional
@@ -198,49 +362,37 @@ def get_annotation_xml(request, image_id):
 # SuspiciousOperation exception, which causes the tool to reload and get the
 # correct annotations back from the database.
 
-# handle understanding the document and updating the database. if this raises
-# any kind of exception, the database transaction is rolled back.
-def process_annotation_xml(request, root):
+# pull what we need out of the document: the image it's for, the edit key and
+# the polygons, as a SimpleNamespace with image_id, edit_key and polygons. each
+# polygon is a SimpleNamespace with id (None if it's new), index, label_name,
+# label_id (None if the label doesn't exist yet), deleted, occluded, attributes
+# and points.
+def read_annotation_xml(root):
     if root.tag != "annotation":
         raise SuspiciousOperation("not an annotation")
+    doc = types.SimpleNamespace()
 
-    # look up the image we are allegedly annotating
+    # the image we are allegedly annotating
     try:
         filename = root.find("filename").text
         if not filename.startswith("img") or not filename.endswith(".jpg"):
             raise Exception("invalid filename {}".format(filename))
-        image_id = int(filename[3:-4])
-        image = image_mgr.models.Image.objects.get(pk=image_id)
-        if not image.visible:
-            raise Exception("invisible image")
+        doc.image_id = int(filename[3:-4])
     except Exception as e:
         raise SuspiciousOperation("invalid image") from e
 
-    # look up the annotation this document is allegedly for
+    # the annotation it's allegedly for
     try:
-        anno_id = int(root.find("c_anno_id").text)
-        annotation = models.Annotation.objects.get(
-            annotator=request.user, image=image, locked=False, deleted=False)
-        if annotation.deleted:
-            raise Exception("deleted annotation")
+        doc.anno_id = int(root.find("c_anno_id").text)
     except Exception as e:
         raise SuspiciousOperation("invalid anno id") from e
 
-    # make sure the edit key matches. note that this is optimistic; it could be
-    # changed out from under us while we are processing. we re-check right
-    # before committing the data, but checking here saves processing in the
-    # common case.
     try:
-        edit_key = bytes.fromhex(root.find("edit_key").text)
-        if edit_key != bytes(annotation.edit_key):
-            raise Exception("edit key does not match")
+        doc.edit_key = root.find("edit_key").text
     except Exception as e:
-        # probably will be modified in the future; a bad or missing edit key
-        # isn't necessarily suspicious
         raise SuspiciousOperation("invalid edit key") from e
 
-    # pull out all the polygons defined in this document. once that is done, we
-    # will apply them to the database.
+    # pull out all the polygons defined in this document
     anno_polygons = []
     anno_poly_ids = set()
     # iterate through objects in order, keeping track of their index
@@ -261,9 +413,15 @@ def process_annotation_xml(request, root):
             anno_polygon.index = curr_index
             curr_index = curr_index + 1
 
-            anno_polygon.name = obj_tag.find("name").text
-            if anno_polygon.name == "":
-                raise Exception("empty name")
+            # look up the label's ID now so we only have to compare IDs later.
+            # labels that don't exist yet are created once the submission is
+            # known to be accepted.
+            anno_polygon.label_name = labels.normalize_name(
+                obj_tag.find("name").text)
+            if anno_polygon.label_name == "":
+                raise Exception("empty label name")
+            anno_polygon.label_id = labels.find_label_id(
+                anno_polygon.label_name)
 
             deleted = int(obj_tag.find("deleted").text)
             if deleted not in (0, 1):
@@ -298,32 +456,124 @@ def process_annotation_xml(request, root):
         except Exception as e:
             raise SuspiciousOperation("invalid polygon") from e
 
+    doc.polygons = anno_polygons
+    return doc
+
+# handle the document (from read_annotation_xml or
+# json_format.read_annotation_json) and update the database. if this raises any
+# kind of exception, the database transaction is rolled back.
+def process_annotation(request, doc):
+    # we time each phase of the processing. the first is validating the
+    # document against the database.
+    phase_start = time.perf_counter()
+    anno_polygons = doc.polygons
+
+    # look up the image we are allegedly annotating
+    try:
+        image = image_mgr.models.Image.objects.get(pk=doc.image_id)
+        if not image.visible:
+            raise Exception("invisible image")
+    except Exception as e:
+        raise SuspiciousOperation("invalid image") from e
+
+    # look up the annotation this document is allegedly for
+    try:
+        annotation = models.Annotation.objects.get(
+            annotator=request.user, image=image, locked=False, deleted=False)
+        if annotation.deleted:
+            raise Exception("deleted annotation")
+    except Exception as e:
+        raise SuspiciousOperation("invalid anno id") from e
+    request.l_annotation_id = annotation.pk
+
+    # make sure the lease is current. note that this is optimistic; it could be
+    # changed out from under us while we are processing. we re-check right
+    # before committing the data, but checking here saves processing in the
+    # common case.
+    try:
+        lease, version = parse_edit_key(doc.edit_key)
+        if not lease_is_current(annotation, lease, version):
+            raise Exception("lease is not current")
+    except Exception as e:
+        # probably will be modified in the future; a bad or missing edit key
+        # isn't necessarily suspicious
+        raise SuspiciousOperation("invalid edit key") from e
+
+    record_document_metrics("post", len(request.body), anno_polygons)
+
+    # simplify the polygons whose labels call for it. this happens before we
+    # compare against the database, which has the simplified points, so a
+    # polygon only counts as changed if its simplified version changed.
+    for anno_polygon in anno_polygons:
+        anno_polygon.original_vertex_count = None
+        tolerance = labels.simplify_tolerance(anno_polygon.label_id)
+        if tolerance is None:
+            continue
+        points = simplify.simplify(anno_polygon.points, tolerance)
+        if len(points) < len(anno_polygon.points):
+            anno_polygon.original_vertex_count = len(anno_polygon.points)//2
+            anno_polygon.points = points
+
     # get the polygons attached to this annotation that we would have shown
     polygons = annotation.polygons.filter(deleted=False)
     # and map them by their ID
     polygons_by_id = {p.pk: p for p in polygons}
-    # plus index in the file
+    # plus index in the file, if they were created under this lease
     polygons_by_index = {p.anno_index: p
-        for p in polygons_by_id.values() if p.anno_index is not None}
+        for p in polygons_by_id.values() if p.anno_lease == lease}
+    phase_end = time.perf_counter()
+    metrics.annotation_phase_seconds.observe(phase_end-phase_start, "validate")
+    phase_start = phase_end
+    try:
+        _apply_annotation(request, doc, annotation, lease, version,
+            polygons_by_id, polygons_by_index, phase_start)
+    except IntegrityError:
+        # most likely a label we remember was deleted. the tool will submit
+        # again and we'll look it up then.
+        labels.forget_label_ids()
+        raise
+
+# the second half of process_annotation, which makes the changes
+def _apply_annotation(request, doc, annotation, lease, version,
+        polygons_by_id, polygons_by_index, phase_start):
+    anno_polygons = doc.polygons
     with transaction.atomic():
         # reload the annotation, this time while selected for update. this
         # ensures that nobody else can change it until the transaction finishes.
         annotation = models.Annotation.objects.select_for_update().get(
             pk=annotation.pk)
-        # now we can be sure the edit key is correct
-        if edit_key != bytes(annotation.edit_key):
+        phase_end = time.perf_counter()
+        metrics.annotation_phase_seconds.observe(
+            phase_end-phase_start, "lock_wait")
+        phase_start = phase_end
+        # it may have been approved (see review_views.py) or deleted while we
+        # waited for it, which doesn't change the version
+        if annotation.locked or annotation.deleted:
+            raise SuspiciousOperation("invalid anno id")
+        # now we can be sure the annotation's version is correct. a new lease
+        # might still be handed out while we work, but the tool it goes to
+        # will get a version we haven't changed yet, and the next submission
+        # under our lease will be rejected.
+        if not lease_is_current(annotation, lease, version):
             raise SuspiciousOperation("invalid edit key")
-        # the edit key can't be changed until the transaction finishes, ensuring
+        # the version can't be changed until the transaction finishes, ensuring
         # that any changes are in the database before a new edit can happen.
 
-        # mesaure if anything changed in the annotation so we can update its
-        # last edited time.
-        annotation_changed = False
+        # the submission is going to be accepted, so now it's safe to create
+        # the labels it uses that don't exist yet
+        for anno_poly in anno_polygons:
+            if anno_poly.label_id is None:
+                anno_poly.label_id = labels.get_label_id(anno_poly.label_name)
+
+        # everything changed in this submission gets the same time
+        now = datetime.now(timezone.utc)
+        # the polygons to be inserted and updated, and what changed in each
+        # for the history
+        to_create = []
+        to_update = []
+        # and how the statistics change
+        tally = stats.Tally({annotation.pk: annotation.annotator_id})
         for anno_poly in anno_polygons:
-            # mesaure if anything changed in the polygon so we can update its
-            # last edited time.
-            polygon_changed = False
-
             if anno_poly.id is not None:
                 try:
                     poly = polygons_by_id[anno_poly.id]
@@ -344,78 +594,158 @@ def process_annotation_xml(request, root):
                     if anno_poly.deleted:
                         continue
                     else:
-                        poly = models.Polygon(
-                            annotation=annotation, anno_index=anno_poly.index)
-                        polygon_changed = True
-
-            if polygon_changed == True: pass
-            elif poly.label_as_str != anno_poly.name: polygon_changed = True
-            elif poly.notes != anno_poly.attributes: polygon_changed = True
-            elif poly.occluded != anno_poly.occluded: polygon_changed = True
-            elif poly.points != anno_poly.points: polygon_changed = True
-            elif poly.deleted != anno_poly.deleted: polygon_changed = True
-            if polygon_changed: print("poly changed!!")
-
-            if polygon_changed:
-                poly.label_as_str = anno_poly.name
-                poly.notes = anno_poly.attributes
-                poly.occluded = anno_poly.occluded
-                poly.points = anno_poly.points
-                poly.deleted = anno_poly.deleted
-                poly.last_edit_time = datetime.now(timezone.utc)
-                poly.save()
-                annotation_changed = True
-
-        if annotation_changed:
-            annotation.last_edit_time = datetime.now(timezone.utc)
-            annotation.save(update_fields=('last_edit_time',))
-
-
-# parse the XML data. the request can't be, by default, bigger than 2.5MiB, so
-# it shouldn't consume too much memory. the options given to parse prevent
-# expansion attacks and external sourcing garbage.
-def parse_annotation_xml(request):
+                        poly = models.Polygon(annotation=annotation,
+                            anno_index=anno_poly.index, anno_lease=lease)
+
+            # mesaure what changed in the polygon so we can update its last
+            # edited time and record it in the history
+            if poly.pk is None:
+                changed = history.ALL
+            else:
+                changed = 0
+                if poly.label_id != anno_poly.label_id:
+                    changed |= history.LABEL
+                if poly.notes != anno_poly.attributes:
+                    changed |= history.NOTES
+                if poly.occluded != anno_poly.occluded:
+                    changed |= history.OCCLUDED
+                if poly.points != anno_poly.points:
+                    changed |= history.POINTS
+                if poly.deleted != anno_poly.deleted:
+                    changed |= history.DELETED
+            if changed == 0:
+                continue
+            metrics.polygons_changed.inc()
+            # it no longer counts as it was
+            if poly.pk is not None:
+                tally.add_polygon(poly, -1)
+
+            poly.label_id = anno_poly.label_id
+            poly.notes = anno_poly.attributes
+            poly.occluded = anno_poly.occluded
+            poly.points = anno_poly.points
+            # only if this submission's points were simplified. otherwise the
+            # count from when they were is still the one that matters.
+            if anno_poly.original_vertex_count is not None:
+                poly.original_vertex_count = anno_poly.original_vertex_count
+            poly.deleted = anno_poly.deleted
+            poly.last_edit_time = now
+            tally.add_polygon(poly)
+            if poly.pk is None:
+                to_create.append((poly, changed))
+            else:
+                to_update.append((poly, changed))
+
+        # write all the changes with a few big statements instead of one per
+        # polygon
+        if len(to_create) > 0:
+            models.Polygon.objects.bulk_create([p for p, _ in to_create])
+        if len(to_update) > 0:
+            models.Polygon.objects.bulk_update([p for p, _ in to_update],
+                ("label", "notes", "occluded", "points",
+                    "original_vertex_count", "deleted", "last_edit_time"))
+        if len(to_create) > 0 or len(to_update) > 0:
+            history.record(to_create+to_update, request.user, now)
+            annotation.last_edit_time = now
+            annotation.version += 1
+            annotation.lease = lease
+            annotation.save(update_fields=('last_edit_time', 'version',
+                'lease'))
+            # last, since it locks rows other submissions need too
+            tally.save()
+
+        metrics.annotation_phase_seconds.observe(
+            time.perf_counter()-phase_start, "apply")
+
+
+# parse the document, which is XML unless the tool sent JSON. the request
+# can't be, by default, bigger than 2.5MiB, so it shouldn't consume too much
+# memory.
+def parse_annotation(request):
+    request.l_document_size = len(request.body)
+    with profiling.maybe_profile(request, "submit"):
+        _parse_annotation(request)
+
+def _parse_annotation(request):
+    fmt = "json" if json_format.is_json(request) else "xml"
+    try:
+        with metrics.timer(metrics.annotation_phase_seconds, "parse"):
+            doc = _read_annotation(request, fmt)
+        process_annotation(request, doc)
+    except SuspiciousOperation:
+        raise
+    except Exception as e:
+        raise SuspiciousOperation(fmt+" process failed") from e
+
+def _read_annotation(request, fmt):
     try:
         # empirically, the request seems to be utf8
-        xml = defusedxml.ElementTree.fromstring(request.body.decode("utf8"),
-            forbid_dtd=True, forbid_entities=True, forbid_external=True)
+        body = request.body.decode("utf8")
+        if fmt == "json":
+            data = json.loads(body)
+        else:
+            # the options given to parse prevent expansion attacks and external
+            # sourcing garbage.
+            data = defusedxml.ElementTree.fromstring(body, forbid_dtd=True,
+                forbid_entities=True, forbid_external=True)
     except Exception as e:
-        raise SuspiciousOperation("xml parse failed") from e
+        raise SuspiciousOperation(fmt+" parse failed") from e
+
+    if fmt == "json":
+        return json_format.read_annotation_json(data)
+    else:
+        return read_annotation_xml(data)
+
+# since the data was posted by XHR, we are expected to reply with SOME kind
+# of XML (or JSON, if that's what was sent). what that is doesn't matter.
+# eventually it will be quasi-related to any error so the tool can take
+# appropriate action.
+def submit_response(request):
+    if json_format.is_json(request):
+        return JsonResponse({})
+    return HttpResponse("<nop/>", content_type="text/xml")
 
+# process a submitted annotation, counting and logging it if it's rejected.
+# shared with the async view, which runs it in a thread.
+def accept_annotation(request):
     try:
-        process_annotation_xml(request, xml)
-    except SuspiciousOperation:
+        parse_annotation(request)
+    except SuspiciousOperation as e:
+        # the messages are all short constant strings, so they make good
+        # metric labels
+        metrics.annotations_rejected.inc(str(e))
+        logger.warning("rejected annotation from %s", request.user,
+            exc_info=True)
         raise
-    except Exception as e:
-        raise SuspiciousOperation("xml process failed") from e
+    except Exception:
+        metrics.annotations_rejected.inc("error")
+        raise
+    db_router.pin_to_primary(request.user)
 
 # DANGER!!!! CSRF should be used to prevent forged annotations from being
 # uploaded. but that would require hacking labelme to properly transmit the
 # token. apparently django stores it in a cookie so this could be done later.
 @csrf_exempt
 def post_annotation_xml(request):
-    try:
-        parse_annotation_xml(request)
-    except Exception:
-        import traceback
-        traceback.print_exc()
-        raise
-
-    # since the data was posted by XHR, we are expected to reply with SOME kind
-    # of XML. what that is doesn't matter. eventually it will be quasi-related
-    # to any error so the tool can take appropriate action.
-    return HttpResponse("<nop/>", content_type="text/xml")
+    accept_annotation(request)
+    return submit_response(request)
 
-# return the next annotation based on the image given in the request
-def next_annotation(request):
-    filename = request.GET["image"]
+# get the ID of the image the tool is currently showing out of the filename it
+# sends in the "image" query parameter
+def image_id_from_query(request):
     try:
+        filename = request.GET["image"]
         if not filename.startswith("img") or not filename.endswith(".jpg"):
             raise Exception("invalid filename {}".format(filename))
-        image_id = int(filename[3:-4])
+        return int(filename[3:-4])
     except Exception as e:
         raise SuspiciousOperation("bad query") from e
-    
+
+# return the next annotation based on the image given in the request
+@db_router.replica_reads
+def next_annotation(request):
+    image_id = image_id_from_query(request)
+
     # search for the next annotation: one whose image has a bigger primary key
     # than the given image. an arbitrary but consistent ordering.
     try:
@@ -434,15 +764,10 @@ def next_annotation(request):
         content_type="text/xml")
 
 # return the previous annotation based on the image given in the request
+@db_router.replica_reads
 def prev_annotation(request):
-    filename = request.GET["image"]
-    try:
-        if not filename.startswith("img") or not filename.endswith(".jpg"):
-            raise Exception("invalid filename {}".format(filename))
-        image_id = int(filename[3:-4])
-    except Exception as e:
-        raise SuspiciousOperation("bad query") from e
-    
+    image_id = image_id_from_query(request)
+
     # search for the previous annotation: one whose image has a smaller primary
     # key than the given image. an arbitrary but consistent ordering.
     try:
@@ -461,13 +786,16 @@ def prev_annotation(request):
         content_type="text/xml")
 
 # show all the annotations the user has
+@db_router.replica_reads
 def annotation_list(request):
     # this should be done with the templating engine but we are cowboys rn
 #     out = ["<html><head><title>My Annotations</title></head><body>"
 #         "<h1>My Annotations</h1>"]
 
+    # the polygon counts come from the statistics tables
     the_annotations = models.Annotation.objects.order_by('pk').filter(
-        annotator=request.user, deleted=False)
+        annotator=request.user, deleted=False).annotate(
+            polygon_count=Coalesce("stats__polygons", 0))
 
 #     for anno in the_annotations:
 #         link = ("label/#collection=LabelMe&mode=f&folder=f"
@@ -477,12 +805,32 @@ def annotation_list(request):
 #             "<div style='display:inline-block; margin-top:10px; width:25%;'>"
 #             "<img src='label/Images/f/img{}.jpg' style='width:100%;'>"
 #             "</div></a><br>".format(link, anno.image.pk))
-     
-     the_annotations = [{"href": ("label/#collection=LabelMe&mode=f&folder=f"
-                                 "&image=img{}.jpg&username=hi&actions=a".format(anno.image.pk))
-                         "imgHref": "label/Images/f/img{}.jpg".format(anno.image.pk)}
-                         for anno in the_annotations]
-
-     out = render_to_string("my_annotation.html", {"image_urls": anno})
-     
-     return HttpResponse(out)
+
+    image_urls = [{"href": ("label/#collection=LabelMe&mode=f&folder=f"
+                            "&image=img{}.jpg&username=hi&actions=a".format(
+                                anno.image_id)),
+                   "imgHref": image_mgr.views.signed_image_url(anno.image_id),
+                   "polygons": anno.polygon_count}
+                  for anno in the_annotations]
+
+    totals = models.UserStats.objects.filter(user=request.user).first()
+
+    out = render_to_string("registration/my_annotation.html", {
+        "image_urls": image_urls,
+        "total_polygons": 0 if totals is None else totals.polygons,
+        "total_vertices": 0 if totals is None else totals.vertices})
+
+    return HttpResponse(out)
+
+# suggest labels for the label box. takes the text typed so far as "q" and
+# returns the most used labels that start with it.
+@db_router.replica_reads
+def label_autocomplete(request):
+    prefix = request.GET.get("q", "")
+    try:
+        limit = int(request.GET.get("limit", 10))
+    except ValueError as e:
+        raise SuspiciousOperation("bad query") from e
+    limit = max(0, min(limit, 50))
+
+    return JsonResponse({"labels": labels.autocomplete(prefix, limit)})
@@ -0,0 +1,108 @@
+# send reads that can tolerate being slightly out of date to read replicas, so
+# the primary database only has to deal with writes and the reads that can't.
+
+# nothing goes to a replica unless it's explicitly allowed: views that only
+# read are decorated with replica_reads, and views that mix reads and writes
+# can ask read_alias for where to send particular queries. only our own apps'
+# models are ever read from a replica; sessions and users always come from the
+# primary, since a session that hasn't replicated yet would log people out.
+
+# replicas lag behind the primary a little. so a user sees their own changes,
+# everything they read is sent to the primary for L_REPLICA_STICKY_SECONDS
+# after they submit an annotation. this is tracked in the default cache, which
+# must be shared between processes (memcached, redis, ...) for it to work
+# across them. label_app/checks.py makes sure it is.
+
+from django.conf import settings
+from django.core.cache import cache
+
+import asyncio
+import contextvars
+import functools
+import random
+import time
+
+_REPLICA_APPS = ("label_app", "image_mgr")
+
+# the replica the current request reads from, if it's allowed to. it's picked
+# once per request so all of the request's reads see the same (possibly old)
+# state; two replicas can be behind by different amounts.
+_replica = contextvars.ContextVar("labelous_replica", default=None)
+
+def replica_alias():
+    if len(settings.L_READ_REPLICAS) == 0:
+        return "default"
+    return random.choice(settings.L_READ_REPLICAS)
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replica = _replica.get()
+        if replica is not None and model._meta.app_label in _REPLICA_APPS:
+            return replica
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas have the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
+
+# return True if the current request's reads may be going to a replica. what
+# they read may be behind the primary, so it mustn't be cached where it would
+# be taken as current.
+def reading_replica():
+    replica = _replica.get()
+    return replica is not None and replica != "default"
+
+def _pin_key(user):
+    return "labelous_db_pin:{}".format(user.pk)
+
+# make sure the user reads their own writes for a while
+def pin_to_primary(user):
+    sticky = settings.L_REPLICA_STICKY_SECONDS
+    cache.set(_pin_key(user), time.time()+sticky, sticky)
+
+def _is_pinned(request):
+    if len(settings.L_READ_REPLICAS) == 0:
+        return True
+    user = request.user
+    if not user.is_authenticated:
+        return False
+    pinned_until = cache.get(_pin_key(user))
+    return pinned_until is not None and pinned_until > time.time()
+
+# return the database alias queries made on behalf of the request should read
+# from, if reading slightly old data is acceptable
+def read_alias(request):
+    return "default" if _is_pinned(request) else replica_alias()
+
+# decorate a view that only reads, so its queries go to a replica when that's
+# safe. works on sync and async views.
+def replica_reads(view):
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            # the user has already been loaded by async_login_required
+            if _is_pinned(request):
+                return await view(request, *args, **kwargs)
+            token = _replica.set(replica_alias())
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _replica.reset(token)
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if _is_pinned(request):
+            return view(request, *args, **kwargs)
+        token = _replica.set(replica_alias())
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _replica.reset(token)
+    return wrapper
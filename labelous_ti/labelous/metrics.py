@@ -0,0 +1,141 @@
+# collect performance metrics and export them in the Prometheus text format.
+# everything is kept in memory, so each server process has its own set;
+# Prometheus should scrape every process (or they can be summed by whatever
+# is scraping them).
+
+# recording a value is a lock plus a bisect, so it's cheap enough to do many
+# times per request.
+
+from django.http import HttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+_registry = []
+
+class _Metric:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+        # label values tuple -> the value(s) for those labels
+        self.values = {}
+        _registry.append(self)
+
+    def _label_str(self, label_values, extra=""):
+        parts = ['{}="{}"'.format(k, _escape(v))
+            for k, v in zip(self.labels, label_values)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace(
+        "\n", "\\n")
+
+class Counter(_Metric):
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0)+amount
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} counter".format(self.name)]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append("{}{} {}".format(self.name,
+                    self._label_str(label_values), value))
+        return lines
+
+class Histogram(_Metric):
+    def __init__(self, name, help, labels, buckets):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            try:
+                counts, total = self.values[label_values]
+            except KeyError:
+                # the last count is for values above the biggest bucket
+                counts, total = [0]*(len(self.buckets)+1), 0
+            counts[i] += 1
+            self.values[label_values] = (counts, total+value)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} histogram".format(self.name)]
+        with self.lock:
+            items = sorted((k, (list(c), t)) for k, (c, t) in
+                self.values.items())
+        for label_values, (counts, total) in items:
+            # prometheus buckets are cumulative
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(self.name,
+                    self._label_str(label_values, 'le="{}"'.format(bound)),
+                    cumulative))
+            cumulative += counts[-1]
+            lines.append("{}_bucket{} {}".format(self.name,
+                self._label_str(label_values, 'le="+Inf"'), cumulative))
+            lines.append("{}_sum{} {}".format(self.name,
+                self._label_str(label_values), total))
+            lines.append("{}_count{} {}".format(self.name,
+                self._label_str(label_values), cumulative))
+        return lines
+
+# record how long the body of the with statement takes in the histogram
+@contextmanager
+def timer(histogram, *label_values):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter()-start, *label_values)
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+    2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 10000)
+SIZE_BUCKETS = (1000, 10000, 100000, 250000, 500000, 1000000, 2500000)
+
+request_seconds = Histogram("labelous_request_seconds",
+    "Time taken to handle a request.", ("view",), TIME_BUCKETS)
+request_queries = Histogram("labelous_request_queries",
+    "Database queries made while handling a request.", ("view",),
+    COUNT_BUCKETS)
+request_query_seconds = Histogram("labelous_request_query_seconds",
+    "Time spent in the database while handling a request.", ("view",),
+    TIME_BUCKETS)
+
+annotation_phase_seconds = Histogram("labelous_annotation_phase_seconds",
+    "Time taken by each phase of processing a submitted annotation.",
+    ("phase",), TIME_BUCKETS)
+annotation_payload_bytes = Histogram("labelous_annotation_payload_bytes",
+    "Size of annotation documents.", ("direction",), SIZE_BUCKETS)
+annotation_polygons = Histogram("labelous_annotation_polygons",
+    "Number of polygons in annotation documents.", ("direction",),
+    COUNT_BUCKETS)
+annotation_vertices = Histogram("labelous_annotation_vertices",
+    "Number of vertices in annotation documents.", ("direction",),
+    COUNT_BUCKETS)
+polygons_changed = Counter("labelous_polygons_changed_total",
+    "Polygons written by annotation submissions.", ())
+annotations_rejected = Counter("labelous_annotations_rejected_total",
+    "Annotation submissions that were rejected.", ("reason",))
+
+# expose all the metrics for prometheus. only for admins, since it tells you a
+# lot about what everybody is doing.
+@staff_member_required
+def metrics_view(request):
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    lines.append("")
+    return HttpResponse("\n".join(lines),
+        content_type="text/plain; version=0.0.4; charset=utf-8")
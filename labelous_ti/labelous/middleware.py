@@ -0,0 +1,93 @@
+# measure every request: how long it took, and how many database queries it
+# made and how long they took. the results go into the histograms in
+# metrics.py, labeled by which view handled the request. if
+# L_QUERY_COUNT_HEADER is on, the query count is also reported in the
+# X-Labelous-Queries response header so benchmarks (bench/loadtest.py) can see
+# it without access to the server.
+
+# it works on both sync and async requests, so under ASGI the async views don't
+# get pushed into a thread just to pass through it.
+
+from django.conf import settings
+from django.db import connections
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+import time
+
+from . import metrics
+
+# count the queries made (on any database) while it's active, and how long
+# they took
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.query_time = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.query_time += time.perf_counter()-start
+
+    def start(self):
+        self.wrappers = [conn.execute_wrapper(self)
+            for conn in connections.all()]
+        for wrapper in self.wrappers:
+            wrapper.__enter__()
+
+    def stop(self):
+        for wrapper in reversed(self.wrappers):
+            wrapper.__exit__(None, None, None)
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        counter = _QueryCounter()
+        start = time.perf_counter()
+        counter.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            counter.stop()
+        return self.record(request, response, counter,
+            time.perf_counter()-start)
+
+    async def __acall__(self, request):
+        # the async ORM runs queries in a thread, but with our context, so it
+        # uses the same connection objects we wrap here
+        counter = _QueryCounter()
+        start = time.perf_counter()
+        counter.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            counter.stop()
+        return self.record(request, response, counter,
+            time.perf_counter()-start)
+
+    def record(self, request, response, counter, elapsed):
+        # label by the view's dotted path (or url name, if it has one). using
+        # the path itself would give every image its own histogram.
+        if request.resolver_match is not None:
+            view = request.resolver_match.view_name
+        else:
+            view = "unresolved"
+        metrics.request_seconds.observe(elapsed, view)
+        metrics.request_queries.observe(counter.count, view)
+        metrics.request_query_seconds.observe(counter.query_time, view)
+
+        if settings.L_QUERY_COUNT_HEADER:
+            response["X-Labelous-Queries"] = str(counter.count)
+        return response
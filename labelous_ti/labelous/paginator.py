@@ -0,0 +1,45 @@
+# a paginator for the admin that doesn't count every row. on a table with tens
+# of millions of rows, the exact COUNT(*) the normal paginator runs for every
+# changelist page takes longer than the rest of the page put together. instead
+# we ask postgres how many rows it thinks there are, which it knows instantly.
+# small results are still counted exactly, since that's cheap and the page
+# numbers matter more there.
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+import json
+
+# below this many (estimated) rows, just count them
+EXACT_COUNT_LIMIT = 10000
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = queryset.query
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return super().count
+
+        with connection.cursor() as cursor:
+            if not query.where:
+                # the whole table. the statistics keep an estimate of its size
+                cursor.execute("SELECT reltuples FROM pg_class "
+                    "WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+                estimate = int(row[0]) if row is not None else -1
+            else:
+                # ask the planner how many rows it expects the filter to match
+                sql, params = query.sql_with_params()
+                cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                estimate = int(plan[0]["Plan"]["Plan Rows"])
+
+        # reltuples is -1 if the table has never been analyzed
+        if estimate < EXACT_COUNT_LIMIT:
+            return super().count
+        return estimate
@@ -0,0 +1,87 @@
+# profile a fraction of the annotation fetches and submissions, or the ones
+# that turn out slow, so we can find out why a particular annotation is slow.
+# profiles are saved with cProfile to L_PROFILE_DIR, named after what was being
+# done, the annotation and the size of its document. the profiles management
+# command lists and aggregates them. only the newest L_PROFILE_MAX_FILES are
+# kept.
+
+# profiling is off unless L_PROFILE_SAMPLE_RATE or L_PROFILE_SLOW_SECONDS are
+# set. a profiled request runs maybe twice as slow, and with
+# L_PROFILE_SLOW_SECONDS set every request has to be profiled, since we can't
+# know beforehand which ones will be slow. so only use that while hunting.
+# only one request per process is profiled at a time (see _profiling); the
+# others that overlap it aren't profiled at all.
+
+from django.conf import settings
+
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# kind-anno<id>-<size>b-<ms>ms-<unix time>-<pid>.prof
+PROFILE_NAME_RE = re.compile(r"^(?P<kind>[a-z_]+)-anno(?P<anno>[0-9]+|none)-"
+    r"(?P<size>[0-9]+)b-(?P<ms>[0-9]+)ms-(?P<time>[0-9]+)-[0-9]+\.prof$")
+
+# held while a profile is running. only one can run at a time: async requests
+# share the event loop's thread, so two profiles there would clobber each
+# other, and from python 3.12 cProfile can't run twice in one process at all
+# (the second enable raises ValueError).
+_profiling = threading.Lock()
+
+# profile the body of the with statement if this request is chosen. the code
+# being profiled should set request.l_annotation_id and
+# request.l_document_size once it knows them so the profile can be found later.
+@contextmanager
+def maybe_profile(request, kind):
+    sampled = random.random() < settings.L_PROFILE_SAMPLE_RATE
+    slow_seconds = settings.L_PROFILE_SLOW_SECONDS
+    # if another request is being profiled, this one just isn't
+    if (not sampled and slow_seconds is None) or \
+            not _profiling.acquire(blocking=False):
+        yield
+        return
+
+    try:
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter()-start
+            if sampled or elapsed >= slow_seconds:
+                _save(profiler, request, kind, elapsed)
+    finally:
+        _profiling.release()
+
+def _save(profiler, request, kind, elapsed):
+    anno_id = getattr(request, "l_annotation_id", None)
+    name = "{}-anno{}-{}b-{}ms-{}-{}.prof".format(kind,
+        "none" if anno_id is None else anno_id,
+        getattr(request, "l_document_size", 0), int(elapsed*1000),
+        int(time.time()), os.getpid())
+    profile_dir = settings.L_PROFILE_DIR
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(str(profile_dir/name))
+    _prune(profile_dir)
+
+# delete the oldest profiles until there are no more than L_PROFILE_MAX_FILES
+def _prune(profile_dir):
+    paths = []
+    for path in profile_dir.glob("*.prof"):
+        try:
+            paths.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            # another process pruned it first
+            pass
+    paths.sort()
+    for _, path in paths[:max(0, len(paths)-settings.L_PROFILE_MAX_FILES)]:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
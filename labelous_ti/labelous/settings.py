@@ -59,6 +59,15 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# collect per-view latency and query metrics (exported at /metrics for admins).
+# the overhead is a few microseconds per request and query.
+L_METRICS = True
+if L_METRICS:
+    MIDDLEWARE.insert(0, 'labelous.middleware.MetricsMiddleware')
+# also report how many queries each request made in a response header. the
+# load test harness (bench/loadtest.py) reads it. requires L_METRICS.
+L_QUERY_COUNT_HEADER = False
+
 ROOT_URLCONF = 'labelous.urls'
 
 TEMPLATES = [
@@ -93,6 +102,30 @@ DATABASES = {
     }
 }
 
+# read replicas of the default database, as aliases in DATABASES. views that
+# can read slightly stale data send their queries to them (see db_router.py).
+# bench/local_replica.sh sets one up locally, which can be added like:
+#
+# DATABASES['replica1'] = dict(DATABASES['default'], PORT=5433)
+# L_READ_REPLICAS = ['replica1']
+L_READ_REPLICAS = []
+# after a user submits an annotation, how many seconds all their reads go to
+# the primary, so they don't see stale data from a replica that's behind
+L_REPLICA_STICKY_SECONDS = 30
+
+DATABASE_ROUTERS = ['labelous.db_router.ReplicaRouter']
+
+# edit leases (see label_app/views.py) and read replica pins (see db_router.py)
+# live in the default cache, so every process serving requests has to share
+# it. django's default cache is private to each process, so a system check
+# (label_app/checks.py) refuses it. needs the redis package.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -138,3 +171,66 @@ STATIC_URL = '/static/'
 import pathlib
 L_IMAGE_PATH = pathlib.Path(
     "/Users/thomaswatson/projects/labelous/test_images").resolve(strict=True)
+
+# how many seconds the in-memory label autocomplete index is used before it's
+# rebuilt from the database
+L_LABEL_INDEX_TTL = 60
+
+# use the async versions of the tool's annotation and image views. only useful
+# when running under an ASGI server (e.g. uvicorn labelous.asgi:application),
+# and requires Django 4.2 or newer.
+L_ASYNC_VIEWS = False
+
+# how many seconds signed image URLs are valid for, at minimum. they may stay
+# valid for up to twice this long.
+L_SIGNED_URL_LIFETIME = 60*60
+
+# profile this fraction of annotation fetches and submissions with cProfile
+L_PROFILE_SAMPLE_RATE = 0
+# also keep the profile of any that take at least this many seconds. None to
+# disable. this profiles every request, so it slows everything down!
+L_PROFILE_SLOW_SECONDS = None
+# where the profiles are saved. see the profiles management command.
+L_PROFILE_DIR = pathlib.Path(BASE_DIR)/"profiles"
+# how many profiles are kept there. the oldest are deleted to make room.
+L_PROFILE_MAX_FILES = 1000
+
+# where the compact_deleted command writes the rows it removes
+L_ARCHIVE_PATH = pathlib.Path(BASE_DIR)/"archive"
+
+# simplify submitted polygons so that no removed vertex is more than this many
+# pixels from the result, unless their label says otherwise. None to keep every
+# vertex.
+L_SIMPLIFY_TOLERANCE = None
+
+# where transcoded copies of images are cached, and how many bytes they may
+# take up in total
+L_TRANSCODE_CACHE_PATH = pathlib.Path(BASE_DIR)/"transcode_cache"
+L_TRANSCODE_CACHE_SIZE = 2*1024*1024*1024
+# quality to transcode each format with
+L_TRANSCODE_QUALITY = {"AVIF": 60, "WEBP": 80, "JPEG": 85}
+
+# when an image is served, get the next and previous this many images in the
+# user's loop ready in the background (see label_app/prefetch.py). 0 to turn
+# it off.
+L_PREFETCH_COUNT = 2
+# the most warmings that may be waiting at once. more are dropped.
+L_PREFETCH_QUEUE_SIZE = 32
+# how many of them the browser is told to preload
+L_PRELOAD_COUNT = 1
+# how many seconds prefetched annotation documents and users' loops are cached
+L_PREFETCH_TTL = 5*60
+
+# how many seconds an annotation's edit lease is remembered after it's handed
+# out (see "edit leases" in label_app/views.py). tools kept open longer still
+# work, but only the first of several tabs to submit afterwards is accepted.
+L_LEASE_SECONDS = 24*60*60
+
+# the most annotations (or IDs asked for) the batch annotation view returns per
+# request, and how many it gets from the database at a time
+L_BATCH_LIMIT = 500
+L_BATCH_CHUNK = 100
+
+# how many seconds a reviewer's claim on an annotation lasts before it goes
+# back in the review queue (see label_app/review_views.py)
+L_REVIEW_CLAIM_SECONDS = 30*60
@@ -18,9 +18,11 @@ from django.urls import include, path
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.decorators import login_required
 from label_app.views import annotation_list
+from labelous.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view),
     path('label/', include('label_app.urls')),
     path('accounts/login/', auth_views.LoginView.as_view(), name="login"),
     path('accounts/logout/', auth_views.LogoutView.as_view(), name="logout"),